@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for the receipt pipeline: a local OpenAI-compatible stub
+server, a synthetic receipt generator and a load harness. Run with
+`python -m benchmarks.run`; see the Benchmarks section of the README.
+"""
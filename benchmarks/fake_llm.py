@@ -0,0 +1,250 @@
+import argparse, json, random, re, threading, time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# One canned answer serves every prompt: the classifier reads receipt_or_not,
+# extraction reads the top-level fields and analyze reads `receipt`.
+CANNED_RECEIPT = {
+    'merchant_name': 'Benchmark Market',
+    'total_amount': 23.5,
+    'currency': 'USD',
+    'payment_method': 'Credit Card',
+    'category': 'Groceries',
+    'purchased_at': '2025-01-31T12:00:00Z',
+    'line_items': [
+        {'description': 'Coffee beans', 'quantity': 1, 'unit_price': 12.5, 'total': 12.5},
+        {'description': 'Oat milk', 'quantity': 2, 'unit_price': 5.5, 'total': 11.0},
+    ],
+}
+CANNED_RESPONSE = {'receipt_or_not': 'yes', **CANNED_RECEIPT, 'receipt': CANNED_RECEIPT}
+
+# Rough usage figures, so token counters and the rate limiter see realistic numbers
+IMAGE_TOKENS = 258
+COMPLETION_TOKENS = 150
+
+def parse_multipart(content_type, data):
+    """Form fields of a multipart/form-data body: name -> (filename, bytes)."""
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + data
+    )
+    return {
+        part.get_param('name', header='content-disposition'): (part.get_filename(), part.get_payload(decode=True))
+        for part in message.iter_parts()
+    }
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """
+    Minimal OpenAI-compatible `POST /v1/chat/completions`, plus the batch API
+    (`/v1/files` upload and content, `/v1/batches` create, retrieve and
+    cancel). The server's latency, jitter and content attributes control every
+    response; batches complete `batch_latency` seconds after they are created.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = self.path.rstrip('/')
+        if path.endswith('/files'):
+            fields = parse_multipart(self.headers['Content-Type'], data)
+            filename, content = fields['file']
+            purpose = fields.get('purpose', (None, b''))[1].decode()
+            return self.send_json(200, self.server.add_file(filename, content, purpose))
+        body = json.loads(data or b'{}')
+        if path.endswith('/batches'):
+            return self.send_json(200, self.server.create_batch(body))
+        match = re.search(r'/batches/([^/]+)/cancel$', path)
+        if match:
+            return self.send_batch(match.group(1), cancel=True)
+        if not path.endswith('/chat/completions'):
+            return self.send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+        self.server.count_request()
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            return self.send_json(429, {'error': {'message': 'Rate limit reached'}}, {'Retry-After': '0.1'})
+        delay = self.server.latency + random.uniform(-self.server.jitter, self.server.jitter)
+        time.sleep(max(0.0, delay))
+        self.send_json(200, self.completion(body))
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        match = re.search(r'/files/([^/]+)/content$', path)
+        if match and match.group(1) in self.server.files:
+            return self.send_bytes(200, self.server.files[match.group(1)]['content'], 'application/octet-stream')
+        match = re.search(r'/batches/([^/]+)$', path)
+        if match:
+            return self.send_batch(match.group(1))
+        self.send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+    def send_batch(self, batch_id, cancel=False):
+        batch = self.server.get_batch(batch_id, self, cancel)
+        if batch is None:
+            return self.send_json(404, {'error': {'message': f'No batch {batch_id}'}})
+        self.send_json(200, batch)
+
+    def completion(self, body):
+        prompt_tokens = 0
+        for message in body.get('messages', []):
+            content = message.get('content')
+            parts = content if isinstance(content, list) else [{'type': 'text', 'text': content or ''}]
+            for part in parts:
+                prompt_tokens += IMAGE_TOKENS if part.get('type') == 'image_url' else len(part.get('text', '')) // 4
+        return {
+            'id': f'chatcmpl-{random.getrandbits(64):x}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model') or 'fake',
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': json.dumps(self.server.content)},
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': COMPLETION_TOKENS,
+                'total_tokens': prompt_tokens + COMPLETION_TOKENS,
+            },
+        }
+
+    def send_json(self, status_code, payload, headers=None):
+        self.send_bytes(status_code, json.dumps(payload).encode(), 'application/json', headers)
+
+    def send_bytes(self, status_code, data, content_type, headers=None):
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.5, jitter=0.1, error_rate=0.0, content=None,
+                 batch_latency=1.0):
+        super().__init__(address, FakeLLMHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.content = CANNED_RESPONSE if content is None else content
+        self.batch_latency = batch_latency
+        self.requests = 0
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def add_file(self, filename, content, purpose):
+        file_object = {
+            'id': f'file-{random.getrandbits(64):x}',
+            'object': 'file',
+            'bytes': len(content),
+            'created_at': int(time.time()),
+            'filename': filename or 'upload.jsonl',
+            'purpose': purpose,
+            'status': 'processed',
+        }
+        with self.lock:
+            self.files[file_object['id']] = {**file_object, 'content': content}
+        return file_object
+
+    def create_batch(self, body):
+        input_file = self.files.get(body.get('input_file_id'))
+        lines = input_file['content'].decode().splitlines() if input_file else []
+        batch = {
+            'id': f'batch_{random.getrandbits(64):x}',
+            'object': 'batch',
+            'endpoint': body.get('endpoint'),
+            'input_file_id': body.get('input_file_id'),
+            'completion_window': body.get('completion_window'),
+            'status': 'in_progress' if input_file else 'failed',
+            'output_file_id': None,
+            'error_file_id': None,
+            'created_at': int(time.time()),
+            'metadata': body.get('metadata'),
+            'request_counts': {'total': len([line for line in lines if line.strip()]), 'completed': 0, 'failed': 0},
+        }
+        with self.lock:
+            self.batches[batch['id']] = batch
+        return batch
+
+    def get_batch(self, batch_id, handler, cancel=False):
+        """Return a batch, running it to completion once batch_latency has passed."""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None or batch['status'] != 'in_progress':
+                return batch
+            if cancel:
+                batch['status'] = 'cancelled'
+                return batch
+            if time.time() - batch['created_at'] < self.batch_latency:
+                return batch
+            batch['status'] = 'finalizing'
+            content = self.files[batch['input_file_id']]['content']
+        outputs, errors = [], []
+        for line in content.decode().splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            self.count_request()
+            result = {'id': f'batch_req_{random.getrandbits(64):x}', 'custom_id': request['custom_id'], 'error': None}
+            if self.error_rate and random.random() < self.error_rate:
+                result['response'] = {'status_code': 429, 'body': {'error': {'message': 'Rate limit reached'}}}
+                errors.append(result)
+            else:
+                result['response'] = {'status_code': 200, 'body': handler.completion(request['body'])}
+                outputs.append(result)
+        file_ids = {}
+        for name, results in (('output_file_id', outputs), ('error_file_id', errors)):
+            if results:
+                data = ''.join(json.dumps(result) + '\n' for result in results).encode()
+                file_ids[name] = self.add_file(f'{batch_id}_{name}.jsonl', data, 'batch_output')['id']
+        with self.lock:
+            batch.update(file_ids)
+            batch['request_counts'].update(completed=len(outputs), failed=len(errors))
+            batch['status'] = 'completed'
+            batch['completed_at'] = int(time.time())
+        return batch
+
+def start_server(**kwargs):
+    """Start a FakeLLMServer on a background thread and return it."""
+    server = FakeLLMServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve canned chat completions for benchmarks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help='Seconds per completion')
+    parser.add_argument('--jitter', type=float, default=0.1, help='Uniform +/- seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 429')
+    parser.add_argument('--response', help='JSON file with the content to return instead of the canned receipt')
+    parser.add_argument('--batch-latency', type=float, default=1.0, help='Seconds until a submitted batch completes')
+    args = parser.parse_args()
+
+    content = None
+    if args.response:
+        with open(args.response) as f:
+            content = json.load(f)
+    server = FakeLLMServer((args.host, args.port), args.latency, args.jitter, args.error_rate, content,
+                           args.batch_latency)
+    print(f'Fake LLM listening on {server.base_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
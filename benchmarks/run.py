@@ -0,0 +1,300 @@
+import argparse, json, math, os, platform, subprocess, sys, tempfile, threading, time, uuid
+import urllib.error, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks import fake_llm, synthetic
+
+SCENARIOS = ('upload', 'validate', 'process', 'list')
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(sorted_values, q):
+    """Linearly interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def summarize(scenario, concurrency, samples, wall_time, stages=None):
+    """
+    Reduce (latency seconds, status code) samples to one result row.
+
+    Returns:
+        dict: Throughput, error count and latency percentiles in milliseconds.
+    """
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    errors = sum(1 for _, status_code in samples if status_code >= 400)
+    result = {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / wall_time, 3) if wall_time else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'max_ms': round(latencies[-1], 3) if latencies else None,
+    }
+    for q in (50, 95, 99):
+        value = percentile(latencies, q)
+        result[f'p{q}_ms'] = round(value, 3) if value is not None else None
+    if stages is not None:
+        result['stage_mean_ms'] = stages
+    return result
+
+def encode_multipart(field, path):
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as f:
+        content = f.read()
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{os.path.basename(path)}"\r\n'.encode(),
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        content,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+class Client:
+    """Tiny urllib client; returns (status code, decoded JSON or None)."""
+
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, content_type=None):
+        request = urllib.request.Request(f'{self.base_url}{path}', data=body, method=method)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status_code, data = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status_code, data = e.code, e.read()
+        try:
+            return status_code, json.loads(data)
+        except ValueError:
+            return status_code, None
+
+    def upload(self, path):
+        body, content_type = encode_multipart('file', path)
+        return self.request('POST', '/upload', body, content_type)
+
+def timed(call):
+    start = time.perf_counter()
+    try:
+        status_code, data = call()
+    except Exception as e:
+        status_code, data = 599, {'error': str(e)}
+    return time.perf_counter() - start, status_code, data
+
+def run_calls(calls, concurrency):
+    """
+    Run the calls with `concurrency` in flight.
+
+    Returns:
+        tuple: ([(latency, status code, data)] in call order, wall time in seconds)
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(timed, calls))
+    return outcomes, time.perf_counter() - start
+
+def stage_means(before, after):
+    """Mean milliseconds per pipeline stage between two STAGE_DURATION snapshots."""
+    means = {}
+    for key, (total, count) in after.items():
+        previous_total, previous_count = before.get(key, (0, 0))
+        if count > previous_count:
+            means[key[0]] = round((total - previous_total) / (count - previous_count) * 1000, 3)
+    return means
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=PROJECT_ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{revision}-dirty' if dirty else revision
+
+def setup_django(workdir, llm_base_url):
+    """
+    Point the app at a throwaway workspace (database, uploads, render cache,
+    rate-limit state) and the fake LLM, then migrate a fresh database.
+    """
+    os.chdir(workdir)
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{os.path.join(workdir, "benchmark.db")}',
+        'RECEIPT_STORAGE_ROOT': os.path.join(workdir, 'uploads'),
+        'OPENAI_BASE_URL': llm_base_url,
+        'OPENAI_API_KEY': 'benchmark',
+        'LLM_MODEL': 'benchmark',
+    })
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'receipt_project.settings')
+    os.environ.setdefault('DJANGO_SECURITY_KEY', 'benchmark')
+    os.environ.setdefault('METRICS_LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, PROJECT_ROOT)
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+def serve_django():
+    """Serve the WSGI app on a threaded local server and return its base URL."""
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+    server.daemon_threads = True
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+def run_level(client, concurrency, files, scenarios, in_process, write):
+    """Upload `files`, then validate, process and list them at one concurrency level."""
+    stage_snapshot = None
+    if in_process:
+        from receipts import metrics
+        stage_snapshot = metrics.STAGE_DURATION.totals
+
+    results = []
+
+    def measure(scenario, calls):
+        before = stage_snapshot() if stage_snapshot else None
+        outcomes, wall_time = run_calls(calls, concurrency)
+        stages = stage_means(before, stage_snapshot()) if stage_snapshot else None
+        if scenario in scenarios:
+            result = summarize(scenario, concurrency, [(latency, status_code) for latency, status_code, _ in outcomes], wall_time, stages)
+            write(f'{scenario:>9} c={concurrency:<3} {result["throughput_rps"]:>8} req/s  '
+                  f'p50 {result["p50_ms"]:>9} ms  p95 {result["p95_ms"]:>9} ms  p99 {result["p99_ms"]:>9} ms  '
+                  f'errors {result["errors"]}')
+            results.append(result)
+        return outcomes
+
+    # Upload and validate also run when not measured, since process needs valid receipts
+    outcomes = measure('upload', [lambda path=path: client.upload(path) for path in files])
+    ids = [data['id'] for _, status_code, data in outcomes if status_code == 201 and data]
+    if 'validate' in scenarios or 'process' in scenarios:
+        measure('validate', [lambda i=i: client.request('GET', f'/validate/{i}') for i in ids])
+    if 'process' in scenarios:
+        measure('process', [lambda i=i: client.request('GET', f'/process/{i}?duplicate_strategy=reprocess') for i in ids])
+    if 'list' in scenarios:
+        measure('list', [lambda: client.request('GET', '/receipts?limit=100')] * len(files))
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Compare errors, p95 latency and throughput against a previous results file.
+
+    Returns:
+        list: One message per scenario/concurrency pair that got worse by more than tolerance.
+    """
+    previous = {(row['scenario'], row['concurrency']): row for row in baseline.get('results', [])}
+    regressions = []
+    for row in results:
+        base = previous.get((row['scenario'], row['concurrency']))
+        if not base:
+            continue
+        label = f'{row["scenario"]} c={row["concurrency"]}'
+        if row['errors'] > base.get('errors', 0):
+            regressions.append(f'{label}: errors {base.get("errors", 0)} -> {row["errors"]}')
+        if base.get('p95_ms') and row['p95_ms'] and row['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{label}: p95 {base["p95_ms"]} -> {row["p95_ms"]} ms')
+        if base.get('throughput_rps') and row['throughput_rps'] and row['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            regressions.append(f'{label}: throughput {base["throughput_rps"]} -> {row["throughput_rps"]} req/s')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark upload, validate, process and list against a fake LLM.')
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per scenario and level')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per fake LLM completion')
+    parser.add_argument('--llm-jitter', type=float, default=0.1)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help='Share of LLM calls answered with 429')
+    parser.add_argument('--pages', default=','.join(map(str, synthetic.PAGE_COUNTS)), help='Page counts to mix')
+    parser.add_argument('--dpi', default=','.join(map(str, synthetic.RESOLUTIONS)), help='Resolutions to mix')
+    parser.add_argument('--formats', default=','.join(synthetic.FORMATS), help='Formats to mix')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', help='Benchmark a running server instead of an in-process one; '
+                                      'point its OPENAI_BASE_URL at `python -m benchmarks.fake_llm`')
+    parser.add_argument('--workdir', help='Workspace for the database, uploads and corpus (default: a temp dir)')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='Previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative slowdown before failing')
+    args = parser.parse_args()
+
+    levels = [int(value) for value in args.concurrency.split(',')]
+    scenarios = [value for value in args.scenarios.split(',') if value]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='receipt-benchmark-'))
+    os.makedirs(workdir, exist_ok=True)
+
+    llm_server = None
+    if args.url:
+        base_url = args.url
+    else:
+        llm_server = fake_llm.start_server(latency=args.llm_latency, jitter=args.llm_jitter, error_rate=args.llm_error_rate)
+        setup_django(workdir, llm_server.base_url)
+        base_url = serve_django()
+    client = Client(base_url)
+    print(f'Benchmarking {base_url} (workspace {workdir})')
+
+    results = []
+    for index, concurrency in enumerate(levels):
+        # Fresh content per level, so uploads are never rejected as duplicates
+        files = synthetic.generate_corpus(
+            os.path.join(workdir, 'corpus', f'c{concurrency}'), args.requests,
+            start=args.seed * 1000000 + index * args.requests,
+            page_counts=[int(value) for value in args.pages.split(',')],
+            resolutions=[int(value) for value in args.dpi.split(',')],
+            formats=args.formats.split(','),
+            seed=args.seed + index,
+        )
+        results.extend(run_level(client, concurrency, files, scenarios, llm_server is not None, print))
+
+    report = {
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'concurrency': levels,
+            'requests': args.requests,
+            'llm_latency': args.llm_latency,
+            'llm_jitter': args.llm_jitter,
+            'llm_error_rate': args.llm_error_rate,
+            'pages': args.pages,
+            'dpi': args.dpi,
+            'formats': args.formats,
+            'seed': args.seed,
+            'url': args.url,
+        },
+        'llm_requests': llm_server.requests if llm_server else None,
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {output}')
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.tolerance:.0%} against {baseline_path}')
+
+if __name__ == '__main__':
+    main()
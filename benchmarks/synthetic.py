@@ -0,0 +1,154 @@
+import argparse, os, random
+
+from PIL import Image, ImageDraw, ImageFont
+
+PAGE_SIZE_INCHES = (8.5, 11)
+PAGE_COUNTS = (1, 2, 5)
+RESOLUTIONS = (100, 150, 300)
+# 'textpdf' is a digital PDF with an embedded text layer instead of page images
+FORMATS = ('pdf', 'pdf', 'textpdf', 'jpg', 'png')
+
+MERCHANTS = ('Corner Grocery', 'Blue Bottle Cafe', 'Hardware Depot', 'City Pharmacy', 'Grand Hotel')
+ITEMS = ('Coffee', 'Bagel', 'Batteries', 'Toothpaste', 'Room night', 'Parking', 'Sandwich', 'Notebook', 'Taxi', 'Water')
+
+def receipt_lines(serial, rng, num_items):
+    """Text of one synthetic receipt; `serial` makes every document's content unique."""
+    lines = [rng.choice(MERCHANTS), f'Receipt #{serial:08d}', f'2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:{rng.randint(0, 59):02d}', '']
+    total = 0
+    for _ in range(num_items):
+        quantity = rng.randint(1, 3)
+        unit_price = rng.randint(100, 5000) / 100
+        total += quantity * unit_price
+        lines.append(f'{quantity} x {rng.choice(ITEMS):<20} {quantity * unit_price:>10.2f}')
+    lines += ['', f'{"TOTAL":<25} {total:>10.2f}', 'Paid by Credit Card', 'Thank you!']
+    return lines
+
+def render_page(lines, dpi, page_number, num_pages):
+    width, height = (int(inches * dpi) for inches in PAGE_SIZE_INCHES)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=max(10, dpi // 7))
+    line_height = max(12, dpi // 5)
+    y = dpi // 2
+    for line in lines:
+        draw.text((dpi // 2, y), line, fill='black', font=font)
+        y += line_height
+    draw.text((dpi // 2, height - dpi // 2), f'Page {page_number} of {num_pages}', fill='black', font=font)
+    return image
+
+def escape_pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def write_text_pdf(path, pages_lines):
+    """Write a minimal PDF whose pages carry the lines as real text (Helvetica), like an e-receipt."""
+    width, height = (int(inches * 72) for inches in PAGE_SIZE_INCHES)
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        3: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    }
+    kids = []
+    for index, lines in enumerate(pages_lines):
+        page_id, content_id = 4 + 2 * index, 5 + 2 * index
+        operators = ['BT', '/F1 11 Tf', '14 TL', f'54 {height - 54} Td']
+        operators += [f'({escape_pdf_text(line)}) Tj T*' for line in lines]
+        operators.append('ET')
+        stream = '\n'.join(operators).encode('latin-1')
+        objects[content_id] = b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream'
+        objects[page_id] = (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode()
+        kids.append(f'{page_id} 0 R')
+    objects[2] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'.encode()
+
+    output = bytearray(b'%PDF-1.4\n')
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b'%d 0 obj\n' % object_id + objects[object_id] + b'\nendobj\n'
+    xref_offset = len(output)
+    size = max(objects) + 1
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % size
+    for object_id in range(1, size):
+        output += b'%010d 00000 n \n' % offsets[object_id]
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size, xref_offset)
+    with open(path, 'wb') as f:
+        f.write(output)
+
+def make_receipt(path, serial, pages=1, dpi=150, seed=None, text_layer=False):
+    """
+    Write a synthetic receipt to path. PDFs get `pages` pages (the receipt on
+    the first, filler line items after it); images always have one page.
+    text_layer=True writes a digital PDF with embedded text instead of images.
+
+    Returns:
+        str: The path written.
+    """
+    rng = random.Random(serial if seed is None else seed)
+    fmt = os.path.splitext(path)[1].lower().lstrip('.')
+    if fmt != 'pdf':
+        pages = 1
+    pages_lines = [receipt_lines(serial, rng, rng.randint(3, 25))]
+    pages_lines += [receipt_lines(serial, rng, 40)[4:-4] for _ in range(2, pages + 1)]
+    if fmt == 'pdf' and text_layer:
+        write_text_pdf(path, pages_lines)
+        return path
+    images = [render_page(lines, dpi, page_number, pages) for page_number, lines in enumerate(pages_lines, 1)]
+    if fmt == 'pdf':
+        images[0].save(path, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+    elif fmt in ('jpg', 'jpeg'):
+        images[0].save(path, 'JPEG', quality=85)
+    else:
+        images[0].save(path, fmt.upper())
+    return path
+
+def generate_corpus(directory, count, start=0, page_counts=PAGE_COUNTS, resolutions=RESOLUTIONS, formats=FORMATS, seed=0):
+    """
+    Write `count` receipts with a mix of page counts, resolutions and formats.
+
+    Args:
+        directory: Output directory, created if missing.
+        count: Number of documents.
+        start: First serial number; use distinct ranges to get distinct content.
+        seed: Seed for the mix of shapes, so a corpus can be reproduced.
+
+    Returns:
+        list: Paths of the generated files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for serial in range(start, start + count):
+        fmt = rng.choice(formats)
+        pages, dpi = rng.choice(page_counts), rng.choice(resolutions)
+        if fmt not in ('pdf', 'textpdf'):
+            pages = 1
+        if fmt == 'textpdf':
+            path = os.path.join(directory, f'receipt-{serial:06d}-{pages}p-text.pdf')
+        else:
+            path = os.path.join(directory, f'receipt-{serial:06d}-{pages}p-{dpi}dpi.{fmt}')
+        paths.append(make_receipt(path, serial, pages, dpi, text_layer=fmt == 'textpdf'))
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic receipt PDFs and images.')
+    parser.add_argument('directory')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--pages', default=','.join(map(str, PAGE_COUNTS)), help='Comma-separated page counts to mix')
+    parser.add_argument('--dpi', default=','.join(map(str, RESOLUTIONS)), help='Comma-separated resolutions to mix')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='Comma-separated formats to mix (pdf, textpdf, jpg, png)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_corpus(
+        args.directory, args.count, args.start,
+        page_counts=[int(value) for value in args.pages.split(',')],
+        resolutions=[int(value) for value in args.dpi.split(',')],
+        formats=args.formats.split(','),
+        seed=args.seed,
+    )
+    print(f'Wrote {len(paths)} files to {args.directory}')
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class ReceiptsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'receipts'
+
+    def ready(self):
+        from receipts.db import configure_sqlite, instrument_connection
+        connection_created.connect(configure_sqlite, dispatch_uid='receipts.configure_sqlite')
+        connection_created.connect(instrument_connection, dispatch_uid='receipts.instrument_connection')
@@ -0,0 +1,358 @@
+import json, os, time
+
+from django.conf import settings
+
+from receipts.models import ReceiptMetaData, Receipt
+from receipts.prompts import RECEIPT_EXTRACT_PROMPT, RECEIPT_EXTRACT_TEXT_PROMPT
+from receipts import services, utils, llm_cache, metrics
+from receipts.reprocess import iter_ids
+
+# Bulk extraction through the provider's batch API (upload a JSONL file of
+# chat completion requests, create a batch, poll it, download the results).
+# Batches are billed at a discount and have their own limits, so they bypass
+# the LLM_RPM/LLM_TPM buckets used by synchronous calls.
+LLM_BATCH_ENDPOINT = os.getenv('LLM_BATCH_ENDPOINT', '/v1/chat/completions')
+LLM_BATCH_COMPLETION_WINDOW = os.getenv('LLM_BATCH_COMPLETION_WINDOW', '24h')
+LLM_BATCH_POLL_INTERVAL = float(os.getenv('LLM_BATCH_POLL_INTERVAL', 60))
+# OpenAI accepts up to 50,000 requests and 200 MB per input file
+LLM_BATCH_MAX_REQUESTS = int(os.getenv('LLM_BATCH_MAX_REQUESTS', 50000))
+LLM_BATCH_MAX_BYTES = int(os.getenv('LLM_BATCH_MAX_BYTES', 200 * 1024 * 1024))
+BATCH_SAVE_SIZE = 100
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+def custom_id(receipt_meta_id):
+    return f'receipt-{receipt_meta_id}'
+
+def parse_custom_id(value):
+    return int(value.rsplit('-', 1)[1])
+
+def build_request(receipt_meta, page_numbers=None, page_texts=None):
+    """
+    Build the batch input line for one receipt with the same messages a
+    synchronous /process call would send: page_texts (see
+    utils.text_layer_pages) when given, otherwise the rendered pages.
+    """
+    if page_texts:
+        messages = utils.prepare_text_prompt(RECEIPT_EXTRACT_TEXT_PROMPT, page_texts)
+    else:
+        pages = utils.pre_processing_data(receipt_meta.file_path, receipt_meta.file_hash, page_numbers=page_numbers)
+        messages = utils.prepare_prompt(RECEIPT_EXTRACT_PROMPT, pages)
+    return {
+        'custom_id': custom_id(receipt_meta.id),
+        'method': 'POST',
+        'url': LLM_BATCH_ENDPOINT,
+        'body': {
+            'model': os.getenv('LLM_MODEL'),
+            'messages': messages,
+            'response_format': {'type': 'json_object'},
+        },
+    }
+
+class BatchState:
+    """
+    Submitted batches and the receipts in each, saved to a JSON file so the
+    results can be collected by a later run after the submitting one exits.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.duplicate_strategy = 'return_existing'
+        self.batches = []
+        self.succeeded = 0
+        self.skipped = 0
+        self.failed = []
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        self.duplicate_strategy = state['duplicate_strategy']
+        self.batches = state['batches']
+        self.succeeded = state['succeeded']
+        self.skipped = state['skipped']
+        self.failed = state['failed']
+        return True
+
+    def save(self):
+        state = {
+            'duplicate_strategy': self.duplicate_strategy,
+            'batches': self.batches,
+            'succeeded': self.succeeded,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+    def pending(self):
+        """Batches whose results have not been saved yet."""
+        return [batch for batch in self.batches if not batch['applied']]
+
+    def fail(self, receipt_meta_id, error):
+        self.failed.append({'id': receipt_meta_id, 'error': error})
+
+class BatchWriter:
+    """
+    Write request lines to JSONL input files under `directory`, starting a new
+    file before LLM_BATCH_MAX_REQUESTS or LLM_BATCH_MAX_BYTES is exceeded.
+    """
+
+    def __init__(self, directory, max_requests=None, max_bytes=None):
+        self.directory = directory
+        self.max_requests = max_requests or LLM_BATCH_MAX_REQUESTS
+        self.max_bytes = max_bytes or LLM_BATCH_MAX_BYTES
+        self.files = []
+        self.current = None
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, request, cache_key):
+        """Append one request; raises ValueError if it alone exceeds max_bytes."""
+        line = (json.dumps(request) + '\n').encode()
+        if len(line) > self.max_bytes:
+            raise ValueError(f'Request is {len(line)} bytes, over the {self.max_bytes} byte batch file limit')
+        current = self.current
+        if current is None or len(current['requests']) >= self.max_requests or current['bytes'] + len(line) > self.max_bytes:
+            self.close()
+            path = os.path.join(self.directory, f'batch-{time.strftime("%Y%m%d-%H%M%S")}-{len(self.files):04d}.jsonl')
+            current = self.current = {'path': path, 'file': open(path, 'wb'), 'bytes': 0, 'requests': {}}
+        current['file'].write(line)
+        current['bytes'] += len(line)
+        current['requests'][request['custom_id']] = cache_key
+
+    def close(self):
+        if self.current is not None:
+            self.current['file'].close()
+            self.files.append({'path': self.current['path'], 'requests': self.current['requests']})
+            self.current = None
+        return self.files
+
+def write_batch_files(receipt_metas, state, directory, bypass_cache=False, max_pages=None, limit=None,
+                      save_cached=True, write=print):
+    """
+    Write the extraction prompts for receipt_metas into batch input files.
+    Receipts the duplicate strategy skips are left out, and receipts with a
+    cached response for the same prompt are saved right away instead (or
+    only counted, with save_cached=False).
+
+    Returns:
+        list: {'path', 'requests'} per written file, requests mapping
+        custom_id to the LLM cache key.
+    """
+    writer = BatchWriter(directory)
+    cached = []
+    try:
+        for receipt_meta_id in iter_ids(receipt_metas, limit=limit):
+            receipt_meta = ReceiptMetaData.objects.get(id=receipt_meta_id)
+            early_response = services.check_before_processing(receipt_meta, state.duplicate_strategy)
+            if early_response:
+                payload, status_code = early_response
+                if status_code < 400:
+                    state.skipped += 1
+                else:
+                    state.fail(receipt_meta.id, payload.get('error'))
+                continue
+            page_numbers, error_response = services.select_pages(receipt_meta, max_pages=max_pages)
+            if error_response:
+                state.fail(receipt_meta.id, error_response[0]['error'])
+                continue
+            try:
+                page_texts = utils.text_layer_pages(receipt_meta.file_path, page_numbers)
+                prompt = RECEIPT_EXTRACT_TEXT_PROMPT if page_texts else RECEIPT_EXTRACT_PROMPT
+                cache_key = llm_cache.make_key(receipt_meta.file_hash, prompt, page_numbers=page_numbers)
+                response = None
+                if settings.LLM_CACHE_ENABLED and receipt_meta.file_hash and not bypass_cache:
+                    response = llm_cache.get(cache_key)
+                    llm_cache.count('hits' if response is not None else 'misses')
+                if response is not None:
+                    cached.append((receipt_meta, response))
+                else:
+                    writer.add(build_request(receipt_meta, page_numbers, page_texts), cache_key)
+            except Exception as e:
+                state.fail(receipt_meta.id, f'Could not build the request: {e}')
+    finally:
+        files = writer.close()
+    if cached and save_cached:
+        save_results(cached, state, os.getenv('LLM_MODEL'))
+        write(f'Saved {len(cached)} receipts from cached responses')
+    elif cached:
+        write(f'{len(cached)} receipts have cached responses and were left out')
+    return files
+
+def submit_batch_file(client, path, description=None):
+    """
+    Upload one input file and create a batch for it.
+
+    Returns:
+        Batch: The created batch.
+    """
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+    return client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=LLM_BATCH_ENDPOINT,
+        completion_window=LLM_BATCH_COMPLETION_WINDOW,
+        metadata={'description': description or os.path.basename(path)},
+    )
+
+def wait_for_batch(client, batch_id, poll_interval=None, write=print):
+    """Poll a batch until it reaches a terminal status, printing its progress."""
+    poll_interval = LLM_BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        counts = batch.request_counts
+        done = f'{counts.completed + counts.failed}/{counts.total}' if counts else '?'
+        write(f'Batch {batch_id} {batch.status}: {done} requests done')
+        time.sleep(poll_interval)
+
+def read_output_lines(client, file_id):
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+def parse_result(line):
+    """
+    Extract the model output from one output or error file line.
+
+    Returns:
+        tuple: (content string or None, error message or None)
+    """
+    response = line.get('response') or {}
+    body = response.get('body') or {}
+    if line.get('error'):
+        error = line['error']
+        return None, error.get('message') if isinstance(error, dict) else str(error)
+    if response.get('status_code') != 200:
+        error = body.get('error') or {}
+        return None, error.get('message') or f'HTTP {response.get("status_code")}'
+    try:
+        return body['choices'][0]['message']['content'], None
+    except (KeyError, IndexError, TypeError):
+        return None, 'Response has no message content'
+
+def record_batch_usage(line):
+    """Add the tokens reported for one batch result to the token counters."""
+    usage = ((line.get('response') or {}).get('body') or {}).get('usage') or {}
+    for kind in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+        metrics.LLM_TOKENS.inc(usage.get(kind) or 0, kind=kind.removesuffix('_tokens'))
+
+def save_results(results, state, model_name=None):
+    """
+    Parse model outputs and persist them with save_extracted_batch, in
+    transactions of BATCH_SAVE_SIZE receipts. Outputs that are not valid
+    receipt data are recorded as failed in `state`, like the sync path.
+
+    Args:
+        results: List of (receipt_meta, content string) pairs.
+        model_name: The LLM model the requests were sent to.
+
+    Returns:
+        int: Number of receipts saved.
+    """
+    parsed = []
+    for receipt_meta, content in results:
+        try:
+            with metrics.stage('parse'):
+                extracted_data = json.loads(content)
+        except ValueError as e:
+            state.fail(receipt_meta.id, f'Extraction failed: {e}')
+            continue
+        if not extracted_data:
+            state.fail(receipt_meta.id, 'No data extracted from receipt.')
+            continue
+        extracted_data, error_response = services.validate_extracted_data(extracted_data)
+        if error_response:
+            payload, _ = error_response
+            error = payload['error']
+            state.fail(receipt_meta.id, f'{error}: {json.dumps(payload["fields"])}' if 'fields' in payload else error)
+            continue
+        parsed.append((receipt_meta, extracted_data))
+    for start in range(0, len(parsed), BATCH_SAVE_SIZE):
+        services.save_extracted_batch(parsed[start:start + BATCH_SAVE_SIZE], model_name)
+    state.succeeded += len(parsed)
+    return len(parsed)
+
+def collect_batch(client, batch_state, state, write=print):
+    """
+    Download the results of a finished batch and save them. Requests missing
+    from both the output and error files (expired or cancelled batches) are
+    recorded as failed.
+    """
+    batch = client.batches.retrieve(batch_state['id'])
+    batch_state['status'] = batch.status
+    requests = batch_state['requests']
+    lines = read_output_lines(client, batch.output_file_id) + read_output_lines(client, batch.error_file_id)
+    contents = {}
+    for line in lines:
+        if line.get('custom_id') not in requests:
+            continue
+        content, error = parse_result(line)
+        metrics.LLM_REQUESTS.inc(outcome='batch' if error is None else 'batch_error')
+        record_batch_usage(line)
+        if error is None:
+            contents[line['custom_id']] = content
+        else:
+            state.fail(parse_custom_id(line['custom_id']), error)
+    for missing in set(requests) - {line.get('custom_id') for line in lines}:
+        state.fail(parse_custom_id(missing), f'No result, batch {batch.status}')
+
+    receipt_metas = ReceiptMetaData.objects.in_bulk([parse_custom_id(key) for key in contents])
+    if state.duplicate_strategy == 'return_existing':
+        # Receipts processed by other callers while the batch ran are kept as they are
+        processed = set(Receipt.objects.filter(receipt_file__in=list(receipt_metas)).values_list('receipt_file_id', flat=True))
+    else:
+        processed = set()
+    results = []
+    skipped = 0
+    for key, content in contents.items():
+        receipt_meta = receipt_metas.get(parse_custom_id(key))
+        if receipt_meta is None:
+            continue
+        if settings.LLM_CACHE_ENABLED and receipt_meta.file_hash:
+            llm_cache.put(requests[key], receipt_meta.file_hash, content)
+        if receipt_meta.id in processed:
+            skipped += 1
+        else:
+            results.append((receipt_meta, content))
+    saved = save_results(results, state, batch_state.get('model'))
+    state.skipped += skipped
+    batch_state['applied'] = True
+    state.save()
+    write(f'Batch {batch.id} {batch.status}: {saved} receipts saved, {skipped} already processed, '
+          f'{len(requests) - saved - skipped} failed')
+
+def run_batches(client, receipt_metas, state, directory, bypass_cache=False, max_pages=None, limit=None,
+                wait=True, poll_interval=None, dry_run=False, write=print):
+    """
+    Submit a batch extraction over receipt_metas and, with wait=True, poll
+    every batch and save its results. Batches still outstanding in `state`
+    (from a run that did not wait) are collected instead of submitting new ones.
+
+    Returns:
+        BatchState: The final state of the run.
+    """
+    if not state.pending():
+        files = write_batch_files(receipt_metas, state, directory, bypass_cache, max_pages, limit,
+                                  save_cached=not dry_run, write=write)
+        for batch_file in files:
+            if dry_run:
+                write(f'Wrote {len(batch_file["requests"])} requests to {batch_file["path"]}')
+                continue
+            batch = submit_batch_file(client, batch_file['path'])
+            state.batches.append({'id': batch.id, 'status': batch.status, 'applied': False,
+                                  'model': os.getenv('LLM_MODEL'), 'requests': batch_file['requests']})
+            state.save()
+            os.remove(batch_file['path'])
+            write(f'Submitted batch {batch.id} with {len(batch_file["requests"])} requests')
+        state.save()
+    if dry_run or not wait:
+        return state
+    for batch_state in state.pending():
+        wait_for_batch(client, batch_state['id'], poll_interval, write)
+        collect_batch(client, batch_state, state, write)
+    return state
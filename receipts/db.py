@@ -0,0 +1,20 @@
+from django.conf import settings
+
+from receipts import metrics
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    connection_created handler that applies settings.SQLITE_PRAGMAS to every
+    new SQLite connection. WAL lets readers run alongside the single writer,
+    so web and worker processes stop blocking each other on reads.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created handler that counts every query into receipts.metrics."""
+    if metrics.count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.count_query)
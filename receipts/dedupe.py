@@ -0,0 +1,79 @@
+from itertools import combinations
+
+from django.conf import settings
+from django.db.models import Q
+
+from receipts.models import ReceiptMetaData, PHASH_BANDS, PHASH_BAND_BITS, phash_bands
+
+# Beyond this the band probes get too wide to be worth it
+MAX_SEARCH_DISTANCE = 12
+
+def hamming_distance(hash_a, hash_b):
+    return (int(hash_a, 16) ^ int(hash_b, 16)).bit_count()
+
+def is_detail_match(detail_hash, other):
+    return bool(other) and hamming_distance(detail_hash, other) <= settings.NEAR_DUPLICATE_MAX_DETAIL_DISTANCE
+
+def band_neighbours(band, radius):
+    """Every PHASH_BAND_BITS-bit value within `radius` bit flips of band."""
+    values = [band]
+    for flips in range(1, radius + 1):
+        for bits in combinations(range(PHASH_BAND_BITS), flips):
+            value = band
+            for bit in bits:
+                value ^= 1 << bit
+            values.append(value)
+    return values
+
+def duplicate_info(receipt_meta, distance=None):
+    info = {
+        'existing_id': receipt_meta.id,
+        'existing_file_name': receipt_meta.file_name,
+        'uploaded_at': receipt_meta.created_at.isoformat(),
+        'is_processed': receipt_meta.is_processed,
+        'is_valid': receipt_meta.is_valid
+    }
+    if distance is not None:
+        info['distance'] = distance
+    return info
+
+def find_near_duplicates(perceptual_hash, max_distance=None, exclude_id=None, limit=10, detail_hash=None):
+    """
+    Find receipts whose perceptual hash is within max_distance bits of
+    perceptual_hash, closest first.
+
+    Multi-index hashing: the hash is split into PHASH_BANDS bands, and any hash
+    within max_distance bits has at least one band within
+    max_distance // PHASH_BANDS bits of the query's. Candidates are fetched
+    with indexed IN lookups on the bands, then checked exactly.
+
+    The 64-bit pHash only captures a receipt's overall layout, so different
+    receipts from the same merchant often match. When detail_hash is given,
+    candidates are confirmed against their detail hash as well, and those
+    without one (not backfilled yet) are left out.
+
+    Returns:
+        list: (receipt meta, Hamming distance) pairs.
+    """
+    max_distance = settings.NEAR_DUPLICATE_MAX_DISTANCE if max_distance is None else max_distance
+    max_distance = max(0, min(max_distance, MAX_SEARCH_DISTANCE))
+    radius = max_distance // PHASH_BANDS
+    lookup = Q()
+    for i, band in enumerate(phash_bands(perceptual_hash)):
+        lookup |= Q(**{f'phash_band_{i}__in': band_neighbours(band, radius)})
+
+    candidates = ReceiptMetaData.objects.filter(lookup).only(
+        'id', 'file_name', 'perceptual_hash', 'detail_hash', 'created_at', 'is_processed', 'is_valid'
+    )
+    if exclude_id is not None:
+        candidates = candidates.exclude(id=exclude_id)
+    matches = []
+    for receipt_meta in candidates:
+        distance = hamming_distance(perceptual_hash, receipt_meta.perceptual_hash)
+        if distance > max_distance:
+            continue
+        if detail_hash and not is_detail_match(detail_hash, receipt_meta.detail_hash):
+            continue
+        matches.append((receipt_meta, distance))
+    matches.sort(key=lambda match: (match[1], match[0].id))
+    return matches[:limit]
@@ -0,0 +1,89 @@
+import csv, json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from receipts.models import Receipt
+
+RECEIPT_FIELDS = [
+    'id', 'receipt_meta_data', 'purchased_at', 'merchant_name', 'total_amount',
+    'currency', 'payment_method', 'category', 'updated_at',
+]
+LINE_ITEM_FIELDS = ['description', 'quantity', 'unit_price', 'total']
+CSV_HEADER = RECEIPT_FIELDS + [f'line_item_{field}' for field in LINE_ITEM_FIELDS]
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def parse_since(value):
+    """
+    Parse a `since` watermark. Naive values are taken in the current time zone.
+
+    Returns:
+        datetime or None: Aware datetime, or None if value is not a valid ISO 8601 datetime.
+    """
+    try:
+        since = parse_datetime(value)
+    except ValueError:
+        # Well-formed but out of range, e.g. 2025-13-01T00:00:00
+        return None
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+def export_queryset(since=None):
+    """
+    Receipts changed at or after `since`, oldest change first so the last row's
+    updated_at is the next watermark. Rows at the watermark itself are sent
+    again rather than risk skipping ones written in the same instant.
+    """
+    receipts = Receipt.objects.prefetch_related('line_items').order_by('updated_at', 'id')
+    if since is not None:
+        receipts = receipts.filter(updated_at__gte=since)
+    return receipts
+
+def isoformat(value):
+    # Full microsecond precision, so an exported updated_at works as a watermark
+    return value.isoformat() if value is not None else None
+
+def receipt_values(receipt):
+    return [
+        receipt.id, receipt.receipt_file_id, isoformat(receipt.purchased_at), receipt.merchant_name,
+        receipt.total_amount, receipt.currency, receipt.payment_method, receipt.category,
+        isoformat(receipt.updated_at),
+    ]
+
+def iter_ndjson(receipts, chunk_size=2000):
+    """Yield one JSON line per receipt with its line items nested."""
+    for receipt in receipts.iterator(chunk_size=chunk_size):
+        record = dict(zip(RECEIPT_FIELDS, receipt_values(receipt)))
+        record['line_items'] = [
+            {field: getattr(item, field) for field in LINE_ITEM_FIELDS}
+            for item in receipt.line_items.all()
+        ]
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+class Echo:
+    """File-like object whose write() just returns the line, for csv.writer."""
+    def write(self, value):
+        return value
+
+def iter_csv(receipts, chunk_size=2000):
+    """Yield CSV lines, one per line item (receipts without items get a single row)."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for receipt in receipts.iterator(chunk_size=chunk_size):
+        values = receipt_values(receipt)
+        items = list(receipt.line_items.all())
+        if not items:
+            yield writer.writerow(values + [None] * len(LINE_ITEM_FIELDS))
+        for item in items:
+            yield writer.writerow(values + [getattr(item, field) for field in LINE_ITEM_FIELDS])
+
+def iter_export(export_format, since=None, chunk_size=2000):
+    receipts = export_queryset(since)
+    if export_format == 'csv':
+        return iter_csv(receipts, chunk_size)
+    return iter_ndjson(receipts, chunk_size)
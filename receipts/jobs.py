@@ -0,0 +1,123 @@
+import os, socket, time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+
+from receipts.models import ReceiptJob
+from receipts import services, metrics
+
+JOB_HANDLERS = {
+    'validate': lambda job: services.validate_receipt(
+        job.receipt_meta, bypass_cache=job.params.get('bypass_cache', False),
+        page_range=job.params.get('page_range'), max_pages=job.params.get('max_pages')
+    ),
+    'process': lambda job: services.process_receipt(
+        job.receipt_meta, job.params.get('duplicate_strategy', 'return_existing'),
+        bypass_cache=job.params.get('bypass_cache', False),
+        page_range=job.params.get('page_range'), max_pages=job.params.get('max_pages')
+    ),
+    'analyze': lambda job: services.analyze_receipt(
+        job.receipt_meta, job.params.get('duplicate_strategy', 'return_existing'),
+        bypass_cache=job.params.get('bypass_cache', False),
+        page_range=job.params.get('page_range'), max_pages=job.params.get('max_pages')
+    ),
+}
+
+def enqueue_job(job_type, receipt_meta, **params):
+    """Queue a validate/process job for a receipt and return it."""
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job type: {job_type}')
+    return ReceiptJob.objects.create(job_type=job_type, receipt_meta=receipt_meta, params=params)
+
+def default_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def claim_next_job(worker_name=None):
+    """
+    Atomically move the oldest queued job to 'running'.
+
+    The conditional UPDATE is the lock: only one worker can flip a row out of
+    'queued', so several processes can poll the same table safely.
+
+    Returns:
+        ReceiptJob or None if the queue is empty.
+    """
+    worker_name = worker_name or default_worker_name()
+    while True:
+        job_id = (ReceiptJob.objects.filter(status='queued')
+                  .order_by('id').values_list('id', flat=True).first())
+        if job_id is None:
+            return None
+        claimed = ReceiptJob.objects.filter(id=job_id, status='queued').update(
+            status='running',
+            worker=worker_name,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return ReceiptJob.objects.select_related('receipt_meta').get(id=job_id)
+        # Another worker won the race, try the next one
+
+def run_job(job):
+    """Execute a claimed job and store its result."""
+    start = time.perf_counter()
+    with metrics.trace(job_id=job.id, job_type=job.job_type) as data:
+        job = execute_job(job)
+    duration = time.perf_counter() - start
+    metrics.JOB_DURATION.observe(duration, job_type=job.job_type, status=job.status)
+    metrics.log_trace('job', {**data, 'status': job.status, 'duration_ms': round(duration * 1000, 3)})
+    return job
+
+def execute_job(job):
+    try:
+        payload, status_code = JOB_HANDLERS[job.job_type](job)
+    except Exception as e:
+        if job.attempts < settings.RECEIPT_JOB_MAX_ATTEMPTS:
+            job.status = 'queued'
+            job.error = str(e)
+            job.save(update_fields=['status', 'error'])
+            return job
+        payload, status_code = {'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+    job.result = payload
+    job.status_code = status_code
+    job.status = 'succeeded' if status_code < 400 else 'failed'
+    job.error = payload.get('error') if isinstance(payload, dict) else None
+    job.finished_at = timezone.now()
+    job.save(update_fields=['result', 'status_code', 'status', 'error', 'finished_at'])
+    return job
+
+def requeue_stale_jobs(stale_after=None):
+    """Put back jobs whose worker died while running them."""
+    stale_after = stale_after or settings.RECEIPT_JOB_STALE_AFTER
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = ReceiptJob.objects.filter(status='running', started_at__lt=cutoff)
+    stale.filter(attempts__gte=settings.RECEIPT_JOB_MAX_ATTEMPTS).update(
+        status='failed', error='Job timed out', finished_at=timezone.now()
+    )
+    return stale.update(status='queued')
+
+def work(worker_name=None, poll_interval=None, once=False):
+    """
+    Drain the job queue until interrupted.
+
+    Args:
+        worker_name: Identifier stored on claimed jobs.
+        poll_interval: Seconds to sleep when the queue is empty.
+        once: Return as soon as the queue is empty instead of polling.
+    """
+    worker_name = worker_name or default_worker_name()
+    poll_interval = settings.RECEIPT_JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    while True:
+        close_old_connections()
+        job = claim_next_job(worker_name)
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
@@ -0,0 +1,128 @@
+import hashlib, json, os, threading, time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Count, Sum
+from django.utils import timezone
+
+from receipts.models import LLMResponseCache
+from receipts import utils, metrics
+
+# Per-process counters; persisted per-entry hit counts live on LLMResponseCache.hits
+_stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+_stats_lock = threading.Lock()
+_last_evicted = None
+_evict_lock = threading.Lock()
+
+def count(name):
+    metrics.LLM_CACHE.inc(result=name)
+    with _stats_lock:
+        _stats[name] += 1
+
+def make_key(file_hash, prompt, profile=None, page_numbers=None):
+    """Cache key for (file content, prompt text, LLM_MODEL, render profile, page selection)."""
+    prompt_digest = hashlib.sha256(prompt.encode()).hexdigest()
+    key_data = [file_hash, prompt_digest, os.getenv('LLM_MODEL'), utils.get_encoding_profile(profile)]
+    if page_numbers is not None:
+        key_data.append(list(page_numbers))
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+def get(key):
+    cutoff = timezone.now() - timedelta(seconds=settings.LLM_CACHE_TTL)
+    entry = LLMResponseCache.objects.filter(key=key, created_at__gte=cutoff).only('id', 'response').first()
+    if entry is None:
+        return None
+    LLMResponseCache.objects.filter(id=entry.id).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    return entry.response
+
+def put(key, file_hash, response):
+    now = timezone.now()
+    LLMResponseCache.objects.update_or_create(
+        key=key,
+        defaults={'file_hash': file_hash, 'model_name': os.getenv('LLM_MODEL'), 'response': response,
+                  'created_at': now, 'last_used_at': now},
+    )
+    maybe_evict()
+
+def maybe_evict():
+    """
+    Run evict() if this process hasn't in the last LLM_CACHE_EVICT_INTERVAL
+    seconds, instead of paying for a count and a delete on every put. The
+    table can run over LLM_CACHE_MAX_ENTRIES by one interval's worth of puts.
+    """
+    global _last_evicted
+    with _evict_lock:
+        now = time.monotonic()
+        if _last_evicted is not None and now - _last_evicted < settings.LLM_CACHE_EVICT_INTERVAL:
+            return
+        _last_evicted = now
+    evict()
+
+def evict():
+    """Drop expired entries, then the least recently used ones beyond LLM_CACHE_MAX_ENTRIES."""
+    cutoff = timezone.now() - timedelta(seconds=settings.LLM_CACHE_TTL)
+    LLMResponseCache.objects.filter(created_at__lt=cutoff).delete()
+    excess = LLMResponseCache.objects.count() - settings.LLM_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = LLMResponseCache.objects.order_by('last_used_at').values_list('id', flat=True)[:excess]
+        LLMResponseCache.objects.filter(id__in=list(oldest)).delete()
+
+def cached_llm_call(file_hash, prompt, call, profile=None, bypass=False, page_numbers=None):
+    """
+    Return the cached response for this file/prompt/model/profile, or run
+    `call` and cache its result. Error results are never cached.
+
+    Args:
+        file_hash: SHA-256 of the file content.
+        prompt: The prompt text sent with the page images.
+        call: Zero-argument callable that performs the LLM request.
+        profile: Render profile used for the page images.
+        page_numbers: Pages sent to the model, if not the whole document.
+        bypass: Skip the lookup and always call the model (the fresh result is still stored).
+    """
+    if not settings.LLM_CACHE_ENABLED or not file_hash:
+        return call()
+    key = make_key(file_hash, prompt, profile, page_numbers)
+    if bypass:
+        count('bypassed')
+    else:
+        response = get(key)
+        if response is not None:
+            count('hits')
+            return response
+        count('misses')
+    response = call()
+    if isinstance(response, str):
+        put(key, file_hash, response)
+    return response
+
+def stats():
+    totals = LLMResponseCache.objects.aggregate(entries=Count('id'), stored_hits=Sum('hits'))
+    with _stats_lock:
+        process_stats = dict(_stats)
+    return {
+        'entries': totals['entries'],
+        'stored_hits': totals['stored_hits'] or 0,
+        'process': process_stats,
+        'max_entries': settings.LLM_CACHE_MAX_ENTRIES,
+        'ttl_seconds': settings.LLM_CACHE_TTL,
+    }
+
+async def acached_llm_call(file_hash, prompt, acall, profile=None, bypass=False, page_numbers=None):
+    """Async variant of cached_llm_call; `acall` is a zero-argument coroutine function."""
+    if not settings.LLM_CACHE_ENABLED or not file_hash:
+        return await acall()
+    key = make_key(file_hash, prompt, profile, page_numbers)
+    if bypass:
+        count('bypassed')
+    else:
+        response = await sync_to_async(get)(key)
+        if response is not None:
+            count('hits')
+            return response
+        count('misses')
+    response = await acall()
+    if isinstance(response, str):
+        await sync_to_async(put)(key, file_hash, response)
+    return response
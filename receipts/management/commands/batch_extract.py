@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from receipts import batch, reprocess, utils
+from receipts.management.commands.reprocess_receipts import parse_bool
+
+class Command(BaseCommand):
+    help = ("Extract many receipts through the provider's batch API: write the prompts to JSONL batch "
+            'files, submit them, poll until they finish and save the results.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only receipts uploaded at or after this ISO 8601 datetime.')
+        parser.add_argument('--until', help='Only receipts uploaded before this ISO 8601 datetime.')
+        parser.add_argument('--is-valid', type=parse_bool, default=True,
+                            help='Filter on is_valid (default: true; invalid receipts are never extracted).')
+        parser.add_argument('--is-processed', type=parse_bool, help='Filter on is_processed (true/false).')
+        parser.add_argument('--model', help='Only receipts with a cached response from this LLM model.')
+        parser.add_argument('--limit', type=int, help='Stop after this many receipts.')
+        parser.add_argument('--duplicate-strategy', choices=['return_existing', 'reprocess'], default='return_existing',
+                            help='return_existing leaves already processed receipts alone; reprocess replaces them.')
+        parser.add_argument('--max-pages', type=int, help='Pages sent per PDF (default: PDF_MAX_PAGES).')
+        parser.add_argument('--bypass-cache', action='store_true',
+                            help='Submit receipts that have a cached LLM response for the current prompt and model.')
+        parser.add_argument('--directory', default='llm_batches', help='Where batch input files are written.')
+        parser.add_argument('--state', default='llm_batch_state.json',
+                            help='File the submitted batches are saved to and collected from.')
+        parser.add_argument('--no-wait', action='store_true',
+                            help='Submit and exit; run the command again later to collect the results.')
+        parser.add_argument('--poll-interval', type=float, default=batch.LLM_BATCH_POLL_INTERVAL,
+                            help='Seconds between batch status checks.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Write the batch input files and stop without submitting them.')
+
+    def handle(self, *args, **options):
+        for name in ('since', 'until'):
+            if options[name] and parse_datetime(options[name]) is None:
+                raise CommandError(f'--{name} must be an ISO 8601 datetime')
+
+        state = batch.BatchState(options['state'])
+        if state.load() and state.pending():
+            self.stdout.write(f'Collecting {len(state.pending())} submitted batches from {options["state"]}; '
+                              'no new receipts are submitted in this run')
+        else:
+            state = batch.BatchState(options['state'])
+            state.duplicate_strategy = options['duplicate_strategy']
+
+        receipt_metas = reprocess.filter_receipt_metas(
+            since=parse_datetime(options['since']) if options['since'] else None,
+            until=parse_datetime(options['until']) if options['until'] else None,
+            is_valid=options['is_valid'], is_processed=options['is_processed'], model=options['model'],
+        )
+        state = batch.run_batches(
+            utils.get_openai_client(), receipt_metas, state, options['directory'],
+            bypass_cache=options['bypass_cache'], max_pages=options['max_pages'], limit=options['limit'],
+            wait=not options['no_wait'], poll_interval=options['poll_interval'], dry_run=options['dry_run'],
+            write=self.stdout.write,
+        )
+        if state.pending() or options['dry_run']:
+            self.stdout.write(f'{len(state.pending())} batches outstanding (see {options["state"]})')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Finished: {state.succeeded} succeeded, {state.skipped} skipped, {len(state.failed)} failed '
+            f'(see {options["state"]})'
+        ))
@@ -0,0 +1,42 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from receipts.models import ReceiptMetaData
+from receipts import utils
+
+class Command(BaseCommand):
+    help = 'Compute the first-page perceptual and detail hashes of receipts uploaded before near-duplicate detection existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows updated per bulk_update.')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute hashes that are already set.')
+
+    def handle(self, *args, **options):
+        receipt_metas = ReceiptMetaData.objects.only('id', 'file_name', 'file_path').order_by('id')
+        if not options['all']:
+            receipt_metas = receipt_metas.filter(Q(perceptual_hash__isnull=True) | Q(detail_hash__isnull=True))
+        fields = ['perceptual_hash', 'phash_band_0', 'phash_band_1', 'phash_band_2', 'phash_band_3', 'detail_hash']
+
+        batch, updated, skipped = [], 0, 0
+        for receipt_meta in receipt_metas.iterator(chunk_size=options['batch_size']):
+            if not receipt_meta.file_path or not os.path.exists(receipt_meta.file_path):
+                skipped += 1
+                continue
+            perceptual_hash, detail_hash = utils.file_image_hashes(receipt_meta.file_path)
+            if perceptual_hash is None:
+                skipped += 1
+                continue
+            receipt_meta.set_perceptual_hash(perceptual_hash, detail_hash)
+            batch.append(receipt_meta)
+            if len(batch) >= options['batch_size']:
+                ReceiptMetaData.objects.bulk_update(batch, fields)
+                updated += len(batch)
+                batch = []
+        if batch:
+            ReceiptMetaData.objects.bulk_update(batch, fields)
+            updated += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Hashed {updated} receipts, skipped {skipped}.'))
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from receipts import exports
+
+class Command(BaseCommand):
+    help = 'Stream receipts and their line items to NDJSON or CSV for the accounting warehouse.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(exports.EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--since', help='Only export receipts updated at or after this ISO 8601 watermark.')
+        parser.add_argument('--output', help='File to write to (default: stdout).')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows fetched from the database per round trip.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = exports.parse_since(options['since'])
+            if since is None:
+                raise CommandError('--since must be an ISO 8601 datetime')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be a positive integer')
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            for line in exports.iter_export(options['format'], since, options['chunk_size']):
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from receipts import reprocess
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+class Command(BaseCommand):
+    help = ('Re-run extraction over existing receipts, e.g. after a prompt or model change, '
+            'with bounded concurrency and a resumable checkpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only receipts uploaded at or after this ISO 8601 datetime.')
+        parser.add_argument('--until', help='Only receipts uploaded before this ISO 8601 datetime.')
+        parser.add_argument('--is-valid', type=parse_bool, help='Filter on is_valid (true/false).')
+        parser.add_argument('--is-processed', type=parse_bool, help='Filter on is_processed (true/false).')
+        parser.add_argument('--model', help='Only receipts whose current extraction came from this LLM model.')
+        parser.add_argument('--mode', choices=list(reprocess.REPROCESS_HANDLERS), default='process',
+                            help='process re-extracts valid receipts; analyze also re-classifies them.')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Receipts (and LLM calls) in flight at once.')
+        parser.add_argument('--limit', type=int, help='Stop after this many receipts.')
+        parser.add_argument('--bypass-cache', action='store_true',
+                            help='Ignore cached LLM responses for the current prompt and model.')
+        parser.add_argument('--checkpoint', default='reprocess_checkpoint.json',
+                            help='File the progress is saved to and resumed from.')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start from the first receipt.')
+        parser.add_argument('--report-interval', type=float, default=10,
+                            help='Seconds between progress lines.')
+
+    def handle(self, *args, **options):
+        filters = {name: options[name] for name in ('since', 'until', 'is_valid', 'is_processed', 'model', 'mode')}
+        for name in ('since', 'until'):
+            if options[name] and parse_datetime(options[name]) is None:
+                raise CommandError(f'--{name} must be an ISO 8601 datetime')
+
+        checkpoint = reprocess.Checkpoint(options['checkpoint'], filters)
+        if not options['restart']:
+            try:
+                if checkpoint.load():
+                    self.stdout.write(f'Resuming after receipt {checkpoint.last_id} '
+                                      f'({checkpoint.succeeded} done, {len(checkpoint.failed)} failed)')
+            except ValueError as e:
+                raise CommandError(f'{e}; use --restart or another --checkpoint')
+
+        receipt_metas = reprocess.filter_receipt_metas(
+            since=parse_datetime(options['since']) if options['since'] else None,
+            until=parse_datetime(options['until']) if options['until'] else None,
+            is_valid=options['is_valid'], is_processed=options['is_processed'], model=options['model'],
+        )
+        checkpoint = reprocess.reprocess(
+            receipt_metas, checkpoint, mode=options['mode'], concurrency=options['concurrency'],
+            bypass_cache=options['bypass_cache'], limit=options['limit'], write=self.stdout.write,
+            report_interval=options['report_interval'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Finished: {checkpoint.succeeded} succeeded, {len(checkpoint.failed)} failed '
+            f'(see {options["checkpoint"]})'
+        ))
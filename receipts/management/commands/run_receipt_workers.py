@@ -0,0 +1,49 @@
+import multiprocessing, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from receipts import jobs
+
+class Command(BaseCommand):
+    help = 'Run a pool of worker processes that drain the receipt job queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.RECEIPT_JOB_WORKERS,
+                            help='Number of worker processes (default: RECEIPT_JOB_WORKERS).')
+        parser.add_argument('--poll-interval', type=float, default=settings.RECEIPT_JOB_POLL_INTERVAL,
+                            help='Seconds to wait between polls when the queue is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling forever.')
+
+    def handle(self, *args, **options):
+        workers, poll_interval, once = options['workers'], options['poll_interval'], options['once']
+        requeued = jobs.requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale job(s)')
+
+        if workers <= 1:
+            jobs.work(poll_interval=poll_interval, once=once)
+            return
+
+        # Children must not inherit the parent's open database connection
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=jobs.work, kwargs={'poll_interval': poll_interval, 'once': once}, daemon=True)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f'Started {workers} receipt workers')
+
+        try:
+            while any(process.is_alive() for process in processes):
+                time.sleep(poll_interval)
+                if jobs.requeue_stale_jobs():
+                    self.stdout.write('Requeued stale job(s)')
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+        for process in processes:
+            process.join()
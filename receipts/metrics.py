@@ -0,0 +1,139 @@
+import contextvars, json, logging, threading, time
+from contextlib import contextmanager
+
+# In-process metrics rendered in the Prometheus text format by /metrics, plus a
+# per-request trace that the middleware writes out as one structured log line.
+# Kept free of Django so render pool workers can import receipts.utils.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger('receipts.metrics')
+
+_registry = []
+_trace = contextvars.ContextVar('metrics_trace', default=None)
+
+def label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+def format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = label_key(self.labelnames, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labelnames, key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = label_key(self.labelnames, labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def totals(self):
+        """(sum, count) per label tuple, for callers that want averages rather than buckets."""
+        with self.lock:
+            return {key: (total, count) for key, (_, total, count) in self.values.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", f"{bound:g}")])} {bucket_count}')
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.labelnames, key)} {total}')
+                lines.append(f'{self.name}_count{format_labels(self.labelnames, key)} {count}')
+        return lines
+
+STAGE_DURATION = Histogram('receipt_stage_duration_seconds', 'Time spent per pipeline stage.', ['stage'])
+PAGES = Histogram('receipt_pages', 'Pages rendered per document.', buckets=COUNT_BUCKETS)
+PROMPT_BYTES = Histogram('receipt_prompt_image_bytes', 'Base64 image payload sent per LLM call.', buckets=SIZE_BUCKETS)
+TEXT_FAST_PATH = Counter('receipt_text_fast_path_total', 'PDFs sent as text layer or as images.', ['result'])
+RENDER_CACHE = Counter('receipt_render_cache_total', 'Rendered page cache lookups.', ['result'])
+LLM_REQUESTS = Counter('receipt_llm_requests_total', 'LLM request attempts.', ['outcome'])
+LLM_TOKENS = Counter('receipt_llm_tokens_total', 'Tokens reported in response.usage.', ['kind'])
+LLM_CACHE = Counter('receipt_llm_cache_total', 'LLM response cache lookups.', ['result'])
+DB_QUERIES = Counter('receipt_db_queries_total', 'Database queries executed.')
+HTTP_DURATION = Histogram('receipt_http_request_duration_seconds', 'Request latency.', ['view', 'method', 'status'])
+HTTP_DB_QUERIES = Histogram('receipt_http_request_db_queries', 'Database queries per request.', ['view'], buckets=COUNT_BUCKETS)
+JOB_DURATION = Histogram('receipt_job_duration_seconds', 'Queued job run time.', ['job_type', 'status'])
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+@contextmanager
+def trace(**fields):
+    """Collect stage timings and counters for one request or job."""
+    data = {**fields, 'stages': {}, 'db_queries': 0}
+    token = _trace.set(data)
+    try:
+        yield data
+    finally:
+        _trace.reset(token)
+
+def current_trace():
+    return _trace.get()
+
+def record(name, value):
+    """Add value to a numeric field of the current trace, if there is one."""
+    data = _trace.get()
+    if data is not None:
+        data[name] = data.get(name, 0) + value
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage into STAGE_DURATION and the current trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_DURATION.observe(elapsed, stage=name)
+        data = _trace.get()
+        if data is not None:
+            data['stages'][name] = round(data['stages'].get(name, 0) + elapsed * 1000, 3)
+
+def count_query(execute, sql, params, many, context):
+    """Database execute wrapper counting queries, installed on every connection."""
+    DB_QUERIES.inc()
+    record('db_queries', 1)
+    return execute(sql, params, many, context)
+
+def log_trace(event, data):
+    """Write a finished trace as one JSON log line on the receipts.metrics logger."""
+    logger.info(json.dumps({'event': event, **data}, default=str))
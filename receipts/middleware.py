@@ -0,0 +1,50 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from receipts import metrics
+
+class MetricsMiddleware:
+    """
+    Times every request, counts its database queries and pipeline stages into
+    receipts.metrics, and logs the trace as one JSON line per request.
+    Works under both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with metrics.trace() as data:
+            response = self.get_response(request)
+        self.finish(request, response, data, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with metrics.trace() as data:
+            response = await self.get_response(request)
+        self.finish(request, response, data, start)
+        return response
+
+    def finish(self, request, response, data, start):
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        metrics.HTTP_DURATION.observe(duration, view=view, method=request.method, status=response.status_code)
+        metrics.HTTP_DB_QUERIES.observe(data['db_queries'], view=view)
+        metrics.log_trace('request', {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            **data,
+        })
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0002_receiptmetadata_file_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receiptmetadata',
+            name='file_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
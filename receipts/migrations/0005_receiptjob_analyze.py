@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0004_receiptjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='receiptjob',
+            name='job_type',
+            field=models.CharField(choices=[('validate', 'Validate'), ('process', 'Process'), ('analyze', 'Analyze')], max_length=32),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0007_receipt_purchased_at_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['updated_at', 'id'], name='receipt_updated_at_id_idx'),
+        ),
+    ]
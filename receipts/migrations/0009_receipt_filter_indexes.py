@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0008_receipt_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['merchant_name', 'purchased_at'], name='receipt_merchant_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['category', 'purchased_at'], name='receipt_category_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['currency', 'purchased_at'], name='receipt_currency_date_idx'),
+        ),
+    ]
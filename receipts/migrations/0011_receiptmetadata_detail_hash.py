@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0010_receiptmetadata_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receiptmetadata',
+            name='detail_hash',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0011_receiptmetadata_detail_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='llmresponsecache',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:53
+
+from django.db import migrations, models
+
+
+def backfill_model_name(apps, schema_editor):
+    # Best effort for receipts extracted before the model was recorded: the
+    # model of the newest cached response for the same file, if still cached
+    Receipt = apps.get_model('receipts', 'Receipt')
+    LLMResponseCache = apps.get_model('receipts', 'LLMResponseCache')
+    models_by_hash = dict(
+        LLMResponseCache.objects.filter(model_name__isnull=False)
+        .order_by('created_at').values_list('file_hash', 'model_name')
+    )
+    receipts = Receipt.objects.filter(model_name__isnull=True, receipt_file__isnull=False).select_related('receipt_file')
+    batch = []
+    for receipt in receipts.iterator(chunk_size=2000):
+        receipt.model_name = models_by_hash.get(receipt.receipt_file.file_hash)
+        if receipt.model_name:
+            batch.append(receipt)
+    Receipt.objects.bulk_update(batch, ['model_name'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0012_llmresponsecache_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='model_name',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_model_name, migrations.RunPython.noop),
+    ]
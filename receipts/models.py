@@ -1,11 +1,30 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 import hashlib
 import os
 
+# The 64-bit perceptual hash is also stored as four 16-bit bands, each indexed,
+# so Hamming-distance searches can use index lookups (see receipts.dedupe)
+PHASH_BANDS = 4
+PHASH_BAND_BITS = 16
+
+def phash_bands(perceptual_hash):
+    """Split a 16 hex digit perceptual hash into PHASH_BANDS integers."""
+    value = int(perceptual_hash, 16)
+    mask = (1 << PHASH_BAND_BITS) - 1
+    return [(value >> (PHASH_BAND_BITS * i)) & mask for i in range(PHASH_BANDS)]
+
 class ReceiptMetaData(models.Model):
     file_name = models.CharField(max_length=255)
     file_path = models.CharField(max_length=255)
     file_hash = models.CharField(max_length=64, unique=True, blank=True, null=True)
+    perceptual_hash = models.CharField(max_length=16, blank=True, null=True)
+    phash_band_0 = models.PositiveIntegerField(blank=True, null=True, db_index=True)
+    phash_band_1 = models.PositiveIntegerField(blank=True, null=True, db_index=True)
+    phash_band_2 = models.PositiveIntegerField(blank=True, null=True, db_index=True)
+    phash_band_3 = models.PositiveIntegerField(blank=True, null=True, db_index=True)
+    # Confirms pHash candidates before they count as near duplicates
+    detail_hash = models.CharField(max_length=128, blank=True, null=True)
     is_valid = models.BooleanField(default=False)
     invalid_reason = models.CharField(max_length=255, blank=True, null=True)
     is_processed = models.BooleanField(default=False)
@@ -23,13 +42,21 @@ class ReceiptMetaData(models.Model):
         hash_sha256 = hashlib.sha256()
         try:
             with open(self.file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
+                for chunk in iter(lambda: f.read(64 * 1024), b""):
                     hash_sha256.update(chunk)
             return hash_sha256.hexdigest()
         except Exception as e:
             print(f"Error generating hash for {self.file_path}: {e}")
             return None
     
+    def set_perceptual_hash(self, perceptual_hash, detail_hash=None):
+        """Store a perceptual hash together with its indexed bands and the detail hash."""
+        self.perceptual_hash = perceptual_hash
+        self.detail_hash = detail_hash
+        bands = phash_bands(perceptual_hash) if perceptual_hash else [None] * PHASH_BANDS
+        for i, band in enumerate(bands):
+            setattr(self, f'phash_band_{i}', band)
+
     def save(self, *args, **kwargs):
         # Generate file hash if not already set and file exists
         if not self.file_hash and self.file_path and os.path.exists(self.file_path):
@@ -44,8 +71,23 @@ class Receipt(models.Model):
     payment_method = models.CharField(max_length=255, blank=True, null=True)
     category = models.CharField(max_length=255, blank=True, null=True)
     receipt_file = models.OneToOneField(ReceiptMetaData, on_delete=models.CASCADE, related_name='receipt_meta_data', blank=True, null=True)
+    # LLM_MODEL that extracted this receipt; empty for ingested results
+    model_name = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
     # prompt = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (purchased_at, id)
+            models.Index(fields=['purchased_at', 'id'], name='receipt_purchased_at_id_idx'),
+            # Incremental exports read everything changed since a watermark
+            models.Index(fields=['updated_at', 'id'], name='receipt_updated_at_id_idx'),
+            # Filtering by merchant/category/currency within a purchase date range
+            models.Index(fields=['merchant_name', 'purchased_at'], name='receipt_merchant_date_idx'),
+            models.Index(fields=['category', 'purchased_at'], name='receipt_category_date_idx'),
+            models.Index(fields=['currency', 'purchased_at'], name='receipt_currency_date_idx'),
+        ]
+
     def __str__(self):
         return f"{self.merchant_name} - {self.total_amount}"
     
@@ -56,3 +98,51 @@ class LineItem(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     receipt = models.ForeignKey(Receipt, on_delete=models.CASCADE, related_name='line_items', blank=True, null=True)
 
+
+class ReceiptJob(models.Model):
+    """A queued validate/process request, drained by the job workers."""
+    JOB_TYPES = [
+        ('validate', 'Validate'),
+        ('process', 'Process'),
+        ('analyze', 'Analyze'),
+    ]
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    job_type = models.CharField(max_length=32, choices=JOB_TYPES)
+    receipt_meta = models.ForeignKey(ReceiptMetaData, on_delete=models.CASCADE, related_name='jobs')
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default='queued')
+    result = models.JSONField(encoder=DjangoJSONEncoder, blank=True, null=True)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='receipt_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.job_type} #{self.receipt_meta_id} ({self.status})"
+
+class LLMResponseCache(models.Model):
+    """A model response keyed on file content, prompt, model and render profile."""
+    key = models.CharField(max_length=64, unique=True)
+    file_hash = models.CharField(max_length=64, db_index=True)
+    model_name = models.CharField(max_length=255, blank=True, null=True)
+    response = models.TextField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.file_hash[:12]} ({self.model_name})"
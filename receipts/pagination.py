@@ -0,0 +1,108 @@
+import base64, json
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+class KeysetPagination:
+    """
+    Cursor pagination that seeks on (ordering field, id) instead of using
+    OFFSET, so every page costs the same no matter how deep it is.
+
+    Query parameters:
+        limit: Page size, capped at max_limit.
+        ordering: One of `orderings`; prefix with '-' for descending.
+        cursor: Opaque value returned as next_cursor by the previous page.
+    """
+    default_limit = 100
+    max_limit = 1000
+    orderings = ['id', '-id', 'purchased_at', '-purchased_at']
+    default_ordering = 'id'
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'error': 'limit must be an integer'})
+        return max(1, min(limit, self.max_limit))
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get('ordering', self.default_ordering)
+        if ordering not in self.orderings:
+            raise ValidationError({'error': f'ordering must be one of {self.orderings}'})
+        return ordering
+
+    def encode_cursor(self, ordering, obj):
+        field = ordering.lstrip('-')
+        value = getattr(obj, field) if field != 'id' else None
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        payload = json.dumps({'o': ordering, 'v': value, 'id': obj.id})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor, ordering):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if payload['o'] != ordering:
+                raise ValueError
+            value = payload['v']
+            if value is not None and ordering.lstrip('-') != 'id':
+                value = parse_datetime(value)
+            return value, int(payload['id'])
+        except (ValueError, KeyError, TypeError):
+            raise ValidationError({'error': 'Invalid cursor'})
+
+    def seek(self, queryset, ordering, value, last_id):
+        """Filter to the rows that come strictly after (value, last_id)."""
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        if field == 'id':
+            return queryset.filter(id__lt=last_id) if descending else queryset.filter(id__gt=last_id)
+        # NULLs sort first when ascending and last when descending
+        is_null = Q(**{f'{field}__isnull': True})
+        if descending:
+            if value is None:
+                return queryset.filter(is_null, id__lt=last_id)
+            return queryset.filter(
+                Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': last_id}) | is_null
+            )
+        if value is None:
+            return queryset.filter((is_null & Q(id__gt=last_id)) | ~is_null)
+        return queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': last_id}))
+
+    def order(self, queryset, ordering):
+        field = ordering.lstrip('-')
+        if field == 'id':
+            return queryset.order_by(ordering)
+        if ordering.startswith('-'):
+            return queryset.order_by(F(field).desc(nulls_last=True), '-id')
+        return queryset.order_by(F(field).asc(nulls_first=True), 'id')
+
+    def paginate_queryset(self, queryset, request):
+        self.request = request
+        self.ordering = self.get_ordering(request)
+        limit = self.get_limit(request)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            value, last_id = self.decode_cursor(cursor, self.ordering)
+            queryset = self.seek(queryset, self.ordering, value, last_id)
+        page = list(self.order(queryset, self.ordering)[:limit + 1])
+        self.has_next = len(page) > limit
+        page = page[:limit]
+        self.next_cursor = self.encode_cursor(self.ordering, page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        params = self.request.query_params.copy()
+        params['cursor'] = self.next_cursor
+        return self.request.build_absolute_uri(f'{self.request.path}?{params.urlencode()}')
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'next_cursor': self.next_cursor,
+            'next': self.get_next_link(),
+        })
@@ -98,4 +98,63 @@ Example 2: If the image is a picture of a cat, your output must be:
     "receipt_or_not": "no"
     }
     ```
-"""
\ No newline at end of file
+"""
+
+CLASSIFY_AND_EXTRACT_PROMPT = """
+You are an expert at analyzing documents and extracting information from receipts. You will do two things in a single answer:
+first decide whether the provided document is a receipt or payment document, and if it is, extract its data.
+
+Step 1 - Classification
+
+A "receipt" or "payment document" includes, but is not limited to: store receipts, invoices, order confirmations that show a final
+total, bills, tickets, hotel folios or statements of charges, credit card slips, or any document that records a financial transaction
+with an itemized list or a final total amount.
+
+It is NOT a payment document if it is a non-document image (person, landscape, animal, object), a restaurant menu or product catalog,
+a pre-stay booking confirmation without settled charges, a packing slip without prices, a general letter or a shipping label.
+
+Step 2 - Extraction (only when the document is a receipt)
+
+Extract the data following these Pydantic-like schemas:
+
+class LineItem(BaseModel):
+    description: str = Field(..., description="Description of the item purchased.")
+    quantity: Optional[float] = Field(None, description="Quantity of the item.")
+    unit_price: Optional[float] = Field(None, description="Unit price of the item.")
+    total: float = Field(..., description="Total cost for this line item.")
+
+class ExtractedReceiptData(BaseModel):
+    merchant_name: Optional[str] = Field(None, description="The name of the merchant/vendor.")
+    total_amount: Optional[float] = Field(None, description="The total amount of the receipt.")
+    currency: Optional[str] = Field("USD", description="The currency of the total amount (e.g., USD, EUR).")
+    payment_method: Optional[str] = Field(None, description="The payment method used (e.g., Credit Card, Cash).")
+    line_items: Optional[List[LineItem]] = Field(None, description="List of individual items purchased.")
+    category: Optional[str] = Field(None, description="Automatically assigned category for the expense.")
+    purchased_at: Optional[datetime] = Field(None, description="The date and time the purchase was made.")
+
+    - If a field is not present on the receipt, set it to null. Currency defaults to "USD" unless another currency is detected.
+    - Extract all line items; set quantity and unit_price to null when they are not clearly identifiable.
+    - If no line items can be extracted, set line_items to an empty array: [].
+
+Output Format: Your response MUST be a single JSON object and nothing else, with exactly these keys:
+
+    {
+    "receipt_or_not": "yes" or "no",
+    "receipt": an ExtractedReceiptData object when receipt_or_not is "yes", otherwise {}
+    }
+
+Do not include any conversational text, explanations, or markdown outside of the JSON object itself.
+
+Here are the images of the document:
+"""
+
+# Text-only variant of RECEIPT_EXTRACT_PROMPT for PDFs with an embedded text
+# layer: same schema and rules, with the page text following the prompt.
+RECEIPT_EXTRACT_TEXT_PROMPT = RECEIPT_EXTRACT_PROMPT.replace(
+    'the provided receipt (which can be a single image or a set of images)',
+    'the provided receipt text (extracted from the text layer of a PDF, one section per page; '
+    'columns may be out of order, so match amounts to descriptions by context)',
+).replace(
+    'Here are the images of the receipt:',
+    'Here is the text of the receipt:',
+)
@@ -0,0 +1,72 @@
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+EXACT_FILTERS = ['merchant_name', 'category', 'currency']
+GROUP_BY_FIELDS = ['category', 'merchant_name', 'currency', 'month']
+
+def parse_bound(value, name, end_of_day=False):
+    """
+    Parse a purchased_from/purchased_to value. Dates select whole days: a
+    date-only upper bound includes that day.
+
+    Returns:
+        tuple: (aware datetime, True if the bound is exclusive)
+    """
+    error = ValidationError({'error': f'{name} must be an ISO 8601 date or datetime'})
+    try:
+        # parse_date first: parse_datetime also accepts bare dates, as midnight
+        parsed = parse_date(value)
+        if parsed is not None:
+            if end_of_day:
+                parsed += timedelta(days=1)
+            return timezone.make_aware(datetime.combine(parsed, time.min)), end_of_day
+        parsed = parse_datetime(value)
+    except (ValueError, OverflowError):
+        # Well-formed but out of range, e.g. 2025-13-01 or the day after 9999-12-31
+        raise error
+    if parsed is None:
+        raise error
+    return (parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)), False
+
+def filter_receipts(queryset, params):
+    """
+    Apply the merchant_name, category, currency and purchased_from/purchased_to
+    query parameters. Every filter is a plain comparison on an indexed column.
+    """
+    filters = {field: params[field] for field in EXACT_FILTERS if params.get(field)}
+    if params.get('purchased_from'):
+        filters['purchased_at__gte'], _ = parse_bound(params['purchased_from'], 'purchased_from')
+    if params.get('purchased_to'):
+        bound, exclusive = parse_bound(params['purchased_to'], 'purchased_to', end_of_day=True)
+        filters['purchased_at__lt' if exclusive else 'purchased_at__lte'] = bound
+    return queryset.filter(**filters)
+
+def aggregate_receipts(queryset, group_by):
+    """
+    Count and sum total_amount per group with a single GROUP BY query.
+
+    Args:
+        queryset: Receipts, usually already filtered.
+        group_by: List of GROUP_BY_FIELDS; 'month' groups on purchased_at's month.
+    """
+    unknown = set(group_by) - set(GROUP_BY_FIELDS)
+    if not group_by or unknown:
+        raise ValidationError({'error': f'group_by must be a comma separated list of {GROUP_BY_FIELDS}'})
+    if 'month' in group_by:
+        queryset = queryset.annotate(month=TruncMonth('purchased_at'))
+    results = list(
+        queryset.order_by()
+        .values(*group_by)
+        .annotate(count=Count('id'), total_amount=Sum('total_amount'))
+        .order_by(*group_by)
+    )
+    # Match the two-decimal strings used for amounts everywhere else in the API
+    for row in results:
+        if row['total_amount'] is not None:
+            row['total_amount'] = f"{row['total_amount']:.2f}"
+    return results
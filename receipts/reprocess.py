@@ -0,0 +1,196 @@
+import json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.db import close_old_connections
+
+from receipts.models import ReceiptMetaData
+from receipts import services, utils
+
+REPROCESS_HANDLERS = {
+    'process': services.process_receipt,
+    'analyze': services.analyze_receipt,
+}
+
+def filter_receipt_metas(since=None, until=None, is_valid=None, is_processed=None, model=None):
+    """
+    Select the ReceiptMetaData rows to re-run. `model` keeps receipts whose
+    current extraction was produced by that LLM model.
+    """
+    receipt_metas = ReceiptMetaData.objects.all()
+    if since:
+        receipt_metas = receipt_metas.filter(created_at__gte=since)
+    if until:
+        receipt_metas = receipt_metas.filter(created_at__lt=until)
+    if is_valid is not None:
+        receipt_metas = receipt_metas.filter(is_valid=is_valid)
+    if is_processed is not None:
+        receipt_metas = receipt_metas.filter(is_processed=is_processed)
+    if model:
+        receipt_metas = receipt_metas.filter(receipt_meta_data__model_name=model)
+    return receipt_metas
+
+class Checkpoint:
+    """
+    Progress of a reprocess run, saved to a JSON file so an interrupted run can
+    resume. Receipts finish out of order, so the checkpoint records the highest
+    id below which every receipt is done; anything after it is redone on resume.
+    """
+
+    def __init__(self, path, filters):
+        self.path = path
+        self.filters = filters
+        self.last_id = 0
+        self.succeeded = 0
+        self.failed = []
+        self.pending = set()
+        self.done = set()
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Resume from the checkpoint file if it was written for the same filters."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        if state.get('filters') != self.filters:
+            raise ValueError(f'{self.path} was written for different filters: {state.get("filters")}')
+        self.last_id = state['last_id']
+        self.succeeded = state['succeeded']
+        self.failed = state['failed']
+        return True
+
+    def save(self):
+        with self.lock:
+            state = {
+                'filters': self.filters,
+                'last_id': self.last_id,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+            }
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+    def start(self, receipt_meta_id):
+        with self.lock:
+            self.pending.add(receipt_meta_id)
+
+    def finish(self, receipt_meta_id, error=None):
+        with self.lock:
+            self.pending.discard(receipt_meta_id)
+            self.done.add(receipt_meta_id)
+            if error is None:
+                self.succeeded += 1
+            else:
+                self.failed.append({'id': receipt_meta_id, 'error': error})
+            # Advance past every finished id that has nothing pending before it
+            lowest_pending = min(self.pending, default=None)
+            finished = [i for i in self.done if lowest_pending is None or i < lowest_pending]
+            if finished:
+                self.last_id = max(self.last_id, *finished)
+                self.done.difference_update(finished)
+
+class ProgressReporter:
+    """Prints done/total, throughput and an ETA at most every `interval` seconds."""
+
+    def __init__(self, total, write, interval=10):
+        self.total = total
+        self.write = write
+        self.interval = interval
+        self.count = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def advance(self, checkpoint):
+        self.count += 1
+        if time.monotonic() - self.last_report >= self.interval:
+            self.report(checkpoint)
+
+    def report(self, checkpoint):
+        now = self.last_report = time.monotonic()
+        elapsed = now - self.started
+        rate = self.count / elapsed if elapsed else 0
+        eta = (self.total - self.count) / rate if rate else 0
+        self.write(
+            f'{self.count}/{self.total} done, {len(checkpoint.failed)} failed, '
+            f'{rate:.2f} receipts/s, ETA {eta / 60:.1f} min (checkpoint id {checkpoint.last_id})'
+        )
+
+def reprocess_one(handler, receipt_meta_id, bypass_cache):
+    """Re-extract one receipt. Returns None on success or an error message."""
+    close_old_connections()
+    try:
+        receipt_meta = ReceiptMetaData.objects.get(id=receipt_meta_id)
+        # Backfill calls give way to interactive ones under the shared rate limit
+        with utils.llm_lane('bulk'):
+            payload, status_code = handler(receipt_meta, 'reprocess', bypass_cache=bypass_cache)
+    except Exception as e:
+        return str(e)
+    if status_code >= 400:
+        return payload.get('error', f'HTTP {status_code}') if isinstance(payload, dict) else f'HTTP {status_code}'
+    return None
+
+def iter_ids(receipt_metas, after_id=0, limit=None, page_size=2000):
+    """
+    Yield matching ids in ascending order, one short keyset query per page so
+    no read transaction stays open for the whole run.
+    """
+    count = 0
+    while True:
+        page = list(receipt_metas.filter(id__gt=after_id).order_by('id').values_list('id', flat=True)[:page_size])
+        for receipt_meta_id in page:
+            if limit and count >= limit:
+                return
+            count += 1
+            yield receipt_meta_id
+        if len(page) < page_size:
+            return
+        after_id = page[-1]
+
+def reprocess(receipt_metas, checkpoint, mode='process', concurrency=8, bypass_cache=False,
+              limit=None, write=print, report_interval=10, checkpoint_interval=5):
+    """
+    Re-run extraction over receipt_metas with at most `concurrency` receipts
+    in flight, saving the checkpoint every `checkpoint_interval` seconds.
+
+    Returns:
+        Checkpoint: The final state of the run.
+    """
+    handler = REPROCESS_HANDLERS[mode]
+    remaining = receipt_metas.filter(id__gt=checkpoint.last_id).count()
+    reporter = ProgressReporter(min(remaining, limit) if limit else remaining, write, report_interval)
+    last_saved = time.monotonic()
+
+    def handle(receipt_meta_id):
+        return receipt_meta_id, reprocess_one(handler, receipt_meta_id, bypass_cache)
+
+    def collect(futures):
+        nonlocal last_saved
+        for future in futures:
+            receipt_meta_id, error = future.result()
+            checkpoint.finish(receipt_meta_id, error)
+            reporter.advance(checkpoint)
+        if time.monotonic() - last_saved >= checkpoint_interval:
+            checkpoint.save()
+            last_saved = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        in_flight = set()
+        try:
+            for receipt_meta_id in iter_ids(receipt_metas, checkpoint.last_id, limit):
+                # Keep the queue bounded instead of submitting every id up front
+                if len(in_flight) >= concurrency:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                checkpoint.start(receipt_meta_id)
+                in_flight.add(pool.submit(handle, receipt_meta_id))
+            finished, in_flight = wait(in_flight)
+            collect(finished)
+        finally:
+            for future in in_flight:
+                future.cancel()
+            checkpoint.save()
+    reporter.report(checkpoint)
+    return checkpoint
@@ -1,18 +1,36 @@
 from rest_framework import serializers
-from receipts.models import ReceiptMetaData, Receipt, LineItem
+from receipts.models import ReceiptMetaData, Receipt, LineItem, ReceiptJob
 
 class ReceiptMetaDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = ReceiptMetaData
-        fields = '__all__'
+        exclude = ['phash_band_0', 'phash_band_1', 'phash_band_2', 'phash_band_3', 'detail_hash']
+
+class DynamicFieldsMixin:
+    """Accepts a `fields` argument restricting the serializer to those fields."""
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
 
 class LineItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = LineItem
         fields = ['description', 'quantity', 'unit_price', 'total']
 
-class ReceiptDataSerializer(serializers.ModelSerializer):
-    receipt_meta_data = serializers.IntegerField(source='receipt_file.id', read_only=True)
+class ExtractedReceiptSerializer(serializers.ModelSerializer):
+    """Validates extracted receipt data against the column types before it is saved."""
+    line_items = LineItemSerializer(many=True, required=False, allow_null=True)
+
+    class Meta:
+        model = Receipt
+        fields = ['purchased_at', 'merchant_name', 'total_amount', 'currency', 'payment_method', 'category', 'line_items']
+
+class ReceiptDataSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    # receipt_file_id comes from the receipt row itself, no extra query per receipt
+    receipt_meta_data = serializers.IntegerField(source='receipt_file_id', read_only=True)
     line_items = LineItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -21,3 +39,29 @@ class ReceiptDataSerializer(serializers.ModelSerializer):
             'id', 'purchased_at', 'merchant_name', 'total_amount', 'currency',
             'payment_method', 'category', 'receipt_meta_data', 'line_items'
         ]
+
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        """
+        Load only the columns the (projected) serializer needs, and fetch line
+        items for the whole page in one extra query instead of one per receipt.
+        """
+        fields = fields or ReceiptDataSerializer.Meta.fields
+        model_fields = {'id', 'purchased_at'}
+        for field in fields:
+            if field == 'receipt_meta_data':
+                model_fields.add('receipt_file')
+            elif field != 'line_items':
+                model_fields.add(field)
+        queryset = queryset.only(*model_fields)
+        if 'line_items' in fields:
+            queryset = queryset.prefetch_related('line_items')
+        return queryset
+
+class ReceiptJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ReceiptJob
+        fields = [
+            'id', 'job_type', 'receipt_meta', 'params', 'status', 'result',
+            'status_code', 'error', 'attempts', 'created_at', 'started_at', 'finished_at'
+        ]
@@ -0,0 +1,378 @@
+import asyncio, os, json
+
+from asgiref.sync import sync_to_async
+from pypdfium2 import PdfiumError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+
+from receipts.models import ReceiptMetaData, Receipt, LineItem
+from receipts.serializers import ReceiptMetaDataSerializer, ReceiptDataSerializer, ExtractedReceiptSerializer
+from receipts.prompts import RECEIPT_EXTRACT_PROMPT, RECEIPT_EXTRACT_TEXT_PROMPT, CLASSIFICATION_PROMPT, CLASSIFY_AND_EXTRACT_PROMPT
+from receipts import utils, llm_cache, metrics
+
+def apply_classification(receipt_meta, receipt_or_not):
+    """Store the classifier verdict on the receipt meta data."""
+    if isinstance(receipt_or_not, dict):
+        return receipt_or_not, status.HTTP_502_BAD_GATEWAY
+    else:
+        with metrics.stage('parse'):
+            receipt_or_not = json.loads(receipt_or_not).get('receipt_or_not')
+    if receipt_or_not == 'yes':
+        receipt_meta.is_valid = True
+        receipt_meta.invalid_reason = ''
+    else:
+        receipt_meta.is_valid = False
+        receipt_meta.invalid_reason = 'Not a Receipt'
+    receipt_meta.save()
+    serializer = ReceiptMetaDataSerializer(receipt_meta)
+    return serializer.data, status.HTTP_200_OK
+
+def select_pages(receipt_meta, page_range=None, max_pages=None, first_page_only=False):
+    """
+    Resolve which pages of the receipt file are sent to the model.
+
+    Returns:
+        tuple: (0-based page numbers, or None for every page; error response or None)
+    """
+    try:
+        return utils.select_pages(receipt_meta.file_path, page_range, max_pages, first_page_only), None
+    except ValueError as e:
+        return None, ({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+    except PdfiumError as e:
+        # Encrypted or corrupt PDFs fail here, before anything is sent to the model
+        return None, ({'error': f'Could not read PDF: {e}'}, status.HTTP_400_BAD_REQUEST)
+
+def classification_pages(receipt_meta, page_range=None, max_pages=None):
+    """Page selection for classification: page 1 only under CLASSIFY_FIRST_PAGE_ONLY, unless pages were requested."""
+    first_page_only = utils.CLASSIFY_FIRST_PAGE_ONLY and not page_range and not max_pages
+    return select_pages(receipt_meta, page_range, max_pages, first_page_only)
+
+def validate_receipt(receipt_meta, bypass_cache=False, page_range=None, max_pages=None):
+    """
+    Classify the uploaded file as a receipt or not and store the verdict.
+    A cached response for the same content is reused unless bypass_cache is set.
+    page_range and max_pages limit the pages sent to the model.
+
+    Returns:
+        tuple: (response payload, HTTP status code)
+    """
+    page_numbers, error_response = classification_pages(receipt_meta, page_range, max_pages)
+    if error_response:
+        return error_response
+    receipt_or_not = llm_cache.cached_llm_call(
+        receipt_meta.file_hash, CLASSIFICATION_PROMPT,
+        lambda: utils.classify_receipt_or_not(receipt_meta.file_path, receipt_meta.file_hash, page_numbers=page_numbers),
+        bypass=bypass_cache, page_numbers=page_numbers,
+    )
+    return apply_classification(receipt_meta, receipt_or_not)
+
+async def avalidate_receipt(receipt_meta, bypass_cache=False, page_range=None, max_pages=None):
+    """Async variant of validate_receipt."""
+    page_numbers, error_response = await asyncio.to_thread(classification_pages, receipt_meta, page_range, max_pages)
+    if error_response:
+        return error_response
+    receipt_or_not = await llm_cache.acached_llm_call(
+        receipt_meta.file_hash, CLASSIFICATION_PROMPT,
+        lambda: utils.aclassify_receipt_or_not(receipt_meta.file_path, receipt_meta.file_hash, page_numbers=page_numbers),
+        bypass=bypass_cache, page_numbers=page_numbers,
+    )
+    return await sync_to_async(apply_classification)(receipt_meta, receipt_or_not)
+
+def build_receipt(receipt_meta, extracted_data, model_name=None):
+    """Build (unsaved) Receipt and LineItem instances from the model output."""
+    receipt = Receipt(
+        model_name=model_name,
+        merchant_name=extracted_data.get('merchant_name'),
+        total_amount=extracted_data.get('total_amount'),
+        currency=extracted_data.get('currency'),
+        payment_method=extracted_data.get('payment_method'),
+        category=extracted_data.get('category'),
+        purchased_at=extracted_data.get('purchased_at'),
+        receipt_file=receipt_meta,
+    )
+    line_items = [
+        LineItem(
+            description=item.get('description'),
+            quantity=item.get('quantity'),
+            unit_price=item.get('unit_price'),
+            total=item.get('total'),
+        )
+        for item in extracted_data.get('line_items') or []
+    ]
+    return receipt, line_items
+
+@metrics.stage('db_write')
+def save_extracted_batch(results, model_name=None):
+    """
+    Persist extraction results for many receipts in one transaction: existing
+    receipts for those files are replaced, Receipts and LineItems are inserted
+    with bulk_create and the metadata rows are updated with one bulk_update.
+
+    Args:
+        results: List of (receipt_meta, extracted_data) pairs.
+        model_name: The LLM model that produced the results, stored on each Receipt.
+
+    Returns:
+        list: The saved Receipt instances, in the same order.
+    """
+    built = [build_receipt(receipt_meta, extracted_data, model_name) for receipt_meta, extracted_data in results]
+    receipt_metas = [receipt_meta for receipt_meta, _ in results]
+    now = timezone.now()
+    for receipt_meta in receipt_metas:
+        receipt_meta.updated_at = now
+        receipt_meta.is_processed = True
+
+    with transaction.atomic():
+        Receipt.objects.filter(receipt_file__in=receipt_metas).delete()
+        receipts = Receipt.objects.bulk_create([receipt for receipt, _ in built])
+        line_items = []
+        for receipt, items in zip(receipts, (items for _, items in built)):
+            for item in items:
+                item.receipt = receipt
+            line_items.extend(items)
+        LineItem.objects.bulk_create(line_items)
+        ReceiptMetaData.objects.bulk_update(
+            receipt_metas, ['is_valid', 'invalid_reason', 'is_processed', 'updated_at']
+        )
+    return receipts
+
+def save_extracted_data(receipt_meta, extracted_data, model_name=None):
+    """Create the Receipt and its LineItems from the model output."""
+    return save_extracted_batch([(receipt_meta, extracted_data)], model_name)[0]
+
+def check_before_processing(receipt_meta, duplicate_strategy='return_existing', require_valid=True):
+    """
+    Apply the duplicate strategy and sanity checks that run before extraction.
+    require_valid=False skips the is_valid check, for callers that classify
+    and extract in the same call.
+
+    Returns:
+        tuple or None: (response payload, HTTP status code) to return right
+        away, or None when the receipt should be sent to the model.
+    """
+    # Check if receipt has already been processed
+    receipt_data = Receipt.objects.filter(receipt_file=receipt_meta)
+    receipt_data_serializer = ReceiptDataSerializer(receipt_data, many=True)
+
+    if receipt_data:
+        if duplicate_strategy == 'return_existing':
+            return {
+                'message': 'Receipt already processed',
+                'receipt': receipt_data_serializer.data
+            }, status.HTTP_200_OK
+
+        elif duplicate_strategy == 'reprocess':
+            # Existing data is replaced in the same transaction that saves the
+            # new extraction, so a failed reprocess leaves it untouched
+            pass
+        else:
+            return {
+                'error': 'Receipt already processed',
+                'existing_data': receipt_data_serializer.data,
+                'message': 'Use duplicate_strategy=reprocess to reprocess or duplicate_strategy=return_existing to return existing data'
+            }, status.HTTP_409_CONFLICT
+
+    if require_valid and not receipt_meta.is_valid:
+        return {'error': f'Not a Valid Receipt - Reason :- {receipt_meta.invalid_reason}'}, status.HTTP_400_BAD_REQUEST
+
+    file_path = receipt_meta.file_path
+    if not file_path or not os.path.exists(file_path):
+        return {'error': 'File not found for this receipt.'}, status.HTTP_404_NOT_FOUND
+    return None
+
+def validate_extracted_data(extracted_data):
+    """
+    Check parsed model output against the Receipt column types with
+    ExtractedReceiptSerializer, the same validation ingest applies.
+
+    Returns:
+        tuple: (validated data or None, error response or None)
+    """
+    if not isinstance(extracted_data, dict):
+        return None, ({'error': 'Model returned invalid receipt data: expected a JSON object'},
+                      status.HTTP_502_BAD_GATEWAY)
+    serializer = ExtractedReceiptSerializer(data=extracted_data)
+    if not serializer.is_valid():
+        return None, ({'error': 'Model returned invalid receipt data', 'fields': serializer.errors},
+                      status.HTTP_502_BAD_GATEWAY)
+    return serializer.validated_data, None
+
+def apply_extraction(receipt_meta, extracted_result):
+    """Parse the model output and persist it."""
+    try:
+        if isinstance(extracted_result, tuple):
+            return {'error': extracted_result[1]}, status.HTTP_400_BAD_REQUEST
+        if isinstance(extracted_result, dict):
+            return extracted_result, status.HTTP_502_BAD_GATEWAY
+        with metrics.stage('parse'):
+            extracted_data = json.loads(extracted_result)
+    except Exception as e:
+        return {'error': f'Extraction failed: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    if not extracted_data:
+        return {'error': 'No data extracted from receipt.'}, status.HTTP_400_BAD_REQUEST
+    extracted_data, error_response = validate_extracted_data(extracted_data)
+    if error_response:
+        return error_response
+
+    # Cached responses are keyed on LLM_MODEL, so this is the model either way
+    receipt = save_extracted_data(receipt_meta, extracted_data, os.getenv('LLM_MODEL'))
+    serializer = ReceiptDataSerializer(receipt)
+    return serializer.data, status.HTTP_200_OK
+
+def process_receipt(receipt_meta, duplicate_strategy='return_existing', bypass_cache=False,
+                    page_range=None, max_pages=None):
+    """
+    Extract data from a receipt and save it, honouring the duplicate strategy
+    when the receipt has already been processed. A cached response for the
+    same content is reused unless bypass_cache is set. page_range and
+    max_pages limit the pages sent to the model.
+
+    Returns:
+        tuple: (response payload, HTTP status code)
+    """
+    early_response = check_before_processing(receipt_meta, duplicate_strategy)
+    if early_response:
+        return early_response
+    page_numbers, error_response = select_pages(receipt_meta, page_range, max_pages)
+    if error_response:
+        return error_response
+    try:
+        page_texts = utils.text_layer_pages(receipt_meta.file_path, page_numbers)
+        extracted_result = llm_cache.cached_llm_call(
+            receipt_meta.file_hash, RECEIPT_EXTRACT_TEXT_PROMPT if page_texts else RECEIPT_EXTRACT_PROMPT,
+            lambda: utils.extract_receipt_data(receipt_meta.file_path, receipt_meta.file_hash,
+                                               page_numbers=page_numbers, page_texts=page_texts),
+            bypass=bypass_cache, page_numbers=page_numbers,
+        )
+    except Exception as e:
+        return {'error': f'Extraction failed: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    return apply_extraction(receipt_meta, extracted_result)
+
+async def aprocess_receipt(receipt_meta, duplicate_strategy='return_existing', bypass_cache=False,
+                           page_range=None, max_pages=None):
+    """Async variant of process_receipt."""
+    early_response = await sync_to_async(check_before_processing)(receipt_meta, duplicate_strategy)
+    if early_response:
+        return early_response
+    page_numbers, error_response = await asyncio.to_thread(select_pages, receipt_meta, page_range, max_pages)
+    if error_response:
+        return error_response
+    try:
+        page_texts = await asyncio.to_thread(utils.text_layer_pages, receipt_meta.file_path, page_numbers)
+        extracted_result = await llm_cache.acached_llm_call(
+            receipt_meta.file_hash, RECEIPT_EXTRACT_TEXT_PROMPT if page_texts else RECEIPT_EXTRACT_PROMPT,
+            lambda: utils.aextract_receipt_data(receipt_meta.file_path, receipt_meta.file_hash,
+                                                page_numbers=page_numbers, page_texts=page_texts),
+            bypass=bypass_cache, page_numbers=page_numbers,
+        )
+    except Exception as e:
+        return {'error': f'Extraction failed: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    return await sync_to_async(apply_extraction)(receipt_meta, extracted_result)
+
+def analyze_receipt(receipt_meta, duplicate_strategy='return_existing', bypass_cache=False,
+                    page_range=None, max_pages=None):
+    """
+    Classify and extract a receipt with a single LLM call, then store the
+    verdict and the extracted data together.
+
+    Returns:
+        tuple: (response payload, HTTP status code)
+    """
+    early_response = check_before_processing(receipt_meta, duplicate_strategy, require_valid=False)
+    if early_response:
+        return early_response
+    page_numbers, error_response = select_pages(receipt_meta, page_range, max_pages)
+    if error_response:
+        return error_response
+    try:
+        result = llm_cache.cached_llm_call(
+            receipt_meta.file_hash, CLASSIFY_AND_EXTRACT_PROMPT,
+            lambda: utils.classify_and_extract_receipt_data(receipt_meta.file_path, receipt_meta.file_hash, page_numbers=page_numbers),
+            bypass=bypass_cache, page_numbers=page_numbers,
+        )
+        if isinstance(result, dict):
+            return result, status.HTTP_502_BAD_GATEWAY
+        with metrics.stage('parse'):
+            result = json.loads(result)
+    except Exception as e:
+        return {'error': f'Extraction failed: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR
+    if not isinstance(result, dict):
+        return {'error': 'Model returned an invalid analysis: expected a JSON object'}, status.HTTP_502_BAD_GATEWAY
+
+    extracted_data = result.get('receipt') or {}
+    if result.get('receipt_or_not') != 'yes':
+        receipt_meta.is_valid = False
+        receipt_meta.invalid_reason = 'Not a Receipt'
+        receipt_meta.is_processed = False
+        with transaction.atomic():
+            # Reprocessing a file that is no longer a receipt drops its old data
+            Receipt.objects.filter(receipt_file=receipt_meta).delete()
+            receipt_meta.save()
+        return {
+            'receipt_meta': ReceiptMetaDataSerializer(receipt_meta).data,
+            'receipt': None
+        }, status.HTTP_200_OK
+
+    receipt_meta.is_valid = True
+    receipt_meta.invalid_reason = ''
+    if not extracted_data:
+        receipt_meta.save()
+        return {'error': 'No data extracted from receipt.'}, status.HTTP_400_BAD_REQUEST
+    extracted_data, error_response = validate_extracted_data(extracted_data)
+    if error_response:
+        receipt_meta.save()
+        return error_response
+    receipt = save_extracted_data(receipt_meta, extracted_data, os.getenv('LLM_MODEL'))
+    return {
+        'receipt_meta': ReceiptMetaDataSerializer(receipt_meta).data,
+        'receipt': ReceiptDataSerializer(receipt).data
+    }, status.HTTP_200_OK
+
+def ingest_results(items):
+    """
+    Persist already-extracted data for many receipts at once. Each item's data
+    is validated with ExtractedReceiptSerializer; invalid items are reported
+    in 'errors' and only the valid ones are saved.
+
+    Args:
+        items: List of {'receipt_meta_id': int, 'data': extracted receipt dict}.
+
+    Returns:
+        tuple: (response payload, HTTP status code)
+    """
+    if not isinstance(items, list) or not items:
+        return {'error': 'Provide a non-empty list of {"receipt_meta_id", "data"} objects'}, status.HTTP_400_BAD_REQUEST
+
+    errors, valid_items = [], []
+    for index, item in enumerate(items):
+        receipt_meta_id = item.get('receipt_meta_id') if isinstance(item, dict) else None
+        data = item.get('data') if isinstance(item, dict) else None
+        if not isinstance(receipt_meta_id, int) or not isinstance(data, dict) or not data:
+            errors.append({'index': index, 'error': 'Each item needs an integer receipt_meta_id and a non-empty data object'})
+            continue
+        serializer = ExtractedReceiptSerializer(data=data)
+        if not serializer.is_valid():
+            errors.append({'index': index, 'error': 'Invalid data', 'fields': serializer.errors})
+        else:
+            valid_items.append((index, receipt_meta_id, serializer.validated_data))
+
+    receipt_metas = ReceiptMetaData.objects.in_bulk([receipt_meta_id for _, receipt_meta_id, _ in valid_items])
+    results, seen = [], set()
+    for index, receipt_meta_id, data in valid_items:
+        if receipt_meta_id not in receipt_metas:
+            errors.append({'index': index, 'error': f'Receipt {receipt_meta_id} not found'})
+        elif receipt_meta_id in seen:
+            errors.append({'index': index, 'error': f'Receipt {receipt_meta_id} appears more than once'})
+        else:
+            seen.add(receipt_meta_id)
+            results.append((receipt_metas[receipt_meta_id], data))
+
+    errors.sort(key=lambda error: error['index'])
+
+    receipts = save_extracted_batch(results) if results else []
+    saved = Receipt.objects.filter(id__in=[receipt.id for receipt in receipts]).prefetch_related('line_items').order_by('id')
+    return {
+        'receipts': ReceiptDataSerializer(saved, many=True).data,
+        'errors': errors,
+    }, status.HTTP_201_CREATED if receipts else status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,142 @@
+import os, tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+from django.utils.deconstruct import deconstructible
+
+from receipts import utils
+from receipts.models import ReceiptMetaData
+
+class FileTooLarge(Exception):
+    """Raised when an upload grows past its size limit."""
+    def __init__(self, max_bytes):
+        super().__init__(f'File exceeds the maximum upload size of {max_bytes} bytes')
+        self.max_bytes = max_bytes
+
+class LocalFile(File):
+    """
+    A finished file on local disk. Backends that look for
+    temporary_file_path() (FileSystemStorage, ContentAddressedStorage) move or
+    link it into place instead of copying it.
+    """
+    def __init__(self, file, path):
+        super().__init__(file, path)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+def content_name(file_hash, extension):
+    """Storage name derived from the content: `ab/cd/<sha256><ext>`."""
+    return utils.sharded_path('', f'{file_hash}{extension.lower()}')
+
+def store_file(storage, local_path, file_hash, extension):
+    """
+    Save a local file under its content-derived name through the Storage API,
+    so any backend works. Content that is already stored is not saved again.
+
+    Returns:
+        tuple: (storage name, True if the blob is new)
+    """
+    name = content_name(file_hash, extension)
+    if storage.exists(name):
+        return name, False
+    with open(local_path, 'rb') as f:
+        return storage.save(name, LocalFile(f, local_path)), True
+
+def delete_unreferenced(storage, names):
+    """
+    Delete blobs that no receipt points at. A blob that was new to this
+    request can still be shared: a concurrent upload of the same content
+    reuses it instead of saving its own copy.
+    """
+    paths = {storage.path(name): name for name in names}
+    referenced = set(ReceiptMetaData.objects.filter(file_path__in=list(paths)).values_list('file_path', flat=True))
+    for path, name in paths.items():
+        if path not in referenced:
+            storage.delete(name)
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores uploaded receipts by their SHA-256 in a sharded tree
+    (`ab/cd/<hash>.pdf`), so no directory grows past a few hundred entries.
+
+    Files are written to a temporary file inside the store and published with
+    a hard link, which is atomic and fails if the blob already exists:
+    identical content is stored once, and readers never see a partially
+    written file. Content that is already on local disk (see LocalFile) is
+    linked into place directly.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from the content, so an existing file is the same file
+        return name
+
+    def publish(self, temp_path, full_path):
+        """
+        Move temp_path to full_path unless it already exists.
+
+        Returns:
+            bool: True if the file was created, False if it was already stored.
+        """
+        try:
+            os.link(temp_path, full_path)
+        except FileExistsError:
+            return False
+        except OSError:
+            # Filesystems without hard links: os.replace is still atomic
+            os.replace(temp_path, full_path)
+            return True
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return True
+
+    def temp_file(self):
+        """Open a new temporary file inside the store, returning (file, path)."""
+        directory = self.path('.tmp')
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='upload-')
+        return os.fdopen(fd, 'wb'), temp_path
+
+    def link_local_file(self, local_path, full_path):
+        """
+        Hard link a local file into the store. The caller keeps local_path.
+
+        Returns:
+            bool: False if the link could not be made (another filesystem, or no hard links).
+        """
+        try:
+            os.link(local_path, full_path)
+        except FileExistsError:
+            return True
+        except OSError:
+            return False
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return True
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            return name
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if hasattr(content, 'temporary_file_path') and self.link_local_file(content.temporary_file_path(), full_path):
+            return name
+        f, temp_path = self.temp_file()
+        try:
+            with f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        if self.file_permissions_mode is not None:
+            os.chmod(temp_path, self.file_permissions_mode)
+        self.publish(temp_path, full_path)
+        return name
+
+def get_receipt_storage():
+    """The storage backend configured as STORAGES['receipts']."""
+    return storages['receipts']
@@ -1,3 +1,898 @@
-from django.test import TestCase
+import asyncio, hashlib, io, json, os, shutil, tempfile, threading, warnings
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.db.models import QuerySet
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+import openai
+from PIL import Image, ImageDraw, ImageFont
+
+from benchmarks.fake_llm import start_server
+from benchmarks.synthetic import write_text_pdf
+from receipt_project.settings import BASE_DIR, database_from_url
+
+from receipts import batch, dedupe, jobs, llm_cache, metrics, reprocess, services, utils
+from receipts.models import ReceiptMetaData, ReceiptJob, Receipt, LineItem, LLMResponseCache
+from receipts.storage import ContentAddressedStorage, content_name
+
+def create_receipt_meta(name, **kwargs):
+    fields = {'file_name': name, 'file_path': name, 'file_hash': f'hash-{name}', **kwargs}
+    return ReceiptMetaData.objects.create(**fields)
+
+class IngestResultsTests(TestCase):
+    def test_invalid_items_are_reported_and_valid_ones_saved(self):
+        metas = [create_receipt_meta(f'r{i}.pdf') for i in range(5)]
+        items = [
+            {'receipt_meta_id': metas[0].id, 'data': {'total_amount': 'abc'}},
+            {'receipt_meta_id': metas[1].id, 'data': {'purchased_at': 'not a date'}},
+            {'receipt_meta_id': metas[2].id, 'data': {'line_items': 'x'}},
+            {'receipt_meta_id': metas[3].id, 'data': {'total_amount': 12345678901}},
+            {'receipt_meta_id': metas[4].id, 'data': {
+                'merchant_name': 'Market', 'total_amount': '12.50', 'purchased_at': '2025-01-02T03:04:05Z',
+                'line_items': [{'description': 'Tea', 'quantity': 1, 'unit_price': '12.50', 'total': '12.50'}],
+            }},
+        ]
+        response = self.client.post('/receipts/ingest', {'results': items}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual([error['index'] for error in body['errors']], [0, 1, 2, 3])
+        self.assertIn('total_amount', body['errors'][0]['fields'])
+        self.assertIn('purchased_at', body['errors'][1]['fields'])
+        self.assertIn('line_items', body['errors'][2]['fields'])
+        self.assertIn('total_amount', body['errors'][3]['fields'])
+        self.assertEqual(list(Receipt.objects.values_list('receipt_file_id', flat=True)), [metas[4].id])
+        self.assertEqual(LineItem.objects.count(), 1)
+
+    def test_all_invalid_returns_400(self):
+        meta = create_receipt_meta('r.pdf')
+        response = self.client.post('/receipts/ingest', {'results': [
+            {'receipt_meta_id': meta.id, 'data': {'total_amount': 'abc'}},
+        ]}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Receipt.objects.exists())
+
+    def test_non_object_body_returns_400(self):
+        response = self.client.post('/receipts/ingest', [{'receipt_meta_id': 1, 'data': {}}], content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+
+def receipt_image(text, size=(400, 600)):
+    """PNG bytes of a white page with a few lines of text."""
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(20)
+    for i, line in enumerate(text.splitlines()):
+        draw.text((20, 20 + 30 * i), line, fill='black', font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+def temp_receipt_storage(test_case, backend='receipts.storage.ContentAddressedStorage'):
+    """Settings override storing receipts in a temporary directory, and that directory."""
+    location = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, location)
+    storages = {**settings.STORAGES, 'receipts': {'BACKEND': backend, 'OPTIONS': {'location': location}}}
+    return override_settings(STORAGES=storages), location
+
+class DatabaseUrlTests(TestCase):
+    def test_sqlite_paths(self):
+        self.assertEqual(database_from_url('sqlite:///data/receipts.db')['NAME'], BASE_DIR / 'data' / 'receipts.db')
+        self.assertEqual(str(database_from_url('sqlite:////var/lib/receipts.db')['NAME']), '/var/lib/receipts.db')
+        self.assertEqual(database_from_url('sqlite://')['NAME'], BASE_DIR / 'receipts.db')
+        self.assertEqual(database_from_url('sqlite:///:memory:')['NAME'], ':memory:')
+
+class UploadStorageTests(TestCase):
+    def upload_with_backend(self, backend):
+        storage_settings, location = temp_receipt_storage(self, backend)
+        content = receipt_image('Corner Grocery\nTOTAL 12.50')
+        with storage_settings:
+            response = self.client.post('/upload', {'file': SimpleUploadedFile('receipt.png', content)})
+            again = self.client.post('/upload', {'file': SimpleUploadedFile('copy.png', content)})
+        return location, response, again
+
+    def assert_stored_by_hash(self, location, response):
+        self.assertEqual(response.status_code, 201)
+        receipt_meta = ReceiptMetaData.objects.get()
+        file_hash = receipt_meta.file_hash
+        self.assertEqual(receipt_meta.file_path, os.path.join(location, file_hash[:2], file_hash[2:4], f'{file_hash}.png'))
+        self.assertTrue(os.path.exists(receipt_meta.file_path))
+
+    def test_content_addressed_storage(self):
+        location, response, again = self.upload_with_backend('receipts.storage.ContentAddressedStorage')
+        self.assert_stored_by_hash(location, response)
+        self.assertEqual(again.status_code, 409)
+
+    def test_plain_file_system_storage(self):
+        location, response, again = self.upload_with_backend('django.core.files.storage.FileSystemStorage')
+        self.assert_stored_by_hash(location, response)
+        self.assertEqual(again.status_code, 409)
+
+    def test_upload_is_hard_linked_into_the_store(self):
+        temp_inodes, temp_file = [], ContentAddressedStorage.temp_file
+
+        def record_inode(storage):
+            f, path = temp_file(storage)
+            temp_inodes.append(os.stat(path).st_ino)
+            return f, path
+
+        with mock.patch.object(ContentAddressedStorage, 'temp_file', autospec=True, side_effect=record_inode):
+            location, response, _ = self.upload_with_backend('receipts.storage.ContentAddressedStorage')
+
+        self.assert_stored_by_hash(location, response)
+        # One temporary file per upload, created in the store; the blob is that same inode
+        self.assertEqual(len(temp_inodes), 2)
+        self.assertEqual(os.stat(ReceiptMetaData.objects.get().file_path).st_ino, temp_inodes[0])
+        self.assertEqual(os.listdir(os.path.join(location, '.tmp')), [])
+
+def flip_bits(hex_hash, bits):
+    value = int(hex_hash, 16)
+    for bit in bits:
+        value ^= 1 << bit
+    return f'{value:0{len(hex_hash)}x}'
+
+class NearDuplicateTests(TestCase):
+    PHASH = 'b333cccca5cca193'
+    DETAIL = '3c' * 64
+
+    def create_hashed(self, name, perceptual_hash, detail_hash=None):
+        receipt_meta = ReceiptMetaData(file_name=name, file_path=name, file_hash=f'hash-{name}')
+        receipt_meta.set_perceptual_hash(perceptual_hash, detail_hash)
+        receipt_meta.save()
+        return receipt_meta
+
+    def test_band_lookup_finds_every_hash_within_distance(self):
+        # Bits 0-15 are band 0, 16-31 band 1, and so on
+        same = self.create_hashed('same', self.PHASH)
+        one_band = self.create_hashed('one_band', flip_bits(self.PHASH, range(6)))
+        spread = self.create_hashed('spread', flip_bits(self.PHASH, [0, 1, 16, 17, 32, 48]))
+        self.create_hashed('too_far', flip_bits(self.PHASH, [0, 1, 16, 17, 32, 33, 48]))
+        self.create_hashed('every_band', flip_bits(self.PHASH, [0, 1, 2, 16, 17, 18, 32, 33, 34, 48, 49, 50]))
+
+        matches = dedupe.find_near_duplicates(self.PHASH, max_distance=6)
+
+        self.assertEqual([(meta.id, distance) for meta, distance in matches], [(same.id, 0), (one_band.id, 6), (spread.id, 6)])
+        self.assertEqual(dedupe.find_near_duplicates(self.PHASH, max_distance=6, exclude_id=same.id)[0][0].id, one_band.id)
+
+    def test_detail_hash_confirms_candidates(self):
+        close = self.create_hashed('close', self.PHASH, flip_bits(self.DETAIL, range(0, 512, 16)))
+        self.create_hashed('same_layout', self.PHASH, flip_bits(self.DETAIL, range(0, 512, 8)))
+        self.create_hashed('not_backfilled', self.PHASH)
+
+        confirmed = dedupe.find_near_duplicates(self.PHASH, detail_hash=self.DETAIL)
+
+        self.assertEqual([meta.id for meta, _ in confirmed], [close.id])
+        self.assertEqual(len(dedupe.find_near_duplicates(self.PHASH)), 3)
+
+    ORIGINAL = 'Corner Grocery\n12 Main St\nMilk 2.50\nBread 3.10\nEggs 4.25\nTea 5.00\nTOTAL 14.85'
+
+    def rescaled_copy(self, content):
+        image = Image.open(io.BytesIO(content)).convert('RGB').resize((360, 540))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        return buffer.getvalue()
+
+    def test_near_strategy_rejects_copies_but_not_receipts_with_the_same_layout(self):
+        original = receipt_image(self.ORIGINAL)
+        other = receipt_image('Corner Grocery\n12 Main St\nRice 6.40\nApples 1.99\nCheese 7.80\nJam 3.30\nTOTAL 19.49')
+        copy = self.rescaled_copy(original)
+        # Both share the original's layout closely enough to be pHash candidates
+        original_hash = utils.file_image_hashes(io.BytesIO(original), 'original.png')[0]
+        for content, name in [(other, 'other.png'), (copy, 'copy.jpg')]:
+            self.assertLessEqual(dedupe.hamming_distance(original_hash, utils.file_image_hashes(io.BytesIO(content), name)[0]), settings.NEAR_DUPLICATE_MAX_DISTANCE)
+
+        storage_settings, _ = temp_receipt_storage(self)
+        with storage_settings:
+            self.assertEqual(self.client.post('/upload', {'file': SimpleUploadedFile('original.png', original)}).status_code, 201)
+            rejected = self.client.post('/upload?duplicate_strategy=near', {'file': SimpleUploadedFile('copy.jpg', copy)})
+            accepted = self.client.post('/upload?duplicate_strategy=near', {'file': SimpleUploadedFile('other.png', other)})
+
+        self.assertEqual(rejected.status_code, 409)
+        self.assertEqual(rejected.json()['near_duplicates'][0]['existing_file_name'], 'original.png')
+        self.assertEqual(accepted.status_code, 201)
+
+    def test_near_rejection_keeps_blobs_other_receipts_use(self):
+        original = receipt_image(self.ORIGINAL)
+        copy = self.rescaled_copy(original)
+        copy_name = content_name(hashlib.sha256(copy).hexdigest(), '.jpg')
+        storage_settings, location = temp_receipt_storage(self)
+        with storage_settings:
+            self.client.post('/upload', {'file': SimpleUploadedFile('original.png', original)})
+            self.assertEqual(self.client.post('/upload?duplicate_strategy=near', {'file': SimpleUploadedFile('copy.jpg', copy)}).status_code, 409)
+            self.assertFalse(os.path.exists(os.path.join(location, copy_name)))
+
+            # A concurrent upload of the same bytes already points at the blob
+            create_receipt_meta('concurrent.jpg', file_path=os.path.join(location, copy_name))
+            self.assertEqual(self.client.post('/upload?duplicate_strategy=near', {'file': SimpleUploadedFile('copy.jpg', copy)}).status_code, 409)
+            self.assertTrue(os.path.exists(os.path.join(location, copy_name)))
+
+def text_lines(chars):
+    """Lines of text with `chars` non-whitespace characters in total."""
+    words = ['Espresso4.50'] * (chars // 12) + ['x' * (chars % 12)]
+    return [' '.join(words[i:i + 4]) for i in range(0, len(words), 4)]
+
+@mock.patch.object(utils, 'PDF_TEXT_FAST_PATH', True)
+class TextLayerTests(TestCase):
+    def text_pdf(self, page_chars):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'receipt.pdf')
+        write_text_pdf(path, [text_lines(chars) if chars else [] for chars in page_chars])
+        return path
+
+    def test_short_pages_of_a_digital_document_take_the_fast_path(self):
+        # A long folio whose continuation pages are short
+        texts = utils.text_layer_pages(self.text_pdf([1596, 146, 325, 146]))
+        self.assertEqual(len(texts), 4)
+        self.assertIn('Espresso4.50', texts[1])
+
+    def test_page_without_text_layer_falls_back_to_images(self):
+        path = self.text_pdf([1596, 0, 325])
+        self.assertIsNone(utils.text_layer_pages(path))
+        self.assertEqual(len(utils.text_layer_pages(path, page_numbers=[0, 2])), 2)
+
+    def test_too_little_text_falls_back_to_images(self):
+        self.assertIsNone(utils.text_layer_pages(self.text_pdf([150, 150])))
+
+class UnreadablePdfTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def receipt_meta(self, name, content=None):
+        path = os.path.join(self.directory, name)
+        if content is None:
+            write_text_pdf(path, [text_lines(400)])
+        else:
+            with open(path, 'wb') as f:
+                f.write(content)
+        return create_receipt_meta(name, file_path=path, is_valid=True)
+
+    def test_corrupt_pdf_returns_an_error_response(self):
+        receipt_meta = self.receipt_meta('corrupt.pdf', b'%PDF-1.7\nnot really a pdf')
+        for process in (services.validate_receipt, services.process_receipt, services.analyze_receipt):
+            payload, status_code = process(receipt_meta)
+            self.assertEqual(status_code, 400)
+            self.assertIn('Could not read PDF', payload['error'])
+
+    def test_corrupt_pdf_does_not_stop_a_batch(self):
+        corrupt, good = self.receipt_meta('corrupt.pdf', b'%PDF-1.7\nnot really a pdf'), self.receipt_meta('good.pdf')
+        state = batch.BatchState(os.path.join(self.directory, 'state.json'))
+        files = batch.write_batch_files(ReceiptMetaData.objects.all(), state, os.path.join(self.directory, 'batches'), write=lambda line: None)
+
+        self.assertEqual([error['id'] for error in state.failed], [corrupt.id])
+        self.assertEqual([list(f['requests']) for f in files], [[batch.custom_id(good.id)]])
+
+@mock.patch.object(utils, 'PDF_TEXT_FAST_PATH', True)
+class BatchExtractTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.server = start_server(latency=0, jitter=0, batch_latency=0.2)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        env = {'OPENAI_BASE_URL': self.server.base_url, 'OPENAI_API_KEY': 'test', 'LLM_MODEL': 'batch-model'}
+        self.enterContext(mock.patch.dict(os.environ, env))
+        self.client = utils.create_openai_client()
+        self.state_path = os.path.join(self.directory, 'state.json')
+
+    def receipt_meta(self, name):
+        path = os.path.join(self.directory, name)
+        write_text_pdf(path, [text_lines(400)])
+        return create_receipt_meta(name, file_path=path, file_hash=name, is_valid=True)
+
+    def run_batches(self, state, wait=True):
+        return batch.run_batches(self.client, ReceiptMetaData.objects.all(), state, os.path.join(self.directory, 'batches'),
+                                 wait=wait, poll_interval=0.05, write=lambda line: None)
+
+    def test_results_are_saved_after_resuming_from_the_state_file(self):
+        first, second = self.receipt_meta('first.pdf'), self.receipt_meta('second.pdf')
+        state = self.run_batches(batch.BatchState(self.state_path), wait=False)
+        self.assertEqual(len(state.pending()), 1)
+        self.assertFalse(Receipt.objects.exists())
+        # A request the provider never answered
+        dropped = self.receipt_meta('dropped.pdf')
+        state.batches[0]['requests'][batch.custom_id(dropped.id)] = 'key'
+        state.save()
+
+        resumed = batch.BatchState(self.state_path)
+        self.assertTrue(resumed.load())
+        resumed = self.run_batches(resumed)
+
+        self.assertEqual(resumed.pending(), [])
+        self.assertEqual(resumed.succeeded, 2)
+        self.assertEqual([failure['id'] for failure in resumed.failed], [dropped.id])
+        self.assertEqual(sorted(Receipt.objects.values_list('receipt_file_id', 'model_name')),
+                         [(first.id, 'batch-model'), (second.id, 'batch-model')])
+
+    def test_failed_and_invalid_results_are_recorded_without_blocking_the_batch(self):
+        cases = ((['not', 'an', 'object'], 'invalid receipt data'),
+                 ({'total_amount': '12,50'}, 'total_amount'),
+                 (None, 'Rate limit reached'))
+        for i, (content, error) in enumerate(cases):
+            ReceiptMetaData.objects.all().delete()
+            receipt_meta = self.receipt_meta(f'receipt-{i}.pdf')
+            self.server.content, self.server.error_rate = content, 1.0 if content is None else 0.0
+            state = self.run_batches(batch.BatchState(self.state_path), wait=True)
+
+            self.assertEqual(state.pending(), [])
+            self.assertEqual([failure['id'] for failure in state.failed], [receipt_meta.id])
+            self.assertIn(error, state.failed[0]['error'])
+            self.assertFalse(Receipt.objects.exists())
+            os.remove(self.state_path)
+
+def llm_response(content='{}', total_tokens=None):
+    usage = SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=total_tokens) if total_tokens else None
+    return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.limit(LLM_RATE_LIMIT_STATE=os.path.join(directory, 'state.json'))
+
+    def limit(self, **values):
+        self.enterContext(mock.patch.multiple(utils, **values))
+
+    def test_request_bucket_refills_at_rpm(self):
+        self.limit(LLM_RPM=2, LLM_TPM=0)
+        self.assertEqual(utils.try_acquire_rate_limit(100, 'interactive', 'a'), 0)
+        self.assertEqual(utils.try_acquire_rate_limit(100, 'interactive', 'a'), 0)
+        # The next request is half a minute of refill away
+        self.assertAlmostEqual(utils.try_acquire_rate_limit(100, 'interactive', 'a'), 30, delta=1)
+
+    def test_token_bucket_and_settling_to_reported_usage(self):
+        self.limit(LLM_RPM=0, LLM_TPM=1000)
+        self.assertEqual(utils.try_acquire_rate_limit(800, 'interactive', 'a'), 0)
+        self.assertAlmostEqual(utils.try_acquire_rate_limit(400, 'interactive', 'a'), 12, delta=0.5)
+
+        # The call used 300 tokens instead of the 800 estimated
+        utils.settle_rate_limit(800, llm_response(total_tokens=300))
+        self.assertEqual(utils.try_acquire_rate_limit(600, 'interactive', 'a'), 0)
+
+    def test_bulk_lane_leaves_a_reserve_for_interactive_calls(self):
+        self.limit(LLM_RPM=0, LLM_TPM=1000, LLM_BULK_RESERVE=0.2)
+        self.assertEqual(utils.try_acquire_rate_limit(700, 'interactive', 'a'), 0)
+        self.assertGreater(utils.try_acquire_rate_limit(150, 'bulk', 'b'), 0)
+        self.assertEqual(utils.try_acquire_rate_limit(150, 'interactive', 'a'), 0)
+
+    def test_async_wait_takes_the_file_lock_off_the_event_loop(self):
+        self.limit(LLM_RPM=60, LLM_TPM=0)
+        threads = []
+        def try_acquire(tokens, lane, waiter_id):
+            threads.append(threading.get_ident())
+            return 0.01 if len(threads) == 1 else 0
+
+        with mock.patch.object(utils, 'try_acquire_rate_limit', side_effect=try_acquire):
+            asyncio.run(utils.arate_limit_wait(100))
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_disabled_limiter_skips_token_estimate(self):
+        self.limit(LLM_RPM=0, LLM_TPM=0)
+        client = mock.Mock()
+        client.chat.completions.create = mock.AsyncMock(return_value=llm_response())
+        def get_client():
+            utils._async_semaphores[asyncio.get_running_loop()] = asyncio.Semaphore(1)
+            return client
+
+        with mock.patch.object(utils, 'estimate_tokens') as estimate_tokens, \
+                mock.patch.object(utils, 'get_async_openai_client', side_effect=get_client):
+            self.assertEqual(asyncio.run(utils.acall_llm([{'role': 'user', 'content': 'hi'}])), '{}')
+        estimate_tokens.assert_not_called()
+
+def api_error(error_class, status_code, headers=None):
+    response = SimpleNamespace(request=None, status_code=status_code, headers=headers or {})
+    return error_class(f'HTTP {status_code}', response=response, body=None)
+
+@mock.patch.multiple(utils, LLM_MAX_RETRIES=2, LLM_RETRY_BASE_DELAY=1.0, LLM_RETRY_MAX_DELAY=30.0, LLM_RPM=0, LLM_TPM=0)
+class LLMRetryTests(TestCase):
+    def call_llm(self, *outcomes):
+        """Run call_llm against a client returning outcomes in turn; returns (result, attempts, sleeps)."""
+        create = mock.Mock(side_effect=outcomes)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        with mock.patch.object(utils, 'get_openai_client', return_value=client), mock.patch.object(utils.time, 'sleep') as sleep:
+            result = utils.call_llm([])
+        return result, create.call_count, [call.args[0] for call in sleep.call_args_list]
+
+    def test_retryable_errors_back_off_and_honour_retry_after(self):
+        result, attempts, sleeps = self.call_llm(
+            api_error(openai.RateLimitError, 429, {'retry-after': '2'}),
+            api_error(openai.InternalServerError, 500),
+            llm_response('{"total_amount": 1}'),
+        )
+
+        self.assertEqual(result, '{"total_amount": 1}')
+        self.assertEqual(attempts, 3)
+        self.assertEqual(sleeps[0], 2.0)
+        # Full jitter: the second retry waits up to LLM_RETRY_BASE_DELAY * 2
+        self.assertTrue(0 <= sleeps[1] <= 2.0)
+
+    def test_retry_after_is_capped(self):
+        _, _, sleeps = self.call_llm(api_error(openai.RateLimitError, 429, {'retry-after': '120'}), llm_response())
+        self.assertEqual(sleeps, [30.0])
+
+    def test_client_errors_are_not_retried(self):
+        result, attempts, sleeps = self.call_llm(api_error(openai.BadRequestError, 400))
+        self.assertEqual((result['status_code'], attempts, sleeps), (400, 1, []))
+
+    def test_gives_up_after_max_retries(self):
+        result, attempts, sleeps = self.call_llm(*[api_error(openai.InternalServerError, 503)] * 3)
+        self.assertEqual((result['status_code'], attempts, len(sleeps)), (503, 3, 2))
+
+class RenderCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache_dir = os.path.join(directory, 'images')
+        self.enterContext(mock.patch.multiple(
+            utils, RENDER_CACHE_DIR=self.cache_dir, RENDER_CACHE_MANIFEST=os.path.join(self.cache_dir, 'manifest.json'),
+            RENDER_CACHE_LOCK=os.path.join(self.cache_dir, '.manifest.lock'),
+        ))
+        self.path = os.path.join(directory, 'receipt.png')
+        with open(self.path, 'wb') as f:
+            f.write(receipt_image('Corner Grocery\nTOTAL 12.50'))
+
+    def cached_hashes(self):
+        return {entry['file_hash'] for entry in utils.load_render_manifest().values()}
+
+    def test_least_recently_used_render_is_evicted(self):
+        # The same content under three hashes, so every render has the same size
+        first, second, third = 'a' * 64, 'b' * 64, 'c' * 64
+        utils.pre_processing_data(self.path, first)
+        size, = [entry['size'] for entry in utils.load_render_manifest().values()]
+
+        with mock.patch.object(utils, 'RENDER_CACHE_MAX_BYTES', size * 2 + size // 2):
+            utils.pre_processing_data(self.path, second)
+            # A cache hit makes the first render the most recently used
+            utils.pre_processing_data(self.path, first)
+            utils.pre_processing_data(self.path, third)
+
+        self.assertEqual(self.cached_hashes(), {first, third})
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir, 'bb', 'bb')), [])
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, 'aa', 'aa'))), 1)
+
+class ReceiptFilterTests(TestCase):
+    def test_date_only_upper_bound_includes_the_day(self):
+        Receipt.objects.create(merchant_name='Market', purchased_at='2025-01-31T23:30:00Z')
+        Receipt.objects.create(merchant_name='Market', purchased_at='2025-02-01T00:00:00Z')
+        response = self.client.get('/receipts/aggregate?group_by=merchant_name&purchased_from=2025-01-01&purchased_to=2025-01-31')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['count'], 1)
+
+    def test_out_of_range_bounds_return_400(self):
+        bounds = [
+            {'purchased_from': '2025-13-01'},
+            {'purchased_to': '2025-02-30'},
+            {'purchased_from': '2025-01-01T25:00:00'},
+            {'purchased_to': '9999-12-31'},
+            {'purchased_from': 'soon'},
+        ]
+        for bound in bounds:
+            for path, params in [('/receipts', {}), ('/receipts/aggregate', {'group_by': 'category'})]:
+                with self.subTest(path=path, bound=bound):
+                    response = self.client.get(path, {**params, **bound})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('must be an ISO 8601 date or datetime', response.json()['error'])
+
+class ExportTests(TestCase):
+    def export(self, **params):
+        response = self.client.get('/receipts/export', params)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, body
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_naive_since_is_taken_in_the_current_time_zone(self):
+        receipt = Receipt.objects.create(merchant_name='Market')
+        # 05:30 UTC is 00:30 in New York, after a naive midnight watermark
+        Receipt.objects.filter(id=receipt.id).update(updated_at='2025-01-02T05:30:00Z')
+        with warnings.catch_warnings():
+            # Django warns when a naive datetime reaches a query
+            warnings.simplefilter('error', RuntimeWarning)
+            status_code, body = self.export(since='2025-01-02T00:00:00')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(len(body.splitlines()), 1)
+        status_code, body = self.export(since='2025-01-02T01:00:00')
+        self.assertEqual(body, b'')
+
+    def test_invalid_parameters_return_400(self):
+        for params in [{'since': '2025-13-01T00:00:00'}, {'since': 'yesterday'}, {'chunk_size': '0'}, {'chunk_size': '-5'}, {'chunk_size': 'many'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.export(**params)[0], 400)
+
+    def test_command_rejects_invalid_parameters(self):
+        for args in [['--since', '2025-13-01T00:00:00'], ['--chunk-size', '0']]:
+            with self.subTest(args=args), self.assertRaises(CommandError):
+                call_command('export_receipts', *args)
+
+@override_settings(LLM_CACHE_ENABLED=True, LLM_CACHE_TTL=3600, LLM_CACHE_MAX_ENTRIES=2, LLM_CACHE_EVICT_INTERVAL=60)
+class LLMCacheTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(llm_cache, '_last_evicted', None))
+        self.enterContext(mock.patch.dict(os.environ, {'LLM_MODEL': 'model-a'}))
+
+    def test_key_covers_content_prompt_model_profile_and_pages(self):
+        key = llm_cache.make_key('hash', 'prompt')
+        self.assertEqual(key, llm_cache.make_key('hash', 'prompt'))
+        variants = [
+            llm_cache.make_key('other', 'prompt'),
+            llm_cache.make_key('hash', 'other prompt'),
+            llm_cache.make_key('hash', 'prompt', profile='compact'),
+            llm_cache.make_key('hash', 'prompt', page_numbers=[0]),
+        ]
+        with mock.patch.dict(os.environ, {'LLM_MODEL': 'model-b'}):
+            variants.append(llm_cache.make_key('hash', 'prompt'))
+        self.assertEqual(len({key, *variants}), 6)
+
+    def test_entries_expire_after_ttl(self):
+        call = mock.Mock(return_value='{"total_amount": 1}')
+        self.assertEqual(llm_cache.cached_llm_call('hash', 'prompt', call), '{"total_amount": 1}')
+        self.assertEqual(llm_cache.cached_llm_call('hash', 'prompt', call), '{"total_amount": 1}')
+        self.assertEqual(call.call_count, 1)
+
+        LLMResponseCache.objects.update(created_at=timezone.now() - timedelta(seconds=3601))
+        llm_cache.cached_llm_call('hash', 'prompt', call)
+        self.assertEqual(call.call_count, 2)
+
+    def test_errors_are_not_cached(self):
+        call = mock.Mock(return_value={'error': 'Rate limited', 'status_code': 429})
+        llm_cache.cached_llm_call('hash', 'prompt', call)
+        llm_cache.cached_llm_call('hash', 'prompt', call)
+        self.assertEqual(call.call_count, 2)
+        self.assertFalse(LLMResponseCache.objects.exists())
+
+    def test_eviction_runs_at_most_once_per_interval(self):
+        with mock.patch.object(llm_cache.time, 'monotonic', return_value=1000.0) as monotonic:
+            for i in range(4):
+                llm_cache.put(f'key-{i}', 'hash', '{}')
+            # Only the first put evicted, with a single entry in the table
+            self.assertEqual(LLMResponseCache.objects.count(), 4)
+
+            LLMResponseCache.objects.filter(key='key-0').update(created_at=timezone.now() - timedelta(seconds=3601))
+            monotonic.return_value = 1061.0
+            llm_cache.put('key-4', 'hash', '{}')
+        # key-0 expired; of the rest, the least recently used beyond 2 go
+        self.assertEqual(sorted(LLMResponseCache.objects.values_list('key', flat=True)), ['key-3', 'key-4'])
+
+class ReprocessTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = directory
+
+    def create_image_receipt(self, name, **kwargs):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(receipt_image(f'{name}\nTOTAL 12.50'))
+        return create_receipt_meta(name, file_path=path, is_valid=True, **kwargs)
+
+    def process_with_model(self, receipt_meta, model_name):
+        extract = mock.patch.object(utils, 'extract_receipt_data', return_value='{"merchant_name": "Market", "total_amount": 12.5}')
+        with extract, mock.patch.dict(os.environ, {'LLM_MODEL': model_name}):
+            _, status_code = services.process_receipt(receipt_meta, duplicate_strategy='reprocess')
+        self.assertEqual(status_code, 200)
+
+    def test_model_filter_uses_the_model_recorded_on_the_receipt(self):
+        old, new = self.create_image_receipt('old.png'), self.create_image_receipt('new.png')
+        self.process_with_model(old, 'model-a')
+        self.process_with_model(new, 'model-b')
+        # Cached responses expire; the recorded model does not
+        LLMResponseCache.objects.all().delete()
+
+        self.assertEqual(list(reprocess.filter_receipt_metas(model='model-a')), [old])
+        self.process_with_model(old, 'model-b')
+        self.assertEqual(set(reprocess.filter_receipt_metas(model='model-b')), {old, new})
+        self.assertFalse(reprocess.filter_receipt_metas(model='model-a').exists())
+
+class ModelOutputValidationTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def create_image_receipt(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(receipt_image(f'{name}\nTOTAL 12.50'))
+        return create_receipt_meta(name, file_path=path, is_valid=True)
+
+    def test_invalid_extraction_is_rejected_without_saving(self):
+        receipt_meta = self.create_image_receipt('r.png')
+        for output in ('{"merchant_name": "Market", "total_amount": "12,50"}', '[{"total_amount": 12.5}]'):
+            with mock.patch.object(utils, 'extract_receipt_data', return_value=output):
+                payload, status_code = services.process_receipt(receipt_meta, bypass_cache=True)
+            self.assertEqual(status_code, 502)
+            self.assertIn('invalid receipt data', payload['error'])
+        self.assertIn('total_amount', services.validate_extracted_data({'total_amount': '12,50'})[1][0]['fields'])
+        self.assertFalse(Receipt.objects.exists())
+
+    def test_invalid_analysis_fails_the_job_without_retrying(self):
+        receipt_meta = self.create_image_receipt('r.png')
+        output = '{"receipt_or_not": "yes", "receipt": {"purchased_at": "yesterday"}}'
+        job = jobs.enqueue_job('analyze', receipt_meta)
+        with mock.patch.object(utils, 'classify_and_extract_receipt_data', return_value=output):
+            jobs.work(once=True)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.status_code, job.attempts), ('failed', 502, 1))
+        self.assertIn('purchased_at', job.result['fields'])
+        self.assertFalse(Receipt.objects.exists())
+
+    def test_reprocess_with_not_a_receipt_verdict_drops_existing_data(self):
+        receipt_meta = self.create_image_receipt('r.png')
+        services.save_extracted_data(receipt_meta, {'merchant_name': 'Market', 'line_items': [{'description': 'Tea'}]})
+        with mock.patch.object(utils, 'classify_and_extract_receipt_data', return_value='{"receipt_or_not": "no"}'):
+            payload, status_code = services.analyze_receipt(receipt_meta, duplicate_strategy='reprocess', bypass_cache=True)
+
+        self.assertEqual(status_code, 200)
+        self.assertIsNone(payload['receipt'])
+        receipt_meta.refresh_from_db()
+        self.assertEqual((receipt_meta.is_valid, receipt_meta.is_processed), (False, False))
+        self.assertFalse(Receipt.objects.exists())
+        self.assertFalse(LineItem.objects.exists())
+
+    def test_non_object_analysis_returns_502(self):
+        receipt_meta = self.create_image_receipt('r.png')
+        with mock.patch.object(utils, 'classify_and_extract_receipt_data', return_value='["yes"]'):
+            payload, status_code = services.analyze_receipt(receipt_meta, bypass_cache=True)
+
+        self.assertEqual(status_code, 502)
+        self.assertIn('error', payload)
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'receipt.png')
+        with open(path, 'wb') as f:
+            f.write(receipt_image('Corner Grocery\nTOTAL 12.50'))
+        self.receipt_meta = create_receipt_meta('receipt.png', file_path=path, is_valid=True)
+
+    def test_only_one_worker_claims_a_job(self):
+        raced, other = jobs.enqueue_job('process', self.receipt_meta), jobs.enqueue_job('process', self.receipt_meta)
+        first = QuerySet.first
+
+        def claimed_by_another_worker(queryset):
+            # Another worker flips the job to running between the lookup and the claim
+            job_id = first(queryset)
+            if job_id == raced.id:
+                ReceiptJob.objects.filter(id=job_id).update(status='running', worker='worker-b')
+            return job_id
+
+        with mock.patch.object(QuerySet, 'first', autospec=True, side_effect=claimed_by_another_worker):
+            claimed = jobs.claim_next_job('worker-a')
+
+        self.assertEqual((claimed.id, claimed.worker, claimed.attempts), (other.id, 'worker-a', 1))
+        raced.refresh_from_db()
+        self.assertEqual((raced.worker, raced.attempts), ('worker-b', 0))
+        self.assertIsNone(jobs.claim_next_job('worker-c'))
+
+    @override_settings(RECEIPT_JOB_MAX_ATTEMPTS=2)
+    def test_failed_attempts_are_retried_up_to_max_attempts(self):
+        recovers, keeps_failing = jobs.enqueue_job('process', self.receipt_meta), jobs.enqueue_job('validate', self.receipt_meta)
+        handlers = {
+            'process': mock.Mock(side_effect=[RuntimeError('timed out'), ({'id': 1}, 200)]),
+            'validate': mock.Mock(side_effect=RuntimeError('boom')),
+        }
+        with mock.patch.dict(jobs.JOB_HANDLERS, handlers):
+            jobs.work('worker', once=True)
+
+        recovers.refresh_from_db()
+        keeps_failing.refresh_from_db()
+        self.assertEqual((recovers.status, recovers.attempts, recovers.status_code, recovers.error), ('succeeded', 2, 200, None))
+        self.assertEqual((keeps_failing.status, keeps_failing.attempts, keeps_failing.status_code), ('failed', 2, 500))
+        self.assertEqual(keeps_failing.error, 'boom')
+
+    @override_settings(RECEIPT_JOB_MAX_ATTEMPTS=2)
+    def test_stale_running_jobs_are_requeued_or_failed(self):
+        started_at = timezone.now() - timedelta(hours=1)
+        retried, exhausted = jobs.enqueue_job('process', self.receipt_meta), jobs.enqueue_job('process', self.receipt_meta)
+        ReceiptJob.objects.filter(id=retried.id).update(status='running', started_at=started_at, attempts=1)
+        ReceiptJob.objects.filter(id=exhausted.id).update(status='running', started_at=started_at, attempts=2)
+
+        self.assertEqual(jobs.requeue_stale_jobs(stale_after=60), 1)
+        self.assertEqual(ReceiptJob.objects.get(id=retried.id).status, 'queued')
+        exhausted.refresh_from_db()
+        self.assertEqual((exhausted.status, exhausted.error), ('failed', 'Job timed out'))
+
+    def test_job_status_view_reports_the_result(self):
+        response = self.client.get(f'/process/{self.receipt_meta.id}?async=true')
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], 'queued')
+
+        extract = mock.patch.object(utils, 'extract_receipt_data', return_value='{"merchant_name": "Market", "total_amount": 12.5}')
+        with extract:
+            jobs.work('worker', once=True)
+
+        body = self.client.get(status_url).json()
+        self.assertEqual((body['status'], body['status_code'], body['attempts']), ('succeeded', 200, 1))
+        self.assertEqual(body['result']['merchant_name'], 'Market')
+        self.assertEqual(self.client.get('/jobs/999999').status_code, 404)
+
+class BatchUploadTests(TestCase):
+    def upload(self, *files):
+        return self.client.post('/upload/batch', {'files': [SimpleUploadedFile(name, content) for name, content in files]})
+
+    def stored_files(self, location):
+        return sorted(name for _, _, names in os.walk(location) for name in names)
+
+    def test_new_files_are_created_and_duplicates_skipped(self):
+        storage_settings, location = temp_receipt_storage(self)
+        first, second = receipt_image('Corner Grocery\nTOTAL 12.50'), receipt_image('Book Shop\nTOTAL 30.00')
+        with storage_settings:
+            self.upload(('first.png', first))
+            response = self.upload(('again.png', first), ('second.png', second), ('copy.png', second))
+
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual([receipt['file_name'] for receipt in body['created']], ['second.png'])
+        self.assertEqual([duplicate['file_name'] for duplicate in body['duplicates']], ['copy.png', 'again.png'])
+        self.assertEqual(len(self.stored_files(location)), 2)
+
+    def test_image_hashes_are_computed_before_the_transaction(self):
+        storage_settings, _ = temp_receipt_storage(self)
+        depth, depths = len(connection.atomic_blocks), []
+        file_image_hashes = utils.file_image_hashes
+
+        def record_depth(file_path):
+            depths.append(len(connection.atomic_blocks))
+            return file_image_hashes(file_path)
+
+        with storage_settings, mock.patch.object(utils, 'file_image_hashes', side_effect=record_depth):
+            response = self.upload(('first.png', receipt_image('Corner Grocery')), ('second.png', receipt_image('Book Shop')))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(depths, [depth, depth])
+        self.assertEqual(ReceiptMetaData.objects.filter(perceptual_hash__isnull=False, detail_hash__isnull=False).count(), 2)
+
+    def test_failed_insert_rolls_back_and_deletes_unreferenced_blobs(self):
+        storage_settings, location = temp_receipt_storage(self)
+        shared, lone = receipt_image('Corner Grocery\nTOTAL 12.50'), receipt_image('Book Shop\nTOTAL 30.00')
+        shared_path = os.path.join(location, content_name(hashlib.sha256(shared).hexdigest(), '.png'))
+        # Another receipt already points at the path the shared file is stored under
+        create_receipt_meta('concurrent.png', file_path=shared_path)
+
+        bulk_create = mock.patch.object(ReceiptMetaData.objects, 'bulk_create', side_effect=IntegrityError)
+        with storage_settings, bulk_create:
+            response = self.upload(('shared.png', shared), ('lone.png', lone))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(list(ReceiptMetaData.objects.values_list('file_name', flat=True)), ['concurrent.png'])
+        self.assertEqual(self.stored_files(location), [os.path.basename(shared_path)])
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        purchased_at = [None, '2025-01-02T00:00:00Z', None, '2025-01-01T00:00:00Z', '2025-01-02T00:00:00Z', None, '2025-01-03T00:00:00Z']
+        for value in purchased_at:
+            Receipt.objects.create(merchant_name='Market', purchased_at=value)
+
+    def walk(self, ordering, limit=2):
+        ids, cursor = [], None
+        while True:
+            params = {'ordering': ordering, 'limit': limit, 'fields': 'id'}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get('/receipts', params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            ids += [receipt['id'] for receipt in body['results']]
+            cursor = body['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_pages_follow_the_full_ordering_across_nulls(self):
+        receipts = list(Receipt.objects.all())
+        nulls = sorted(receipt.id for receipt in receipts if receipt.purchased_at is None)
+        dated = sorted((receipt.purchased_at, receipt.id) for receipt in receipts if receipt.purchased_at)
+        expected = {
+            'id': sorted(receipt.id for receipt in receipts),
+            '-id': sorted((receipt.id for receipt in receipts), reverse=True),
+            # NULLs first ascending and last descending, ties broken by id
+            'purchased_at': nulls + [receipt_id for _, receipt_id in dated],
+            '-purchased_at': [receipt_id for _, receipt_id in reversed(dated)] + nulls[::-1],
+        }
+        for ordering, ids in expected.items():
+            for limit in (1, 2, 3):
+                with self.subTest(ordering=ordering, limit=limit):
+                    self.assertEqual(self.walk(ordering, limit), ids)
+
+    def test_cursor_must_match_the_ordering(self):
+        cursor = self.client.get('/receipts', {'ordering': 'purchased_at', 'limit': 1}).json()['next_cursor']
+        self.assertEqual(self.client.get('/receipts', {'ordering': '-purchased_at', 'cursor': cursor}).status_code, 400)
+        self.assertEqual(self.client.get('/receipts', {'cursor': 'not-a-cursor'}).status_code, 400)
+
+class CheckpointTests(TransactionTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'checkpoint.json')
+        self.ids = [create_receipt_meta(f'r{i}.pdf').id for i in range(6)]
+
+    def test_last_id_only_advances_past_contiguous_finished_receipts(self):
+        checkpoint = reprocess.Checkpoint(self.path, {})
+        for receipt_meta_id in (1, 2, 3):
+            checkpoint.start(receipt_meta_id)
+        checkpoint.finish(2)
+        self.assertEqual(checkpoint.last_id, 0)
+        checkpoint.finish(1, 'boom')
+        self.assertEqual(checkpoint.last_id, 2)
+        checkpoint.finish(3)
+        self.assertEqual((checkpoint.last_id, checkpoint.succeeded, checkpoint.failed), (3, 2, [{'id': 1, 'error': 'boom'}]))
+
+    def run_reprocess(self, handler, filters=None):
+        checkpoint = reprocess.Checkpoint(self.path, filters or {'mode': 'process'})
+        checkpoint.load()
+        with mock.patch.dict(reprocess.REPROCESS_HANDLERS, {'process': handler}):
+            return reprocess.reprocess(ReceiptMetaData.objects.all(), checkpoint, concurrency=1, write=lambda line: None)
+
+    def test_interrupted_run_resumes_after_the_checkpoint(self):
+        seen = []
+        def interrupted(receipt_meta, duplicate_strategy, bypass_cache=False):
+            if receipt_meta.id == self.ids[3]:
+                raise KeyboardInterrupt
+            seen.append(receipt_meta.id)
+            return ({'error': 'No data extracted from receipt.'}, 400) if receipt_meta.id == self.ids[1] else ({}, 200)
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.run_reprocess(interrupted)
+        self.assertEqual(seen, self.ids[:3])
+
+        seen.clear()
+        checkpoint = self.run_reprocess(lambda receipt_meta, *args, **kwargs: seen.append(receipt_meta.id) or ({}, 200))
+        self.assertEqual(seen, self.ids[3:])
+        self.assertEqual(checkpoint.last_id, self.ids[-1])
+        self.assertEqual(checkpoint.succeeded, 5)
+        self.assertEqual(checkpoint.failed, [{'id': self.ids[1], 'error': 'No data extracted from receipt.'}])
+
+    def test_checkpoint_for_other_filters_is_not_resumed(self):
+        reprocess.Checkpoint(self.path, {'model': 'model-a'}).save()
+        with self.assertRaises(ValueError):
+            reprocess.Checkpoint(self.path, {'model': 'model-b'}).load()
+
+class MetricsTests(TestCase):
+    def histogram(self, *args, **kwargs):
+        histogram = metrics.Histogram(*args, **kwargs)
+        self.addCleanup(metrics._registry.remove, histogram)
+        return histogram
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = self.histogram('test_seconds', 'Test latency.', ['view'], buckets=(0.01, 0.05))
+        for value in (0.003, 0.02, 0.02, 100):
+            histogram.observe(value, view='list')
+
+        self.assertEqual(histogram.render(), [
+            '# HELP test_seconds Test latency.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="list",le="0.01"} 1',
+            'test_seconds_bucket{view="list",le="0.05"} 3',
+            'test_seconds_bucket{view="list",le="+Inf"} 4',
+            f'test_seconds_sum{{view="list"}} {0.003 + 0.02 + 0.02 + 100}',
+            'test_seconds_count{view="list"} 4',
+        ])
+
+    def test_label_values_are_escaped(self):
+        histogram = self.histogram('test_escaped', 'Escaping.', ['path'], buckets=())
+        histogram.observe(1, path='a"b\\c\nd')
+        self.assertIn('test_escaped_count{path="a\\"b\\\\c\\nd"} 1', histogram.render())
+
+    def test_metrics_endpoint_and_request_log(self):
+        with self.assertLogs('receipts.metrics', 'INFO') as logs:
+            self.client.get('/receipts')
+        trace = json.loads(logs.records[0].getMessage())
+        self.assertEqual((trace['event'], trace['view'], trace['status']), ('request', 'list-receipts', 200))
+        self.assertGreaterEqual(trace['db_queries'], 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('# TYPE receipt_http_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'receipt_http_request_duration_seconds_count\{view="list-receipts",method="GET",status="200"\} \d+')
@@ -0,0 +1,151 @@
+import hashlib, os, tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from receipts.storage import FileTooLarge, get_receipt_storage, store_file
+
+# Room for multipart boundaries, part headers and small form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'File is too large'
+
+class HashingTempFile:
+    """
+    A local temporary file that computes the SHA-256 of everything written to
+    it and refuses to grow past max_bytes. It is created inside the store when
+    the storage backend offers temp_file() (ContentAddressedStorage), so it can
+    be hard linked into place, and in FILE_UPLOAD_TEMP_DIR otherwise.
+    """
+
+    def __init__(self, max_bytes=None, storage=None):
+        if hasattr(storage, 'temp_file'):
+            self.file, self.path = storage.temp_file()
+        else:
+            fd, self.path = tempfile.mkstemp(dir=settings.FILE_UPLOAD_TEMP_DIR, prefix='receipt-upload-')
+            self.file = os.fdopen(fd, 'wb')
+        self.hash_sha256 = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise FileTooLarge(self.max_bytes)
+        self.hash_sha256.update(chunk)
+        self.file.write(chunk)
+
+    def store(self, storage, extension):
+        """
+        Save the finished file to storage under its content hash, then remove it.
+
+        Returns:
+            tuple: (storage name, SHA-256 hex digest, True if the blob is new)
+        """
+        self.file.close()
+        try:
+            file_hash = self.hash_sha256.hexdigest()
+            name, is_new = store_file(storage, self.path, file_hash, extension)
+        finally:
+            self.discard()
+        return name, file_hash, is_new
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def store_chunks(storage, chunks, extension, max_bytes=None):
+    """
+    Stream chunks into storage, hashing them on the way.
+
+    Raises:
+        FileTooLarge: The content is longer than max_bytes; nothing is stored.
+
+    Returns:
+        tuple: (storage name, SHA-256 hex digest, True if the blob is new)
+    """
+    temp = HashingTempFile(max_bytes, storage)
+    try:
+        for chunk in chunks:
+            temp.write(chunk)
+    except BaseException:
+        temp.discard()
+        raise
+    return temp.store(storage, extension)
+
+class StoredUploadedFile(UploadedFile):
+    """An upload that has already been written to the receipt storage."""
+    def __init__(self, name, storage_name, path, file_hash, is_new, content_type, size, charset):
+        super().__init__(open(path, 'rb'), name, content_type, size, charset)
+        self.storage_name = storage_name
+        self.path = path
+        self.file_hash = file_hash
+        self.is_new = is_new
+
+class StorageUploadHandler(FileUploadHandler):
+    """
+    Streams uploaded files into a local temporary file, hashing each chunk as
+    it arrives so memory use stays flat however large the file is, then saves
+    it to the receipt storage under its hash with the Storage API. Local
+    backends move or link the temporary file into place instead of copying it.
+
+    Files whose extension is not in `extensions` are passed on to the next
+    handler (e.g. ZIP archives, which are expanded by the view). Each stored
+    file is limited to max_bytes; with limit_request=True a request whose
+    Content-Length already exceeds that is rejected before any of it is read.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None, extensions=None, max_bytes=None, limit_request=False, storage=None):
+        super().__init__(request)
+        self.extensions = tuple(extensions or ())
+        self.max_bytes = settings.RECEIPT_UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+        self.limit_request = limit_request
+        self.storage = storage or get_receipt_storage()
+        self.temp = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if self.limit_request and self.max_bytes and content_length > self.max_bytes + MULTIPART_OVERHEAD_BYTES:
+            raise UploadTooLarge({'error': str(FileTooLarge(self.max_bytes))})
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.temp = None
+        if self.extensions and not self.file_name.lower().endswith(self.extensions):
+            return
+        self.temp = HashingTempFile(self.max_bytes, self.storage)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.temp is None:
+            return raw_data
+        try:
+            self.temp.write(raw_data)
+        except FileTooLarge as e:
+            self.discard()
+            raise UploadTooLarge({'error': str(e), 'file_name': self.file_name})
+        return None
+
+    def file_complete(self, file_size):
+        if self.temp is None:
+            return None
+        temp, self.temp = self.temp, None
+        storage_name, file_hash, is_new = temp.store(self.storage, os.path.splitext(self.file_name)[1])
+        return StoredUploadedFile(
+            self.file_name, storage_name, self.storage.path(storage_name), file_hash, is_new,
+            self.content_type, file_size, self.charset,
+        )
+
+    def discard(self):
+        if self.temp is not None:
+            self.temp.discard()
+            self.temp = None
+
+    def upload_interrupted(self):
+        self.discard()
@@ -1,10 +1,24 @@
 from django.urls import path
-from .views import UploadReceiptView, ValidateReceiptView, ProcessReceiptView, ListReceiptsView, ReceiptDetailView
+from .views import (
+    UploadReceiptView, BatchUploadReceiptView, CheckDuplicateView, ValidateReceiptView, ProcessReceiptView, AnalyzeReceiptView, ListReceiptsView, IngestReceiptsView, AggregateReceiptsView, ExportReceiptsView, ReceiptDetailView, JobStatusView, LLMCacheStatsView, MetricsView,
+    AsyncValidateReceiptView, AsyncProcessReceiptView,
+)
 
 urlpatterns = [
     path('upload', UploadReceiptView.as_view(), name='upload-receipt'),
+    path('upload/batch', BatchUploadReceiptView.as_view(), name='batch-upload-receipts'),
+    path('check_duplicate', CheckDuplicateView.as_view(), name='check-duplicate'),
     path('validate/<int:receipt_id>', ValidateReceiptView.as_view(), name='validate-receipt'),
     path('process/<int:receipt_id>', ProcessReceiptView.as_view(), name='process-receipt'),
+    path('analyze/<int:receipt_id>', AnalyzeReceiptView.as_view(), name='analyze-receipt'),
+    path('async/validate/<int:receipt_id>', AsyncValidateReceiptView.as_view(), name='async-validate-receipt'),
+    path('async/process/<int:receipt_id>', AsyncProcessReceiptView.as_view(), name='async-process-receipt'),
     path('receipts', ListReceiptsView.as_view(), name='list-receipts'),
+    path('receipts/ingest', IngestReceiptsView.as_view(), name='ingest-receipts'),
+    path('receipts/aggregate', AggregateReceiptsView.as_view(), name='aggregate-receipts'),
+    path('receipts/export', ExportReceiptsView.as_view(), name='export-receipts'),
     path('receipts/<int:id>', ReceiptDetailView.as_view(), name='receipt-detail'),
+    path('jobs/<int:job_id>', JobStatusView.as_view(), name='job-status'),
+    path('llm-cache/stats', LLMCacheStatsView.as_view(), name='llm-cache-stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ] 
\ No newline at end of file
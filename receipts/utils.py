@@ -1,127 +1,935 @@
 from io import BytesIO
-import os
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import asyncio, contextvars, os, json, math, multiprocessing, random, re, shutil, threading, time, uuid, weakref
 import base64, hashlib
 
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to unlocked manifest updates
+    fcntl = None
+
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import pypdfium2 as pdfium
-from PIL import Image
+from PIL import Image, ImageOps
 from dotenv import load_dotenv
+from django.conf import settings
 
-from receipts.prompts import RECEIPT_EXTRACT_PROMPT, CLASSIFICATION_PROMPT
+from receipts.prompts import RECEIPT_EXTRACT_PROMPT, RECEIPT_EXTRACT_TEXT_PROMPT, CLASSIFICATION_PROMPT, CLASSIFY_AND_EXTRACT_PROMPT
+from receipts import metrics
 
 load_dotenv()
 
-def convert_pdf_to_images(file_path, file_id, scale=100/72):
-        pdf_file = pdfium.PdfDocument(file_path)
-        page_indices = [i for i in range(len(pdf_file))]
+# Rendered pages are cached per (file content, render parameters) so validate and
+# process, and re-uploads of the same file, only rasterize a document once.
+RENDER_CACHE_DIR = 'images'
+RENDER_CACHE_MANIFEST = os.path.join(RENDER_CACHE_DIR, 'manifest.json')
+RENDER_CACHE_LOCK = os.path.join(RENDER_CACHE_DIR, '.manifest.lock')
+RENDER_CACHE_MAX_BYTES = int(os.getenv('RENDER_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Encoding profiles control how pages are rasterized and compressed before they
+# are sent to the model. Payload size, base64 time and token cost all grow with
+# resolution and quality. 'adaptive' also caps the short side at 768px, the size
+# vision models downscale to anyway, and renders PDFs directly at that size.
+ENCODING_PROFILES = {
+    'default': {'scale': 100/72, 'max_dimension': 1536, 'max_short_side': None, 'quality': 95, 'grayscale': False, 'format': 'JPEG'},
+    'compact': {'scale': 100/72, 'max_dimension': 1280, 'max_short_side': None, 'quality': 80, 'grayscale': True, 'format': 'JPEG'},
+    'webp': {'scale': 100/72, 'max_dimension': 1536, 'max_short_side': None, 'quality': 80, 'grayscale': False, 'format': 'WEBP'},
+    'adaptive': {'scale': 150/72, 'max_dimension': 2048, 'max_short_side': 768, 'quality': 85, 'grayscale': True, 'format': 'JPEG'},
+}
+RENDER_PROFILE = os.getenv('RENDER_PROFILE', 'default')
+
+# PDFs with at least RENDER_PARALLEL_MIN_PAGES pages are rendered across
+# RENDER_WORKERS processes; 0 or 1 keeps rendering in the calling process.
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', 0))
+RENDER_PARALLEL_MIN_PAGES = int(os.getenv('RENDER_PARALLEL_MIN_PAGES', 4))
+_render_pools = {}
+_render_pools_lock = threading.Lock()
+
+# Page selection: long PDFs are cut to PDF_MAX_PAGES pages (0 = no limit),
+# preferring the pages whose text layer looks most like a receipt when
+# PDF_PAGE_PRESCAN is on. CLASSIFY_FIRST_PAGE_ONLY classifies from page 1 alone.
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', 0))
+PDF_PAGE_PRESCAN = os.getenv('PDF_PAGE_PRESCAN', 'true').lower() in ('1', 'true', 'yes')
+CLASSIFY_FIRST_PAGE_ONLY = os.getenv('CLASSIFY_FIRST_PAGE_ONLY', 'false').lower() in ('1', 'true', 'yes')
+PAGE_RANGE_PATTERN = re.compile(r'^\s*\d+(\s*-\s*\d+)?(\s*,\s*\d+(\s*-\s*\d+)?)*\s*$')
+RECEIPT_KEYWORDS = re.compile(
+    r'\b(total|subtotal|tax|vat|gst|amount|paid|payment|receipt|invoice|balance|due|cash|change|tip|visa|mastercard|amex)\b',
+    re.IGNORECASE,
+)
+MONEY_PATTERN = re.compile(r'\d[\d,]*[.,]\d{2}\b')
+
+# Text-layer fast path: when PDF_TEXT_FAST_PATH is on, every selected page of a
+# PDF has a text layer (PDF_TEXT_PAGE_MIN_CHARS, so a page number alone doesn't
+# count) and the pages average PDF_TEXT_MIN_CHARS characters, extraction sends
+# that text instead of rendered page images.
+PDF_TEXT_FAST_PATH = os.getenv('PDF_TEXT_FAST_PATH', 'false').lower() in ('1', 'true', 'yes')
+PDF_TEXT_MIN_CHARS = int(os.getenv('PDF_TEXT_MIN_CHARS', 200))
+PDF_TEXT_PAGE_MIN_CHARS = int(os.getenv('PDF_TEXT_PAGE_MIN_CHARS', 20))
+
+# Perceptual hashes are computed from a small grayscale render of the first page
+PHASH_RENDER_SIZE = 384
+PHASH_DCT_SIZE = 32
+# The detail hash compares horizontal gradients on an 8 x 64 grid over the
+# page's content, fine enough to tell apart receipts sharing a layout
+DETAIL_HASH_WIDTH = 8
+DETAIL_HASH_HEIGHT = 64
+DETAIL_HASH_INK_LEVEL = 60
+_PHASH_COS = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * PHASH_DCT_SIZE)) for x in range(PHASH_DCT_SIZE)]
+    for u in range(8)
+]
+
+# One OpenAI client (and HTTP connection pool) per process, shared by all calls
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 120))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', 1.0))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', 30.0))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_llm_semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+# Provider rate limits, shared by every process on the host through a state
+# file guarded by a file lock. 0 disables the limit. Calls in the 'bulk' lane
+# (backfills) wait while 'interactive' calls are queued and leave
+# LLM_BULK_RESERVE of each bucket to them.
+LLM_RPM = int(os.getenv('LLM_RPM', 0))
+LLM_TPM = int(os.getenv('LLM_TPM', 0))
+LLM_RATE_LIMIT_STATE = settings.LLM_RATE_LIMIT_STATE
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv('LLM_RATE_LIMIT_MAX_WAIT', 300))
+LLM_BULK_RESERVE = float(os.getenv('LLM_BULK_RESERVE', 0.2))
+# Token estimate: images are billed per tile (Gemini: 258 tokens per 768px tile,
+# OpenAI high detail: 170 per 512px tile), text at ~4 characters per token
+LLM_IMAGE_TILE_SIZE = int(os.getenv('LLM_IMAGE_TILE_SIZE', 768))
+LLM_IMAGE_TILE_TOKENS = int(os.getenv('LLM_IMAGE_TILE_TOKENS', 258))
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv('LLM_EXPECTED_OUTPUT_TOKENS', 600))
+LLM_LANES = ('interactive', 'bulk')
+_llm_lane = contextvars.ContextVar('llm_lane', default='interactive')
+
+# Async calls (ASGI views) share one AsyncOpenAI client per event loop
+LLM_MAX_ASYNC_CONCURRENCY = int(os.getenv('LLM_MAX_ASYNC_CONCURRENCY', 200))
+_async_clients = weakref.WeakKeyDictionary()
+_async_semaphores = weakref.WeakKeyDictionary()
+
+def get_encoding_profile(profile=None):
+    """Resolve a profile name (or dict) to a full set of encoding options."""
+    if isinstance(profile, dict):
+        return {**ENCODING_PROFILES['default'], **profile}
+    name = profile or RENDER_PROFILE
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f'Unknown encoding profile: {name}')
+    return ENCODING_PROFILES[name]
+
+def fit_ratio(width, height, profile):
+    """Largest ratio <= 1 that fits (width, height) inside the profile's size limits."""
+    ratio = min(1, profile['max_dimension'] / max(width, height))
+    if profile.get('max_short_side'):
+        ratio = min(ratio, profile['max_short_side'] / min(width, height))
+    return ratio
+
+def encode_page(image, profile=None):
+    """Downscale a PIL image to fit the encoding profile and encode it once."""
+    profile = get_encoding_profile(profile)
+    ratio = fit_ratio(image.width, image.height, profile)
+    if ratio < 1:
+        new_size = (max(1, int(image.width * ratio)),
+                    max(1, int(image.height * ratio)))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+    mode = 'L' if profile['grayscale'] else 'RGB'
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    image_byte_array = BytesIO()
+    image.save(image_byte_array, format=profile['format'],
+               quality=profile['quality'],
+               optimize=True)
+    return image_byte_array.getvalue()
+
+def iter_pdf_pages(file_path, profile=None, start=0, stop=None, page_numbers=None):
+    """Yield pages [start, stop), or the 0-based page_numbers, of a PDF as encoded image bytes."""
+    profile = get_encoding_profile(profile)
+    pdf_file = pdfium.PdfDocument(file_path)
+    try:
+        if page_numbers is None:
+            stop = len(pdf_file) if stop is None else min(stop, len(pdf_file))
+            page_numbers = range(start, stop)
+        for i in page_numbers:
+            page = pdf_file[i]
+            # Render straight at the target size rather than rasterizing large and shrinking
+            width, height = page.get_size()
+            scale = profile['scale'] * fit_ratio(width * profile['scale'], height * profile['scale'], profile)
+            yield encode_page(page.render(scale=scale, grayscale=profile['grayscale']).to_pil(), profile)
+    finally:
+        pdf_file.close()
+
+def render_pdf_pages(file_path, page_numbers, profile=None):
+    """Render a slice of the selected pages; runs inside a render pool worker, which opens the PDF itself."""
+    return list(iter_pdf_pages(file_path, profile, page_numbers=page_numbers))
+
+def get_render_pool(workers):
+    """Return the process-wide render pool with the given number of workers, creating it on first use."""
+    with _render_pools_lock:
+        if workers not in _render_pools:
+            # spawn, not fork: forking a threaded web/worker process can deadlock
+            _render_pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _render_pools[workers]
+
+def split_page_ranges(num_pages, parts):
+    """Split [0, num_pages) into at most `parts` contiguous, nearly equal ranges."""
+    parts = max(1, min(parts, num_pages))
+    size, extra = divmod(num_pages, parts)
+    ranges, start = [], 0
+    for part in range(parts):
+        stop = start + size + (1 if part < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+def count_pdf_pages(file_path):
+    pdf_file = pdfium.PdfDocument(file_path)
+    try:
+        return len(pdf_file)
+    finally:
+        pdf_file.close()
+
+def parse_page_range(page_range, num_pages):
+    """
+    Turn a 1-based page range such as '1-3,7' into sorted 0-based page numbers.
+    Pages past the end of the document are ignored.
+
+    Raises:
+        ValueError: The range is malformed or selects no page of the document.
+    """
+    if not PAGE_RANGE_PATTERN.match(page_range):
+        raise ValueError(f'Invalid page range: {page_range}. Use 1-based pages such as 1-3,7')
+    selected = set()
+    for part in page_range.split(','):
+        first, _, last = part.partition('-')
+        first, last = int(first), int(last or first)
+        if first < 1 or last < first:
+            raise ValueError(f'Invalid page range: {page_range}. Use 1-based pages such as 1-3,7')
+        selected.update(range(first - 1, min(last, num_pages)))
+    if not selected:
+        raise ValueError(f'Page range {page_range} selects no pages; the document has {num_pages}')
+    return sorted(selected)
+
+def receipt_text_score(text):
+    """How much a page's text looks like a receipt: keyword hits weigh more than amounts."""
+    return 3 * len(RECEIPT_KEYWORDS.findall(text)) + len(MONEY_PATTERN.findall(text))
+
+def prescan_pdf_pages(pdf_file, page_numbers):
+    """Score pages from their text layer without rendering them; scanned pages score 0."""
+    scores = {}
+    for i in page_numbers:
+        page = pdf_file[i]
+        textpage = page.get_textpage()
+        try:
+            scores[i] = receipt_text_score(textpage.get_text_range())
+        finally:
+            textpage.close()
+            page.close()
+    return scores
+
+def select_pdf_pages(file_path, page_range=None, max_pages=None, prescan=None):
+    """
+    Choose which pages of a PDF to render. An explicit page_range narrows the
+    candidates; when more than max_pages remain, the pre-scan keeps the
+    highest-scoring ones (in document order), or the first ones if no page has
+    a usable text layer.
+
+    Args:
+        page_range: 1-based range string such as '1-3,7'.
+        max_pages: Page cap, defaults to PDF_MAX_PAGES (0 = no cap).
+        prescan: Rank pages by their text layer, defaults to PDF_PAGE_PRESCAN.
+
+    Returns:
+        list or None: Sorted 0-based page numbers, or None for every page.
+    """
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    prescan = PDF_PAGE_PRESCAN if prescan is None else prescan
+    pdf_file = pdfium.PdfDocument(file_path)
+    try:
         num_pages = len(pdf_file)
+        candidates = parse_page_range(page_range, num_pages) if page_range else list(range(num_pages))
+        if max_pages and len(candidates) > max_pages:
+            scores = prescan_pdf_pages(pdf_file, candidates) if prescan else {}
+            if any(scores.values()):
+                candidates = sorted(sorted(candidates, key=lambda i: (-scores[i], i))[:max_pages])
+            else:
+                candidates = candidates[:max_pages]
+    finally:
+        pdf_file.close()
+    return None if len(candidates) == num_pages else candidates
 
-        renderer = pdf_file.render(
-            pdfium.PdfBitmap.to_pil,
-            page_indices=page_indices,
-            scale=scale,
-        )
+def normalize_page_text(text):
+    """Drop trailing spaces and blank-line runs from a text layer; pdfium uses CRLF line ends."""
+    lines = [line.rstrip() for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n')]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
 
-        os.makedirs(f'images/{file_id}', exist_ok=True)
-        for i, image in zip(page_indices, renderer):
-            image_byte_array = BytesIO()
+def read_pdf_text(file_path, page_numbers=None):
+    """Text layer of the selected (default: all) PDF pages, one string per page."""
+    pdf_file = pdfium.PdfDocument(file_path)
+    try:
+        texts = []
+        for i in range(len(pdf_file)) if page_numbers is None else page_numbers:
+            page = pdf_file[i]
+            textpage = page.get_textpage()
+            try:
+                texts.append(normalize_page_text(textpage.get_text_range()))
+            finally:
+                textpage.close()
+                page.close()
+        return texts
+    finally:
+        pdf_file.close()
+
+@metrics.stage('text_layer')
+def text_layer_pages(file_path, page_numbers=None, min_chars=None, page_min_chars=None):
+    """
+    Page texts for the text-layer fast path, or None when the file should be
+    sent as images: the fast path is off, the file is not a PDF, a selected
+    page has no text layer (less than page_min_chars, default
+    PDF_TEXT_PAGE_MIN_CHARS, e.g. a scanned page), or the pages average less
+    than min_chars (default PDF_TEXT_MIN_CHARS). Short continuation or
+    totals pages of a long digital document still take the fast path.
+
+    Returns:
+        list or None: One text per selected page.
+    """
+    if not PDF_TEXT_FAST_PATH or os.path.splitext(file_path)[1].lower() != '.pdf':
+        return None
+    min_chars = PDF_TEXT_MIN_CHARS if min_chars is None else min_chars
+    page_min_chars = PDF_TEXT_PAGE_MIN_CHARS if page_min_chars is None else page_min_chars
+    texts = read_pdf_text(file_path, page_numbers)
+    counts = [len(re.sub(r'\s', '', text)) for text in texts]
+    usable = bool(counts) and min(counts) >= page_min_chars and sum(counts) >= min_chars * len(counts)
+    metrics.TEXT_FAST_PATH.inc(result='text' if usable else 'images')
+    return texts if usable else None
+
+def select_pages(file_path, page_range=None, max_pages=None, first_page_only=False):
+    """
+    Page selection for any uploaded file; images always have a single page.
+
+    Returns:
+        list or None: 0-based page numbers to render, or None for every page.
+    """
+    if os.path.splitext(file_path)[1].lower() != '.pdf':
+        return None
+    if first_page_only:
+        return None if count_pdf_pages(file_path) == 1 else [0]
+    return select_pdf_pages(file_path, page_range, max_pages)
+
+def perceptual_hash(image):
+    """
+    64-bit DCT perceptual hash (pHash) of a PIL image as 16 hex digits. Images
+    that look alike (rescaled, recompressed, re-exported) differ in few bits.
+    """
+    image = image.convert('L').resize((PHASH_DCT_SIZE, PHASH_DCT_SIZE), Image.Resampling.LANCZOS)
+    pixels = list(image.getdata())
+    rows = [pixels[y * PHASH_DCT_SIZE:(y + 1) * PHASH_DCT_SIZE] for y in range(PHASH_DCT_SIZE)]
+    # Separable 2D DCT-II, keeping only the 8x8 lowest frequencies
+    row_dct = [[sum(p * c for p, c in zip(row, _PHASH_COS[u])) for u in range(8)] for row in rows]
+    coefficients = [
+        sum(row_dct[y][u] * _PHASH_COS[v][y] for y in range(PHASH_DCT_SIZE))
+        for v in range(8) for u in range(8)
+    ]
+    # The DC term only encodes overall brightness, leave it out of the median
+    median = sorted(coefficients[1:])[len(coefficients) // 2 - 1]
+    bits = 0
+    for coefficient in coefficients:
+        bits = (bits << 1) | (coefficient > median)
+    return f'{bits:016x}'
+
+def detail_hash(image):
+    """
+    512-bit difference hash (dHash) of a PIL image as 128 hex digits, taken
+    over the page cropped to its content. Unlike the 64-bit pHash, which only
+    sees a receipt's overall layout, it follows individual lines of text, so
+    two receipts with the same layout differ in many bits.
+    """
+    image = image.convert('L')
+    content = ImageOps.invert(image).point(lambda p: 255 if p > DETAIL_HASH_INK_LEVEL else 0).getbbox()
+    if content:
+        image = image.crop(content)
+    image = image.resize((DETAIL_HASH_WIDTH + 1, DETAIL_HASH_HEIGHT), Image.Resampling.LANCZOS)
+    pixels = image.tobytes()
+    bits = 0
+    for y in range(DETAIL_HASH_HEIGHT):
+        row = pixels[y * (DETAIL_HASH_WIDTH + 1):(y + 1) * (DETAIL_HASH_WIDTH + 1)]
+        for x in range(DETAIL_HASH_WIDTH):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return f'{bits:0{DETAIL_HASH_WIDTH * DETAIL_HASH_HEIGHT // 4}x}'
+
+def file_image_hashes(file, file_name=None):
+    """
+    pHash and detail hash of the first page of a PDF or of an image file,
+    both taken from one small grayscale render.
+
+    Args:
+        file: Path or binary file object.
+        file_name: Name used to tell PDFs from images, defaults to the path.
+
+    Returns:
+        tuple: (perceptual hash, detail hash), or (None, None) if the file can't be rendered.
+    """
+    file_name = file_name or file
+    try:
+        if file_name.lower().endswith('.pdf'):
+            pdf_file = pdfium.PdfDocument(file)
+            try:
+                page = pdf_file[0]
+                scale = min(1, PHASH_RENDER_SIZE / max(page.get_size()))
+                image = page.render(scale=scale, grayscale=True).to_pil()
+            finally:
+                pdf_file.close()
+        else:
+            with Image.open(file) as img:
+                img.draft('L', (PHASH_RENDER_SIZE, PHASH_RENDER_SIZE))
+                image = ImageOps.exif_transpose(img).convert('L')
+        return perceptual_hash(image), detail_hash(image)
+    except Exception:
+        return None, None
+
+def iter_image_pages(file_path, profile=None):
+    """Yield an image file as a single page of encoded image bytes."""
+    with Image.open(file_path) as img:
+        yield encode_page(img, profile)
+
+def page_extension(page):
+    return 'webp' if page[8:12] == b'WEBP' else 'jpg'
 
-            max_dimension = 1536  
-            if image.width > max_dimension or image.height > max_dimension:
-                ratio = min(max_dimension/image.width,
-                            max_dimension/image.height)
-                new_size = (int(image.width * ratio),
-                            int(image.height * ratio))
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
+def page_mime_type(page):
+    return 'image/webp' if page_extension(page) == 'webp' else 'image/jpeg'
 
-            # Optimize JPEG quality
-            image.save(image_byte_array, format='JPEG',
-                       quality=95,  
-                       optimize=True)
-            image_byte_array = image_byte_array.getvalue()
+def write_pages(pages, output_dir):
+    """Write encoded pages to output_dir as 1.jpg..N.jpg (or .webp)."""
+    os.makedirs(output_dir, exist_ok=True)
+    for i, page in enumerate(pages):
+        with open(os.path.join(output_dir, f"{i+1}.{page_extension(page)}"), 'wb') as f:
+            f.write(page)
 
-            image_path = os.path.join('images', file_id, f"{i+1}.jpg")
-            Image.open(BytesIO(image_byte_array)).save(image_path)
+def load_pages(images_path, num_pages, extension='jpg'):
+    """Read back pages written by write_pages."""
+    pages = []
+    for page in range(1, num_pages + 1):
+        with open(os.path.join(images_path, f"{page}.{extension}"), 'rb') as image_file:
+            pages.append(image_file.read())
+    return pages
 
-        return f'images/{file_id}', num_pages 
+def convert_pdf_to_images(file_path, output_dir=None, profile=None, workers=None, page_numbers=None):
+    """
+    Render the pages of a PDF to encoded image bytes in memory. Long documents
+    are split into page ranges rendered in parallel by a process pool.
 
-def prepare_prompt(prompt, images_path, num_images):
+    Args:
+        file_path: Path of the PDF.
+        output_dir: If given, the pages are also written there as 1.jpg..N.jpg.
+        profile: Encoding profile name or dict, defaults to RENDER_PROFILE.
+        workers: Render processes to use, defaults to RENDER_WORKERS (<= 1 renders serially).
+        page_numbers: 0-based pages to render (see select_pages), defaults to every page.
+
+    Returns:
+        list: Encoded image bytes, one entry per rendered page.
+    """
+    profile = get_encoding_profile(profile)
+    workers = RENDER_WORKERS if workers is None else workers
+    if page_numbers is None and workers > 1:
+        page_numbers = list(range(count_pdf_pages(file_path)))
+    if workers > 1 and len(page_numbers) >= RENDER_PARALLEL_MIN_PAGES:
+        futures = [
+            get_render_pool(workers).submit(render_pdf_pages, file_path, page_numbers[start:stop], profile)
+            for start, stop in split_page_ranges(len(page_numbers), workers)
+        ]
+        pages = [page for future in futures for page in future.result()]
+    else:
+        pages = list(iter_pdf_pages(file_path, profile, page_numbers=page_numbers))
+    if output_dir:
+        write_pages(pages, output_dir)
+    return pages
+
+@metrics.stage('prompt')
+def prepare_prompt(prompt, pages):
     prompt_with_images = [
         {'type': 'text', 'text': prompt},
     ]
-    for page in range(1, num_images + 1):
-        image_path = f"{images_path}/{page}.jpg"
-        with open(image_path, 'rb') as image_file:
-            image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
-            prompt_with_images.append({'type': 'image_url', 'image_url': {'url': f'data:image/jpeg;base64,{image_base64}'}})
+    for page in pages:
+        image_base64 = base64.b64encode(page).decode('utf-8')
+        prompt_with_images.append({'type': 'image_url', 'image_url': {'url': f'data:{page_mime_type(page)};base64,{image_base64}'}})
+    payload_bytes = sum(len(part['image_url']['url']) for part in prompt_with_images[1:])
+    metrics.PROMPT_BYTES.observe(payload_bytes)
+    metrics.record('prompt_bytes', payload_bytes)
     prompt_format = [
         {"role": "system", "content": "You're an expert in analyzing receipts and extracting data from them."},
         {"role": "user", "content": prompt_with_images}
     ]
     return prompt_format
 
-def pre_processing_data(file_path, file_id):
-    ext = os.path.splitext(file_path)[1].lower()
-    image_exts = ['.jpg', '.jpeg', '.png']
+@metrics.stage('prompt')
+def prepare_text_prompt(prompt, page_texts):
+    """Text-only counterpart of prepare_prompt: the page texts follow the prompt."""
+    sections = [f'--- Page {i + 1} ---\n{text}' for i, text in enumerate(page_texts)]
+    metrics.record('prompt_text_chars', sum(len(section) for section in sections))
+    return [
+        {"role": "system", "content": "You're an expert in analyzing receipts and extracting data from them."},
+        {"role": "user", "content": '\n\n'.join([prompt, *sections])},
+    ]
+
+@contextmanager
+def file_lock(lock_path):
+    """Hold an exclusive, cross-process lock on lock_path for the duration of the block."""
+    with open(lock_path, 'a+b') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_render_manifest():
+    try:
+        with open(RENDER_CACHE_MANIFEST) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_render_manifest(manifest):
+    temp_path = f'{RENDER_CACHE_MANIFEST}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, RENDER_CACHE_MANIFEST)
+
+def evict_render_cache(manifest, keep_key=None):
+    """Drop least recently used renders until the cache fits RENDER_CACHE_MAX_BYTES."""
+    total_size = sum(entry['size'] for entry in manifest.values())
+    for key in sorted(manifest, key=lambda k: manifest[k]['last_used']):
+        if total_size <= RENDER_CACHE_MAX_BYTES:
+            break
+        if key == keep_key:
+            continue
+        shutil.rmtree(sharded_path(RENDER_CACHE_DIR, key), ignore_errors=True)
+        total_size -= manifest.pop(key)['size']
+
+def sharded_path(root, name):
+    """root/ab/cd/<name> for a name starting with a hex digest, keeping directories small."""
+    return os.path.join(root, name[:2], name[2:4], name)
+
+def render_cache_key(file_hash, render_params):
+    params_digest = hashlib.sha256(json.dumps(render_params, sort_keys=True).encode()).hexdigest()
+    return f'{file_hash}-{params_digest[:16]}'
 
+def render_pages(file_path, ext, profile=None, page_numbers=None):
     if ext == '.pdf':
-        images_path, num_images = convert_pdf_to_images(file_path, file_id)
-    elif ext in image_exts:
-        os.makedirs(f'images/{file_id}', exist_ok=True)
-        dest_path = os.path.join('images', file_id, '1.jpg')
-        with Image.open(file_path) as img:
-            rgb_img = img.convert('RGB')
-            rgb_img.save(dest_path, format='JPEG', quality=95, optimize=True)
-        images_path = f'images/{file_id}'
-        num_images = 1
-
-    return images_path, num_images
+        return convert_pdf_to_images(file_path, profile=profile, page_numbers=page_numbers)
+    return list(iter_image_pages(file_path, profile))
+
+@metrics.stage('render')
+def pre_processing_data(file_path, file_hash=None, use_cache=True, profile=None, page_numbers=None):
+    """
+    Render a PDF/image into encoded page JPEGs. Renders are kept on disk under
+    images/ab/cd/<key>/ as a side output, and a cached render of the same content and
+    render parameters is reused instead of rasterizing again.
+
+    Args:
+        file_path: Path of the uploaded file.
+        file_hash: SHA-256 of the file content, computed from the file if not given.
+        use_cache: Set to False to render purely in memory.
+        profile: Encoding profile name or dict, defaults to RENDER_PROFILE.
+        page_numbers: 0-based PDF pages to render (see select_pages), defaults to every page.
+
+    Returns:
+        list: Encoded JPEG bytes, one entry per rendered page.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    profile = get_encoding_profile(profile)
+    if not use_cache:
+        return count_pages(render_pages(file_path, ext, profile, page_numbers))
+
+    file_hash = file_hash or generate_file_hash_from_path(file_path)
+    render_params = {'ext': ext, **profile}
+    if page_numbers is not None:
+        render_params['pages'] = list(page_numbers)
+    key = render_cache_key(file_hash, render_params)
+    images_path = sharded_path(RENDER_CACHE_DIR, key)
+    os.makedirs(os.path.dirname(images_path), exist_ok=True)
+
+    with file_lock(RENDER_CACHE_LOCK):
+        manifest = load_render_manifest()
+        entry = manifest.get(key)
+        if entry and os.path.isdir(images_path):
+            entry['last_used'] = time.time()
+            save_render_manifest(manifest)
+            metrics.RENDER_CACHE.inc(result='hit')
+            return count_pages(load_pages(images_path, entry['num_pages'], entry.get('extension', 'jpg')))
+
+    metrics.RENDER_CACHE.inc(result='miss')
+    pages = render_pages(file_path, ext, profile, page_numbers)
+
+    # Write into a private directory, then publish it atomically
+    temp_path = f'{images_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        write_pages(pages, temp_path)
+        try:
+            os.replace(temp_path, images_path)
+        except OSError:
+            # Another worker published the same render first
+            pass
+    finally:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+    with file_lock(RENDER_CACHE_LOCK):
+        manifest = load_render_manifest()
+        manifest[key] = {
+            'file_hash': file_hash,
+            'num_pages': len(pages),
+            'extension': page_extension(pages[0]) if pages else 'jpg',
+            'size': sum(len(page) for page in pages),
+            'last_used': time.time(),
+        }
+        evict_render_cache(manifest, keep_key=key)
+        save_render_manifest(manifest)
+
+    return count_pages(pages)
+
+def count_pages(pages):
+    metrics.PAGES.observe(len(pages))
+    metrics.record('pages', len(pages))
+    return pages
 
 def create_openai_client():
     client = OpenAI(
         base_url=os.getenv('OPENAI_BASE_URL'),
-        api_key=os.getenv('OPENAI_API_KEY')
+        api_key=os.getenv('OPENAI_API_KEY'),
+        timeout=LLM_TIMEOUT,
+        # Retries are handled by call_llm so they can back off with jitter
+        max_retries=0,
         )
     return client
 
-def extract_receipt_data(file_path, file_id):
+def get_openai_client():
+    """
+    Return the process-wide client, creating it on first use. Reusing one client
+    reuses its HTTP connection pool, so calls skip the TCP/TLS handshake.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        # A forked worker must not share its parent's sockets
+        if _client is None or _client_pid != os.getpid():
+            _client = create_openai_client()
+            _client_pid = os.getpid()
+        return _client
+
+def is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+def retry_delay(attempt, error=None):
+    """Exponential backoff with full jitter, honouring Retry-After when the provider sends one."""
+    if isinstance(error, openai.APIStatusError):
+        retry_after = error.response.headers.get('retry-after')
+        try:
+            return min(float(retry_after), LLM_RETRY_MAX_DELAY)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+def llm_error(error):
+    return {'error': str(error), 'status_code': getattr(error, 'status_code', None)}
+
+@contextmanager
+def llm_lane(lane):
+    """Run the LLM calls made inside the block in the given priority lane."""
+    if lane not in LLM_LANES:
+        raise ValueError(f'Unknown LLM lane: {lane}')
+    token = _llm_lane.set(lane)
+    try:
+        yield
+    finally:
+        _llm_lane.reset(token)
+
+def estimate_image_tokens(data_url):
+    try:
+        image_bytes = base64.b64decode(data_url.split(',', 1)[1])
+        with Image.open(BytesIO(image_bytes)) as img:
+            width, height = img.size
+    except Exception:
+        width = height = LLM_IMAGE_TILE_SIZE
+    tiles = math.ceil(width / LLM_IMAGE_TILE_SIZE) * math.ceil(height / LLM_IMAGE_TILE_SIZE)
+    return tiles * LLM_IMAGE_TILE_TOKENS
+
+def estimate_tokens(messages):
+    """Rough prompt + completion token count of a chat request, for rate limiting."""
+    tokens = LLM_EXPECTED_OUTPUT_TOKENS
+    for message in messages:
+        content = message['content']
+        parts = [{'type': 'text', 'text': content}] if isinstance(content, str) else content
+        for part in parts:
+            if part['type'] == 'text':
+                tokens += len(part['text']) // 4 + 1
+            elif part['type'] == 'image_url':
+                tokens += estimate_image_tokens(part['image_url']['url'])
+    return tokens
+
+def load_rate_limit_state(now):
+    try:
+        with open(LLM_RATE_LIMIT_STATE) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {'requests': LLM_RPM, 'tokens': LLM_TPM, 'updated': now, 'waiters': {}}
+    # Refill both buckets for the time since the last update, up to one minute's worth
+    elapsed = max(0, now - state['updated'])
+    state['requests'] = min(LLM_RPM, state['requests'] + LLM_RPM * elapsed / 60)
+    state['tokens'] = min(LLM_TPM, state['tokens'] + LLM_TPM * elapsed / 60)
+    state['updated'] = now
+    state['waiters'] = {k: w for k, w in state['waiters'].items() if w['expires'] > now}
+    return state
+
+def save_rate_limit_state(state):
+    temp_path = f'{LLM_RATE_LIMIT_STATE}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_path, LLM_RATE_LIMIT_STATE)
+
+def try_acquire_rate_limit(tokens, lane, waiter_id):
+    """
+    Take one request and `tokens` tokens from the shared buckets if possible.
+
+    Returns:
+        float: 0 if acquired, otherwise seconds until it may succeed.
+    """
+    now = time.time()
+    with file_lock(f'{LLM_RATE_LIMIT_STATE}.lock'):
+        state = load_rate_limit_state(now)
+        reserve = LLM_BULK_RESERVE if lane == 'bulk' else 0
+        need_requests = min(1 + reserve * LLM_RPM, LLM_RPM) if LLM_RPM else 0
+        need_tokens = min(tokens + reserve * LLM_TPM, LLM_TPM) if LLM_TPM else 0
+        interactive_waiting = any(
+            w['lane'] == 'interactive' for k, w in state['waiters'].items() if k != waiter_id
+        )
+        if lane == 'bulk' and interactive_waiting:
+            wait = 0.5
+        else:
+            wait = max(
+                (need_requests - state['requests']) * 60 / LLM_RPM if LLM_RPM else 0,
+                (need_tokens - state['tokens']) * 60 / LLM_TPM if LLM_TPM else 0,
+                0,
+            )
+        if wait == 0:
+            state['requests'] -= 1 if LLM_RPM else 0
+            state['tokens'] -= tokens if LLM_TPM else 0
+            state['waiters'].pop(waiter_id, None)
+        else:
+            # Advertise the wait so bulk callers in other processes step aside
+            state['waiters'][waiter_id] = {'lane': lane, 'expires': now + min(wait, 1) + 2}
+        save_rate_limit_state(state)
+    return wait
+
+def rate_limit_enabled():
+    return bool(LLM_RPM or LLM_TPM)
+
+def rate_limit_waiter(tokens):
+    """The (tokens, lane, waiter id, deadline) one call waits with."""
+    if LLM_TPM:
+        tokens = min(tokens, LLM_TPM)
+    waiter_id = f'{os.getpid()}-{uuid.uuid4().hex}'
+    return tokens, _llm_lane.get(), waiter_id, time.monotonic() + LLM_RATE_LIMIT_MAX_WAIT
+
+def rate_limit_delay(wait):
+    return min(wait, 1.0) * random.uniform(0.8, 1.2)
+
+def rate_limit_wait(tokens):
+    """
+    Sleep until the call may go out. After LLM_RATE_LIMIT_MAX_WAIT the call
+    is let through and the provider's 429s are left to the retry loop.
+    """
+    if not rate_limit_enabled():
+        return
+    tokens, lane, waiter_id, deadline = rate_limit_waiter(tokens)
+    while True:
+        wait = try_acquire_rate_limit(tokens, lane, waiter_id)
+        if wait == 0 or time.monotonic() >= deadline:
+            return
+        time.sleep(rate_limit_delay(wait))
+
+async def arate_limit_wait(tokens):
+    """Async variant of rate_limit_wait; the file-locked attempts run in a worker thread."""
+    if not rate_limit_enabled():
+        return
+    tokens, lane, waiter_id, deadline = rate_limit_waiter(tokens)
+    while True:
+        wait = await asyncio.to_thread(try_acquire_rate_limit, tokens, lane, waiter_id)
+        if wait == 0 or time.monotonic() >= deadline:
+            return
+        await asyncio.sleep(rate_limit_delay(wait))
+
+def settle_rate_limit(estimated_tokens, response):
+    """Correct the token bucket by the difference between the estimate and the reported usage."""
+    usage = getattr(response, 'usage', None)
+    if not LLM_TPM or usage is None or not usage.total_tokens:
+        return
+    with file_lock(f'{LLM_RATE_LIMIT_STATE}.lock'):
+        state = load_rate_limit_state(time.time())
+        state['tokens'] = min(LLM_TPM, state['tokens'] + min(estimated_tokens, LLM_TPM) - usage.total_tokens)
+        save_rate_limit_state(state)
+
+def llm_outcome(error):
+    """Short label for a failed attempt: the HTTP status, or the error class."""
+    status_code = getattr(error, 'status_code', None)
+    return str(status_code) if status_code else type(error).__name__
+
+def record_llm_usage(response):
+    """Count a successful attempt and the tokens it reported in response.usage."""
+    metrics.LLM_REQUESTS.inc(outcome='ok')
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+        value = getattr(usage, kind, None) or 0
+        metrics.LLM_TOKENS.inc(value, kind=kind.removesuffix('_tokens'))
+        metrics.record(kind, value)
+
+def call_llm(messages):
+    """
+    Send a chat completion on the shared client, retrying rate limits, 5xx and
+    connection errors. At most LLM_MAX_CONCURRENCY calls run at once per process,
+    and every attempt first waits for the shared LLM_RPM/LLM_TPM budget.
+
+    Returns:
+        str: The JSON content of the response, or a dict with 'error' and 'status_code'.
+    """
+    client = get_openai_client()
+    tokens = estimate_tokens(messages) if rate_limit_enabled() else 0
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            with metrics.stage('rate_limit_wait'):
+                rate_limit_wait(tokens)
+            with _llm_semaphore, metrics.stage('llm'):
+                response = client.chat.completions.create(
+                    model=os.getenv('LLM_MODEL'),
+                    messages=messages,
+                    response_format={"type": "json_object"},
+                )
+            settle_rate_limit(tokens, response)
+            record_llm_usage(response)
+            return response.choices[0].message.content
+        except openai.OpenAIError as e:
+            metrics.LLM_REQUESTS.inc(outcome=llm_outcome(e))
+            if attempt == LLM_MAX_RETRIES or not is_retryable(e):
+                return llm_error(e)
+            time.sleep(retry_delay(attempt, e))
+
+def get_async_openai_client():
+    """
+    Return the AsyncOpenAI client for the running event loop. Async HTTP
+    connections belong to the loop that opened them, so each loop gets its own.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = AsyncOpenAI(
+            base_url=os.getenv('OPENAI_BASE_URL'),
+            api_key=os.getenv('OPENAI_API_KEY'),
+            timeout=LLM_TIMEOUT,
+            max_retries=0,
+        )
+        _async_semaphores[loop] = asyncio.Semaphore(LLM_MAX_ASYNC_CONCURRENCY)
+    return _async_clients[loop]
+
+async def acall_llm(messages):
+    """Async variant of call_llm, limited to LLM_MAX_ASYNC_CONCURRENCY calls per event loop."""
+    client = get_async_openai_client()
+    semaphore = _async_semaphores[asyncio.get_running_loop()]
+    tokens = await asyncio.to_thread(estimate_tokens, messages) if rate_limit_enabled() else 0
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            with metrics.stage('rate_limit_wait'):
+                await arate_limit_wait(tokens)
+            async with semaphore:
+                with metrics.stage('llm'):
+                    response = await client.chat.completions.create(
+                        model=os.getenv('LLM_MODEL'),
+                        messages=messages,
+                        response_format={"type": "json_object"},
+                    )
+            if LLM_TPM:
+                await asyncio.to_thread(settle_rate_limit, tokens, response)
+            record_llm_usage(response)
+            return response.choices[0].message.content
+        except openai.OpenAIError as e:
+            metrics.LLM_REQUESTS.inc(outcome=llm_outcome(e))
+            if attempt == LLM_MAX_RETRIES or not is_retryable(e):
+                return llm_error(e)
+            await asyncio.sleep(retry_delay(attempt, e))
+
+def extract_receipt_data(file_path, file_hash=None, profile=None, page_numbers=None, page_texts=None):
+    """
+    Extract receipt data from the page images, or from page_texts (see
+    text_layer_pages) with the text-only prompt when they are given.
+    """
+    if page_texts:
+        return call_llm(prepare_text_prompt(RECEIPT_EXTRACT_TEXT_PROMPT, page_texts))
     ext = os.path.splitext(file_path)[1].lower()
     image_exts = ['.jpg', '.jpeg', '.png']
     if ext == '.pdf' or ext in image_exts:
-        images_path, num_images = pre_processing_data(file_path, file_id)
+        pages = pre_processing_data(file_path, file_hash, profile=profile, page_numbers=page_numbers)
     else:
         return {}, "Unsupported file type"
-    client = create_openai_client()
 
-    prompt = prepare_prompt(RECEIPT_EXTRACT_PROMPT, images_path, num_images)
-    try:
-        response = client.chat.completions.create(
-            model=os.getenv('LLM_MODEL'),
-            messages=[prompt],
-            response_format={"type": "json_object"},
-        )
-        return response.choices[0].message.content
-    except openai.error.OpenAIError as e:
-        return {'error': str(e), 'status_code': e.http_status}
-
-def classify_receipt_or_not(file_path, file_id):
-    images_path, num_images = pre_processing_data(file_path, str(file_id))
-    prompt = prepare_prompt(CLASSIFICATION_PROMPT, images_path, num_images)
-    
-    client = create_openai_client()
-    try:
-        response = client.chat.completions.create(
-            model=os.getenv('LLM_MODEL'),
-            messages=[prompt],
-            response_format={"type": "json_object"},
-        )
-        return response.choices[0].message.content
-    except openai.error.OpenAIError as e:
-        return {'error': str(e), 'status_code': e.http_status}
+    prompt = prepare_prompt(RECEIPT_EXTRACT_PROMPT, pages)
+    return call_llm(prompt)
+
+def classify_receipt_or_not(file_path, file_hash=None, profile=None, page_numbers=None):
+    pages = pre_processing_data(file_path, file_hash, profile=profile, page_numbers=page_numbers)
+    prompt = prepare_prompt(CLASSIFICATION_PROMPT, pages)
+    return call_llm(prompt)
+
+def classify_and_extract_receipt_data(file_path, file_hash=None, profile=None, page_numbers=None):
+    """Classify and extract in a single LLM call, sending the page images once."""
+    pages = pre_processing_data(file_path, file_hash, profile=profile, page_numbers=page_numbers)
+    prompt = prepare_prompt(CLASSIFY_AND_EXTRACT_PROMPT, pages)
+    return call_llm(prompt)
+
+async def aextract_receipt_data(file_path, file_hash=None, profile=None, page_numbers=None, page_texts=None):
+    """Async variant of extract_receipt_data; rendering runs in a worker thread."""
+    if page_texts:
+        return await acall_llm(prepare_text_prompt(RECEIPT_EXTRACT_TEXT_PROMPT, page_texts))
+    ext = os.path.splitext(file_path)[1].lower()
+    image_exts = ['.jpg', '.jpeg', '.png']
+    if ext == '.pdf' or ext in image_exts:
+        pages = await asyncio.to_thread(pre_processing_data, file_path, file_hash, profile=profile, page_numbers=page_numbers)
+    else:
+        return {}, "Unsupported file type"
+
+    prompt = await asyncio.to_thread(prepare_prompt, RECEIPT_EXTRACT_PROMPT, pages)
+    return await acall_llm(prompt)
+
+async def aclassify_receipt_or_not(file_path, file_hash=None, profile=None, page_numbers=None):
+    """Async variant of classify_receipt_or_not; rendering runs in a worker thread."""
+    pages = await asyncio.to_thread(pre_processing_data, file_path, file_hash, profile=profile, page_numbers=page_numbers)
+    prompt = await asyncio.to_thread(prepare_prompt, CLASSIFICATION_PROMPT, pages)
+    return await acall_llm(prompt)
 
 def generate_file_hash_from_content(file_content):
     """Generate SHA-256 hash from file content"""
     hash_sha256 = hashlib.sha256()
     hash_sha256.update(file_content)
-    return hash_sha256.hexdigest()
\ No newline at end of file
+    return hash_sha256.hexdigest()
+
+def generate_file_hash_from_path(file_path):
+    """Generate SHA-256 hash of a file on disk without loading it into memory"""
+    hash_sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter_file_chunks(f):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+def iter_file_chunks(file_obj, chunk_size=64 * 1024):
+    """Yield chunks from a plain (non-Django) file-like object."""
+    return iter(lambda: file_obj.read(chunk_size), b"")
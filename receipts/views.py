@@ -1,15 +1,24 @@
-from django.shortcuts import get_object_or_404
+from django.shortcuts import get_object_or_404, aget_object_or_404
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from django.urls import reverse
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.exceptions import ValidationError
 
-import os, json
+import hashlib, os, zipfile
 from datetime import datetime
 
-from receipts.models import ReceiptMetaData, Receipt, LineItem
-from receipts.serializers import ReceiptMetaDataSerializer, ReceiptDataSerializer
-from receipts import utils
+from receipts.models import ReceiptMetaData, Receipt, ReceiptJob
+from receipts.serializers import ReceiptMetaDataSerializer, ReceiptDataSerializer, ReceiptJobSerializer
+from receipts.pagination import KeysetPagination
+from receipts.storage import FileTooLarge, get_receipt_storage, delete_unreferenced
+from receipts.upload_handlers import StorageUploadHandler, StoredUploadedFile, store_chunks
+from receipts import utils, services, jobs, llm_cache, exports, queries, dedupe, metrics
 
 ACCEPTED_FORMATS = ['.png', '.pdf', '.jpg', '.jpeg']
 
@@ -18,104 +27,323 @@ class UploadReceiptView(APIView):
 
     def post(self, request, *args, **kwargs):
         """
-        Create a new receipt meta data entry, and save the file to disk
-        in 'uploads/' directory. Checks for duplicates using file hash.
+        Create a new receipt meta data entry, and save the file to the
+        content-addressed receipt storage. Checks for duplicates using file hash,
+        and with duplicate_strategy=near also for near duplicates using the
+        perceptual hash of the first page.
 
         Returns:
             Response: A JSON response with the new receipt meta data entry or duplicate info.
         """
+        # The file is hashed and written to storage while the request is parsed
+        request.upload_handlers = [
+            StorageUploadHandler(request, ACCEPTED_FORMATS, limit_request=True),
+            *request.upload_handlers,
+        ]
         file_obj = request.FILES.get('file')
         if not file_obj:
             return Response({'error': 'Attach PDF or Image please'})
         if not file_obj.name.lower().endswith(tuple(ACCEPTED_FORMATS)):
             return Response({'error': f'Not a Valid format - Supported Formats: {str(ACCEPTED_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Read file content and generate hash
-        file_content = file_obj.read()
-        file_hash = utils.generate_file_hash_from_content(file_content)
+        file_hash = file_obj.file_hash
+        duplicate_strategy = request.query_params.get('duplicate_strategy', 'reject')
         
         # Check for existing file with same hash
         existing_receipt = ReceiptMetaData.objects.filter(file_hash=file_hash).first()
         if existing_receipt:
-            duplicate_strategy = request.query_params.get('duplicate_strategy', 'reject')
-            
-            if duplicate_strategy == 'reject':
+            if duplicate_strategy in ('reject', 'near'):
                 return Response({
                     'error': 'Duplicate file detected',
-                    'duplicate_info': {
-                        'existing_id': existing_receipt.id,
-                        'existing_file_name': existing_receipt.file_name,
-                        'uploaded_at': existing_receipt.created_at.isoformat(),
-                        'is_processed': existing_receipt.is_processed,
-                        'is_valid': existing_receipt.is_valid
-                    },
+                    'duplicate_info': dedupe.duplicate_info(existing_receipt),
                     'message': 'Use duplicate_strategy=update to update existing receipt or duplicate_strategy=ignore to create new entry'
                 }, status=status.HTTP_409_CONFLICT)
             
             elif duplicate_strategy == 'update':
-                # Update existing receipt metadata
+                # The content is unchanged, so the stored blob is reused as-is
                 existing_receipt.file_name = file_obj.name
+                existing_receipt.file_path = file_obj.path
                 existing_receipt.updated_at = datetime.now()
                 existing_receipt.save()
                 
-                # Update the file on disk
-                os.makedirs('uploads', exist_ok=True)
-                file_path = os.path.join('uploads', f'file-{existing_receipt.id}_{file_obj.name}')
-                with open(file_path, 'wb+') as f:
-                    f.write(file_content)
-                existing_receipt.file_path = file_path
-                existing_receipt.save()
-                
                 serializer = ReceiptMetaDataSerializer(existing_receipt)
                 return Response({
                     'message': 'Existing receipt updated successfully',
                     'receipt': serializer.data
                 }, status=status.HTTP_200_OK)
         
-        # Create new receipt metadata
-        receipt_meta = ReceiptMetaData.objects.create(file_name=file_obj.name, file_hash=file_hash)
+        perceptual_hash, detail_hash = utils.file_image_hashes(file_obj.path)
+        if duplicate_strategy == 'near' and perceptual_hash:
+            near_duplicates = dedupe.find_near_duplicates(perceptual_hash, detail_hash=detail_hash)
+            if near_duplicates:
+                if file_obj.is_new:
+                    delete_unreferenced(get_receipt_storage(), [file_obj.storage_name])
+                return Response({
+                    'error': 'Near-duplicate file detected',
+                    'near_duplicates': [dedupe.duplicate_info(*match) for match in near_duplicates],
+                    'message': 'Upload without duplicate_strategy=near to store it anyway'
+                }, status=status.HTTP_409_CONFLICT)
         
-        # Save file to disk in 'uploads/' directory
-        os.makedirs('uploads', exist_ok=True)
-        file_path = os.path.join('uploads', f'file-{receipt_meta.id}_{file_obj.name}')
-        with open(file_path, 'wb+') as f:
-            f.write(file_content)
-        receipt_meta.file_path = file_path
+        # Create new receipt metadata
+        receipt_meta = ReceiptMetaData(file_name=file_obj.name, file_path=file_obj.path, file_hash=file_hash)
+        receipt_meta.set_perceptual_hash(perceptual_hash, detail_hash)
         receipt_meta.save()
         
         serializer = ReceiptMetaDataSerializer(receipt_meta)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+class BatchUploadReceiptView(APIView):
+    parser_classes = (MultiPartParser, FormParser)
+
+    def iter_uploaded_files(self, request, storage):
+        """
+        Yield (file name, (storage name, file hash, is new), error) for every
+        receipt in the request. Plain files were already stored by
+        StorageUploadHandler while the request was parsed; ZIP archives are
+        expanded and their receipt members streamed into storage one by one.
+        """
+        for file_obj in request.FILES.getlist('files') + request.FILES.getlist('file'):
+            if isinstance(file_obj, StoredUploadedFile):
+                yield file_obj.name, (file_obj.storage_name, file_obj.file_hash, file_obj.is_new), None
+            elif file_obj.name.lower().endswith('.zip'):
+                with zipfile.ZipFile(file_obj) as archive:
+                    for member in archive.infolist():
+                        name = os.path.basename(member.filename)
+                        if member.is_dir() or not name:
+                            continue
+                        if not name.lower().endswith(tuple(ACCEPTED_FORMATS)):
+                            yield name, None, f'Not a Valid format - Supported Formats: {str(ACCEPTED_FORMATS)}'
+                            continue
+                        with archive.open(member) as member_file:
+                            try:
+                                yield name, store_chunks(
+                                    storage, utils.iter_file_chunks(member_file), os.path.splitext(name)[1],
+                                    settings.RECEIPT_UPLOAD_MAX_BYTES
+                                ), None
+                            except FileTooLarge as e:
+                                yield name, None, str(e)
+            else:
+                yield file_obj.name, None, f'Not a Valid format - Supported Formats: {str(ACCEPTED_FORMATS)}'
+
+    def create_receipt_metas(self, staged, duplicates):
+        """
+        Insert metadata rows for the staged files that aren't stored yet, in one
+        transaction. Files that match an existing receipt are added to
+        duplicates instead; they share its blob. Image hashes are computed
+        while staging, so the transaction (and SQLite's write lock) only
+        covers the lookup and the insert.
+
+        Returns:
+            list: The created ReceiptMetaData rows.
+        """
+        with transaction.atomic():
+            existing = ReceiptMetaData.objects.filter(file_hash__in=list(staged)).only(
+                'id', 'file_name', 'file_hash', 'created_at', 'is_processed', 'is_valid'
+            )
+            for existing_receipt in existing:
+                file_name, _, _ = staged.pop(existing_receipt.file_hash)
+                duplicates.append({'file_name': file_name, **dedupe.duplicate_info(existing_receipt)})
+
+            receipt_metas = []
+            for file_hash, (file_name, file_path, image_hashes) in staged.items():
+                receipt_meta = ReceiptMetaData(file_name=file_name, file_path=file_path, file_hash=file_hash)
+                receipt_meta.set_perceptual_hash(*image_hashes)
+                receipt_metas.append(receipt_meta)
+            return ReceiptMetaData.objects.bulk_create(receipt_metas)
+
+    def post(self, request, *args, **kwargs):
+        """
+        Upload many receipts at once, either as several 'files' fields or as
+        ZIP archives. Each file is hashed while it is streamed into storage, all
+        hashes are checked against existing receipts in one query and the new
+        metadata rows are inserted with bulk_create. Duplicates are skipped.
+        If the insert fails, blobs this request stored are deleted again
+        unless another receipt uses them.
+
+        Returns:
+            Response: A JSON response with the created entries, skipped duplicates and rejected files.
+        """
+        request.upload_handlers = [StorageUploadHandler(request, ACCEPTED_FORMATS), *request.upload_handlers]
+        if not request.FILES:
+            return Response({'error': 'Attach PDFs, Images or ZIP archives please'}, status=status.HTTP_400_BAD_REQUEST)
+
+        storage = get_receipt_storage()
+        staged, new_blobs, duplicates, errors = {}, [], [], []
+        try:
+            for file_name, stored, error in self.iter_uploaded_files(request, storage):
+                if error:
+                    errors.append({'file_name': file_name, 'error': error})
+                    continue
+                name, file_hash, is_new = stored
+                if is_new:
+                    new_blobs.append(name)
+                if file_hash in staged:
+                    duplicates.append({'file_name': file_name, 'duplicate_of': staged[file_hash][0]})
+                    continue
+                file_path = storage.path(name)
+                staged[file_hash] = (file_name, file_path, utils.file_image_hashes(file_path))
+        except zipfile.BadZipFile:
+            delete_unreferenced(storage, new_blobs)
+            return Response({'error': 'Invalid ZIP archive'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            created = self.create_receipt_metas(staged, duplicates)
+        except IntegrityError:
+            # A concurrent upload inserted one of these files first; nothing was saved
+            delete_unreferenced(storage, new_blobs)
+            return Response({'error': 'Some of these files were uploaded concurrently, retry the upload'}, status=status.HTTP_409_CONFLICT)
+        except Exception:
+            delete_unreferenced(storage, new_blobs)
+            raise
+
+        serializer = ReceiptMetaDataSerializer(created, many=True)
+        return Response({
+            'created': serializer.data,
+            'duplicates': duplicates,
+            'errors': errors,
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+class CheckDuplicateView(APIView):
+    parser_classes = (MultiPartParser, FormParser)
+
+    def get_max_distance(self, params):
+        try:
+            return int(params.get('max_distance', settings.NEAR_DUPLICATE_MAX_DISTANCE))
+        except ValueError:
+            raise ValidationError({'error': 'max_distance must be an integer'})
+
+    def lookup(self, file_hash, perceptual_hash, max_distance, detail_hash=None):
+        """Look up exact (file hash) and near (perceptual hash) duplicates in the indexes."""
+        exact = ReceiptMetaData.objects.filter(file_hash=file_hash).first() if file_hash else None
+        near = dedupe.find_near_duplicates(perceptual_hash, max_distance, detail_hash=detail_hash) if perceptual_hash else []
+        return Response({
+            'file_hash': file_hash,
+            'perceptual_hash': perceptual_hash,
+            'detail_hash': detail_hash,
+            'is_duplicate': bool(exact or near),
+            'exact_duplicate': dedupe.duplicate_info(exact) if exact else None,
+            'near_duplicates': [dedupe.duplicate_info(*match) for match in near],
+        }, status=status.HTTP_200_OK)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Check precomputed hashes against the stored receipts without uploading
+        anything. Pass file_hash (SHA-256) and/or perceptual_hash (16 hex digits),
+        optionally with detail_hash (128 hex digits) to confirm near duplicates.
+
+        Returns:
+            Response: The exact duplicate, if any, and near duplicates closest first.
+        """
+        file_hash = request.query_params.get('file_hash')
+        perceptual_hash = request.query_params.get('perceptual_hash')
+        if not file_hash and not perceptual_hash:
+            return Response({'error': 'Provide file_hash and/or perceptual_hash'}, status=status.HTTP_400_BAD_REQUEST)
+        if perceptual_hash:
+            try:
+                if len(perceptual_hash) != 16:
+                    raise ValueError
+                int(perceptual_hash, 16)
+            except ValueError:
+                return Response({'error': 'perceptual_hash must be 16 hex digits'}, status=status.HTTP_400_BAD_REQUEST)
+            perceptual_hash = perceptual_hash.lower()
+        detail_hash = request.query_params.get('detail_hash')
+        if detail_hash:
+            try:
+                if len(detail_hash) != 128:
+                    raise ValueError
+                int(detail_hash, 16)
+            except ValueError:
+                return Response({'error': 'detail_hash must be 128 hex digits'}, status=status.HTTP_400_BAD_REQUEST)
+            detail_hash = detail_hash.lower()
+        return self.lookup(file_hash, perceptual_hash, self.get_max_distance(request.query_params), detail_hash)
+
+    def post(self, request, *args, **kwargs):
+        """
+        Hash an uploaded file and check it against the stored receipts. The
+        file itself is not stored.
+
+        Returns:
+            Response: The computed hashes, the exact duplicate if any, and near duplicates.
+        """
+        file_obj = request.FILES.get('file')
+        if not file_obj:
+            return Response({'error': 'Attach PDF or Image please'}, status=status.HTTP_400_BAD_REQUEST)
+        if not file_obj.name.lower().endswith(tuple(ACCEPTED_FORMATS)):
+            return Response({'error': f'Not a Valid format - Supported Formats: {str(ACCEPTED_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+        hash_sha256 = hashlib.sha256()
+        for chunk in file_obj.chunks():
+            hash_sha256.update(chunk)
+        file_obj.seek(0)
+        perceptual_hash, detail_hash = utils.file_image_hashes(file_obj, file_obj.name)
+        return self.lookup(hash_sha256.hexdigest(), perceptual_hash, self.get_max_distance(request.query_params), detail_hash)
+
+def is_truthy(value):
+    return (value or '').lower() in ('1', 'true', 'yes')
+
+def wants_async(request):
+    return is_truthy(request.query_params.get('async'))
+
+def wants_cache_bypass(request):
+    return is_truthy(request.GET.get('bypass_cache'))
+
+def get_page_selection(request):
+    """
+    Parse the `pages` (1-based range such as 1-3,7) and `max_pages` query
+    parameters into keyword arguments for the services. The range itself is
+    checked against the document by the service.
+    """
+    selection = {}
+    if request.GET.get('pages'):
+        selection['page_range'] = request.GET['pages']
+    max_pages = request.GET.get('max_pages')
+    if max_pages:
+        if not max_pages.isdigit():
+            raise ValidationError({'error': 'max_pages must be a non-negative integer (0 = no limit)'})
+        selection['max_pages'] = int(max_pages)
+    return selection
+
+def get_requested_fields(request, allowed_fields):
+    """Parse the `fields` query parameter, defaulting to every allowed field."""
+    fields = request.query_params.get('fields')
+    if not fields:
+        return list(allowed_fields)
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = set(fields) - set(allowed_fields)
+    if unknown:
+        raise ValidationError({'error': f'Unknown fields: {sorted(unknown)}'})
+    return fields
+
+def job_accepted_response(request, job):
+    return Response({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': request.build_absolute_uri(reverse('job-status', args=[job.id])),
+    }, status=status.HTTP_202_ACCEPTED)
+
 class ValidateReceiptView(APIView):
     def get(self, request, receipt_id, *args, **kwargs):
         """
         Validate a receipt by checking if it is a receipt or not.
+        With ?async=true the work is queued and a job id is returned instead.
 
         Returns:
             Response: A JSON response with the updated receipt meta data entry.
         """
         receipt_meta = get_object_or_404(ReceiptMetaData, id=receipt_id)
-        file_path, file_id = receipt_meta.file_path, receipt_id
-        receipt_or_not = utils.classify_receipt_or_not(file_path, file_id)
-        if 'error' in receipt_or_not:
-            return Response(receipt_or_not)
-        else:
-            receipt_or_not = json.loads(receipt_or_not).get('receipt_or_not')
-        if receipt_or_not == 'yes':
-            receipt_meta.is_valid = True
-            receipt_meta.invalid_reason = ''
-        else:
-            receipt_meta.is_valid = False
-            receipt_meta.invalid_reason = 'Not a Receipt'
-        receipt_meta.save()
-        serializer = ReceiptMetaDataSerializer(receipt_meta)
-        return Response(serializer.data)
+        page_selection = get_page_selection(request)
+        if wants_async(request):
+            job = jobs.enqueue_job('validate', receipt_meta, bypass_cache=wants_cache_bypass(request), **page_selection)
+            return job_accepted_response(request, job)
+        data, status_code = services.validate_receipt(receipt_meta, bypass_cache=wants_cache_bypass(request),
+                                                      **page_selection)
+        return Response(data, status=status_code)
 
 class ProcessReceiptView(APIView):
     def get(self, request, receipt_id, *args, **kwargs):
         """
         Process a receipt by extracting data from it and saving the extracted data.
-        Handles duplicate processing scenarios.
+        Handles duplicate processing scenarios. With ?async=true the work is
+        queued and a job id is returned instead.
 
         Args:
             request: The request object.
@@ -124,83 +352,213 @@ class ProcessReceiptView(APIView):
         Returns:
             Response: A JSON response with the extracted data.
         """
-        # Check if receipt has already been processed
-        receipt_data = Receipt.objects.filter(receipt_file=receipt_id)
-        receipt_data_serializer = ReceiptDataSerializer(receipt_data, many=True)
-        
-        if receipt_data:
-            duplicate_strategy = request.query_params.get('duplicate_strategy', 'return_existing')
-            
-            if duplicate_strategy == 'return_existing':
-                return Response({
-                    'message': 'Receipt already processed',
-                    'receipt': receipt_data_serializer.data
-                }, status=status.HTTP_200_OK)
-            
-            elif duplicate_strategy == 'reprocess':
-                # Delete existing receipt data and reprocess
-                receipt_data.delete()
-                # Continue with processing below
-            else:
-                return Response({
-                    'error': 'Receipt already processed',
-                    'existing_data': receipt_data_serializer.data,
-                    'message': 'Use duplicate_strategy=reprocess to reprocess or duplicate_strategy=return_existing to return existing data'
-                }, status=status.HTTP_409_CONFLICT)
-        
         receipt_meta = get_object_or_404(ReceiptMetaData, id=receipt_id)
-        if not receipt_meta.is_valid:
-            return Response({'error': f'Not a Valid Receipt - Reason :- {receipt_meta.invalid_reason}'}, status=status.HTTP_400_BAD_REQUEST)
-    
-        file_path = receipt_meta.file_path
-        if not file_path or not os.path.exists(file_path):
-            return Response({'error': 'File not found for this receipt.'}, status=status.HTTP_404_NOT_FOUND)
-    
+        duplicate_strategy = request.query_params.get('duplicate_strategy', 'return_existing')
+        page_selection = get_page_selection(request)
+        if wants_async(request):
+            job = jobs.enqueue_job('process', receipt_meta, duplicate_strategy=duplicate_strategy,
+                                   bypass_cache=wants_cache_bypass(request), **page_selection)
+            return job_accepted_response(request, job)
+        data, status_code = services.process_receipt(receipt_meta, duplicate_strategy,
+                                                     bypass_cache=wants_cache_bypass(request), **page_selection)
+        return Response(data, status=status_code)
+
+class AnalyzeReceiptView(APIView):
+    def get(self, request, receipt_id, *args, **kwargs):
+        """
+        Validate and process a receipt in one LLM round trip. Stores the
+        is_valid verdict and, for receipts, the extracted data. Accepts the
+        same duplicate_strategy and async parameters as ProcessReceiptView.
+
+        Args:
+            request: The request object.
+            receipt_id: The id of the receipt to be analyzed.
+
+        Returns:
+            Response: A JSON response with the receipt meta data and the extracted data.
+        """
+        receipt_meta = get_object_or_404(ReceiptMetaData, id=receipt_id)
+        duplicate_strategy = request.query_params.get('duplicate_strategy', 'return_existing')
+        page_selection = get_page_selection(request)
+        if wants_async(request):
+            job = jobs.enqueue_job('analyze', receipt_meta, duplicate_strategy=duplicate_strategy,
+                                   bypass_cache=wants_cache_bypass(request), **page_selection)
+            return job_accepted_response(request, job)
+        data, status_code = services.analyze_receipt(receipt_meta, duplicate_strategy,
+                                                     bypass_cache=wants_cache_bypass(request), **page_selection)
+        return Response(data, status=status_code)
+
+class AsyncValidateReceiptView(View):
+    async def get(self, request, receipt_id, *args, **kwargs):
+        """
+        Async variant of ValidateReceiptView for ASGI deployments: the LLM call
+        is awaited, so one process can keep many validations in flight.
+
+        Returns:
+            JsonResponse: The updated receipt meta data entry.
+        """
+        receipt_meta = await aget_object_or_404(ReceiptMetaData, id=receipt_id)
         try:
-            extracted_result = utils.extract_receipt_data(file_path, str(receipt_meta.id))
-            if isinstance(extracted_result, tuple):
-                return Response({'error': extracted_result[1]}, status=status.HTTP_400_BAD_REQUEST)
-            extracted_data = json.loads(extracted_result)
-        except Exception as e:
-            return Response({'error': f'Extraction failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        if not extracted_data:
-            return Response({'error': 'No data extracted from receipt.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        receipt = Receipt.objects.create(
-            merchant_name=extracted_data.get('merchant_name'),
-            total_amount=extracted_data.get('total_amount'),
-            currency=extracted_data.get('currency'),
-            payment_method=extracted_data.get('payment_method'),
-            category=extracted_data.get('category'),
-            purchased_at=extracted_data.get('purchased_at'),
-            receipt_file=receipt_meta,
-        )
-        line_items = extracted_data.get('line_items') or []
-        for item in line_items:
-            LineItem.objects.create(
-                description=item.get('description'),
-                quantity=item.get('quantity'),
-                unit_price=item.get('unit_price'),
-                total=item.get('total'),
-                receipt=receipt
-            )
-        receipt_meta.updated_at = datetime.now()
-        receipt_meta.is_processed = True
-        receipt_meta.save()
-        serializer = ReceiptDataSerializer(receipt)
+            page_selection = get_page_selection(request)
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        data, status_code = await services.avalidate_receipt(receipt_meta, bypass_cache=wants_cache_bypass(request),
+                                                             **page_selection)
+        return JsonResponse(data, status=status_code)
+
+class AsyncProcessReceiptView(View):
+    async def get(self, request, receipt_id, *args, **kwargs):
+        """
+        Async variant of ProcessReceiptView for ASGI deployments. Accepts the
+        same duplicate_strategy query parameter.
+
+        Returns:
+            JsonResponse: The extracted data.
+        """
+        receipt_meta = await aget_object_or_404(ReceiptMetaData, id=receipt_id)
+        duplicate_strategy = request.GET.get('duplicate_strategy', 'return_existing')
+        try:
+            page_selection = get_page_selection(request)
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        data, status_code = await services.aprocess_receipt(receipt_meta, duplicate_strategy,
+                                                            bypass_cache=wants_cache_bypass(request), **page_selection)
+        return JsonResponse(data, status=status_code)
+
+class LLMCacheStatsView(APIView):
+    def get(self, request, *args, **kwargs):
+        """
+        Returns the LLM response cache size and hit/miss counters.
+
+        Returns:
+            Response: A JSON response with the cache statistics.
+        """
+        return Response(llm_cache.stats())
+
+class MetricsView(View):
+    def get(self, request, *args, **kwargs):
+        """
+        Stage latencies, payload sizes, token usage and query counts of this
+        process in the Prometheus text format.
+
+        Returns:
+            HttpResponse: The metrics as text/plain.
+        """
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class JobStatusView(APIView):
+    def get(self, request, job_id, *args, **kwargs):
+        """
+        Retrieve the status, and once finished the result, of a queued job.
+
+        Args:
+            request: The request object.
+            job_id: The id returned when the job was queued.
+
+        Returns:
+            Response: A JSON response with the job state.
+        """
+        job = get_object_or_404(ReceiptJob, id=job_id)
+        serializer = ReceiptJobSerializer(job)
         return Response(serializer.data)
     
 class ListReceiptsView(APIView):
     def get(self, request, *args, **kwargs):
         """
-        Returns a list of all receipts.
+        Returns a page of receipts using keyset (cursor) pagination.
+
+        Query Parameters:
+            limit: Page size (default 100, max 1000).
+            ordering: id, -id, purchased_at or -purchased_at (default id).
+            cursor: The next_cursor value from the previous page.
+            fields: Comma separated list of fields to return.
+            merchant_name, category, currency: Exact match filters.
+            purchased_from, purchased_to: ISO 8601 date or datetime bounds on purchased_at.
 
         Returns:
-            Response: A JSON response containing a list of receipts.
+            Response: A JSON response with the receipts and the cursor of the next page.
         """
-        receipts = Receipt.objects.all()
-        serializer = ReceiptDataSerializer(receipts, many=True)
-        return Response(serializer.data)
+        fields = get_requested_fields(request, ReceiptDataSerializer.Meta.fields)
+        receipts = queries.filter_receipts(Receipt.objects.all(), request.query_params)
+        receipts = ReceiptDataSerializer.setup_eager_loading(receipts, fields)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(receipts, request)
+        serializer = ReceiptDataSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
+
+class IngestReceiptsView(APIView):
+    def post(self, request, *args, **kwargs):
+        """
+        Save extraction results for many receipts in a single transaction.
+        Existing receipt data for those files is replaced.
+
+        Request body:
+            {"results": [{"receipt_meta_id": 1, "data": {...extracted receipt...}}, ...]}
+
+        Returns:
+            Response: A JSON response with the saved receipts and any rejected items.
+        """
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Request body must be a JSON object with a "results" list'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        data, status_code = services.ingest_results(request.data.get('results'))
+        return Response(data, status=status_code)
+
+class AggregateReceiptsView(APIView):
+    def get(self, request, *args, **kwargs):
+        """
+        Count receipts and sum total_amount per group, computed by the database.
+
+        Query Parameters:
+            group_by: Comma separated list of category, merchant_name, currency
+                and month (default: category,currency).
+            merchant_name, category, currency, purchased_from, purchased_to:
+                Same filters as the receipt list.
+
+        Returns:
+            Response: A JSON response with one entry per group.
+        """
+        group_by = [field.strip() for field in request.query_params.get('group_by', 'category,currency').split(',') if field.strip()]
+        receipts = queries.filter_receipts(Receipt.objects.all(), request.query_params)
+        return Response({
+            'group_by': group_by,
+            'results': queries.aggregate_receipts(receipts, group_by),
+        })
+
+class ExportReceiptsView(View):
+    def get(self, request, *args, **kwargs):
+        """
+        Stream every receipt with its line items as NDJSON or CSV. Rows are read
+        with a chunked iterator, so memory stays flat and the first bytes are
+        sent right away.
+
+        Query Parameters:
+            format: ndjson (default) or csv.
+            since: ISO 8601 watermark; only receipts updated at or after it are exported.
+            chunk_size: Rows fetched from the database per round trip (default 2000).
+
+        Returns:
+            StreamingHttpResponse: The export, ordered by updated_at.
+        """
+        export_format = request.GET.get('format', 'ndjson')
+        if export_format not in exports.EXPORT_FORMATS:
+            return JsonResponse({'error': f'format must be one of {list(exports.EXPORT_FORMATS)}'}, status=400)
+        since = request.GET.get('since')
+        if since:
+            since = exports.parse_since(since)
+            if since is None:
+                return JsonResponse({'error': 'since must be an ISO 8601 datetime'}, status=400)
+        chunk_size = request.GET.get('chunk_size', '2000')
+        if not chunk_size.isdigit() or int(chunk_size) == 0:
+            return JsonResponse({'error': 'chunk_size must be a positive integer'}, status=400)
+        chunk_size = int(chunk_size)
+
+        response = StreamingHttpResponse(
+            exports.iter_export(export_format, since, chunk_size),
+            content_type=exports.EXPORT_FORMATS[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="receipts.{export_format}"'
+        return response
 
 class ReceiptDetailView(APIView):
     def get(self, request, id, *args, **kwargs):